@@ -16,9 +16,11 @@ try:
     db = client.climateFitAi  
     users_collection = db.users
     discounts_collection = db.discounts  # Added discounts collection
+    voucher_assignments_collection = db.voucher_assignments  # One document per (username, code)
     payments_collection = db.payments  # Added payments collection
     carts_collection = db.carts  # Added carts collection
     order_collection = db.orders  # Added orders collection
+    idempotency_collection = db.idempotency_keys  # Stored responses for Idempotency-Key retries
 except Exception as e:
     print(f"MongoDB connection failed: {e}")
     raise
\ No newline at end of file
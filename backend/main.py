@@ -115,8 +115,10 @@ except ImportError as e:
     print(f"Warning: discounts module not found, skipping discount routes: {e}")
 
 try:
-    from routes.payments import router as payments_router
+    from routes.payments import router as payments_router, payment_queue
     app.include_router(payments_router, prefix="/api/v1", tags=["payments"])
+    # Start payment workers and the recovery sweep without waiting for a new payment
+    app.add_event_handler("startup", payment_queue.start)
 except ImportError as e:
     print(f"Warning: payments module not found, skipping payments routes: {e}")
 
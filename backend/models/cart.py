@@ -1,4 +1,4 @@
-from pydantic import BaseModel, validator
+from pydantic import BaseModel, validator, root_validator
 from datetime import datetime
 from typing import Optional, List
 from enum import Enum
@@ -59,6 +59,57 @@ class CartItemUpdate(BaseModel):
             raise ValueError('Quantity cannot exceed 50 items')
         return v
 
+class CartOperationType(str, Enum):
+    ADD = "add"
+    UPDATE = "update"
+    REMOVE = "remove"
+
+class CartBatchOperation(BaseModel):
+    op: CartOperationType
+    product_id: str
+    # add: the full line; update: new quantity/size/color; remove: the line's size/color
+    product_name: Optional[str] = None
+    brand: Optional[str] = None
+    unit_price: Optional[float] = None
+    quantity: Optional[int] = None
+    size: Optional[str] = None
+    color: Optional[str] = None
+    image_url: Optional[str] = None
+    # update only: which line to change, as in PUT /cart/item/{product_id}
+    old_size: Optional[str] = None
+    old_color: Optional[str] = None
+
+    @validator('quantity')
+    def validate_quantity(cls, v):
+        if v is not None and (v <= 0 or v > 50):
+            raise ValueError('Quantity must be between 1 and 50')
+        return v
+
+    @root_validator(skip_on_failure=True)
+    def validate_operation_fields(cls, values):
+        op = values.get('op')
+        if op == CartOperationType.ADD:
+            if not values.get('product_name') or not values.get('brand') or values.get('unit_price') is None:
+                raise ValueError('add operations require product_name, brand and unit_price')
+            if values.get('unit_price') < 0:
+                raise ValueError('Unit price cannot be negative')
+            if values.get('quantity') is None:
+                values['quantity'] = 1
+        elif op == CartOperationType.UPDATE and values.get('quantity') is None:
+            raise ValueError('update operations require quantity')
+        return values
+
+class CartBatchRequest(BaseModel):
+    operations: List[CartBatchOperation]
+
+    @validator('operations')
+    def validate_operations(cls, v):
+        if not v:
+            raise ValueError('At least one operation is required')
+        if len(v) > 100:
+            raise ValueError('Cannot apply more than 100 operations at once')
+        return v
+
 class Cart(BaseModel):
     cart_id: str
     user_id: str
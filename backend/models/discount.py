@@ -56,5 +56,4 @@ class Discount(BaseModel):
     expires_at: Optional[datetime] = None
     usage_limit: Optional[int] = None
     used_count: int = 0
-    user_assignments: Optional[List[dict]] = []
     voucher_type: VoucherType = VoucherType.CLOTHES
@@ -1,4 +1,5 @@
-from pymongo import MongoClient
+from pymongo import MongoClient, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from datetime import datetime
 from typing import Optional, List, Dict, Any
 import os
@@ -7,6 +8,7 @@ import asyncio
 import logging
 import re
 from dotenv import load_dotenv
+from services.rollup_service import record_seller_signup
 
 # Load environment variables
 load_dotenv()
@@ -30,6 +32,9 @@ class MongoDBConnection:
             self.db = self.client.climateFitAi  # Match your database name from .env
             self.products_collection = self.db.products
             self.sellers_collection = self.db.sellers
+            self.analysis_cache_collection = self.db.ai_analysis_cache
+            self.ingestion_jobs_collection = self.db.ingestion_jobs
+            self.ingestion_checkpoints_collection = self.db.ingestion_checkpoints
             
             # Test connection
             self.client.admin.command('ismaster')
@@ -47,6 +52,39 @@ class ProductModel:
         self.collection = db_connection.products_collection
         self.db = db_connection.db
         self.sellers_collection = db_connection.sellers_collection
+        try:
+            # Lets an ingestion job re-flush a batch without duplicating products
+            self.collection.create_index(
+                "ingestion_source",
+                unique=True,
+                partialFilterExpression={"ingestion_source": {"$type": "string"}}
+            )
+        except Exception as e:
+            logger.warning(f"Could not create product ingestion index: {str(e)}")
+    
+    @staticmethod
+    def _build_product_document(product_data: Dict[str, Any], seller_id: str) -> Dict[str, Any]:
+        """
+        Build a product document with proper data types
+        """
+        return {
+            "name": str(product_data.get("name", "Unknown Product")),
+            "description": str(product_data.get("description", "")),
+            "category": str(product_data.get("category", "General")),
+            "price_php": float(product_data.get("price_php", 0)),
+            "sizes_available": product_data.get("sizes_available", []),
+            "quantity": int(product_data.get("quantity", 0)),
+            "color": str(product_data.get("color", "")),
+            "material": str(product_data.get("material", "")),
+            "style": str(product_data.get("style", "")),
+            "season": str(product_data.get("season", "")),
+            "gender": str(product_data.get("gender", "")),
+            "brand_style": str(product_data.get("brand_style", "")),
+            "image_path": str(product_data.get("image_path", "")),
+            "seller_id": str(seller_id),
+            "created_at": datetime.utcnow(),
+            "is_active": True
+        }
     
     async def create_product(self, product_data: Dict[str, Any], seller_id: str) -> str:
         """
@@ -54,25 +92,7 @@ class ProductModel:
         """
         def _create_product():
             try:
-                # Ensure proper data types
-                product_document = {
-                    "name": str(product_data.get("name", "Unknown Product")),
-                    "description": str(product_data.get("description", "")),
-                    "category": str(product_data.get("category", "General")),
-                    "price_php": float(product_data.get("price_php", 0)),
-                    "sizes_available": product_data.get("sizes_available", []),
-                    "quantity": int(product_data.get("quantity", 0)),
-                    "color": str(product_data.get("color", "")),
-                    "material": str(product_data.get("material", "")),
-                    "style": str(product_data.get("style", "")),
-                    "season": str(product_data.get("season", "")),
-                    "gender": str(product_data.get("gender", "")),
-                    "brand_style": str(product_data.get("brand_style", "")),
-                    "image_path": str(product_data.get("image_path", "")),
-                    "seller_id": str(seller_id),
-                    "created_at": datetime.utcnow(),
-                    "is_active": True
-                }
+                product_document = self._build_product_document(product_data, seller_id)
                 
                 result = self.collection.insert_one(product_document)
                 logger.info(f"Created product with ID: {result.inserted_id}")
@@ -83,6 +103,79 @@ class ProductModel:
         
         return await asyncio.get_event_loop().run_in_executor(None, _create_product)
     
+    async def create_products_bulk(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        Insert many products in one round trip.
+        Each entry needs "product_data" and "seller_id"; returns one result per entry,
+        in order, with either "product_id" or "error".
+        Entries with an "ingestion_source" key are upserted on it, so writing the
+        same entry again returns the existing product instead of a duplicate.
+        """
+        def _create_products_bulk():
+            if not products:
+                return []
+            
+            documents = []
+            operations = []
+            for entry in products:
+                document = self._build_product_document(entry["product_data"], entry["seller_id"])
+                document["_id"] = ObjectId()
+                source = entry.get("ingestion_source")
+                if source:
+                    document["ingestion_source"] = source
+                    operations.append(UpdateOne({"ingestion_source": source}, {"$setOnInsert": document}, upsert=True))
+                else:
+                    operations.append(InsertOne(document))
+                documents.append(document)
+            
+            try:
+                outcome = self.collection.bulk_write(operations, ordered=False).bulk_api_result
+            except BulkWriteError as e:
+                outcome = e.details
+            except Exception as e:
+                logger.error(f"Error creating products in bulk: {str(e)}")
+                return [{"error": f"Failed to create product: {str(e)}"} for _ in documents]
+            
+            failed = {}
+            for write_error in outcome.get("writeErrors", []):
+                index = write_error["index"]
+                # A duplicate key on an upsert means another writer inserted the same source first
+                if write_error.get("code") == 11000 and documents[index].get("ingestion_source"):
+                    continue
+                failed[index] = write_error.get("errmsg", "Insert failed")
+            
+            # Keyed entries that were not inserted by this call already exist; use their ids
+            upserted = {upsert["index"] for upsert in outcome.get("upserted", [])}
+            existing_sources = [
+                document["ingestion_source"]
+                for index, document in enumerate(documents)
+                if document.get("ingestion_source") and index not in upserted and index not in failed
+            ]
+            existing_ids = {}
+            if existing_sources:
+                existing_ids = {
+                    product["ingestion_source"]: product["_id"]
+                    for product in self.collection.find({"ingestion_source": {"$in": existing_sources}}, {"ingestion_source": 1})
+                }
+            
+            results = []
+            for index, document in enumerate(documents):
+                if index in failed:
+                    results.append({"error": f"Failed to create product: {failed[index]}"})
+                elif document.get("ingestion_source") and index not in upserted:
+                    product_id = existing_ids.get(document["ingestion_source"])
+                    if product_id is None:
+                        results.append({"error": "Failed to create product: upserted product not found"})
+                    else:
+                        results.append({"product_id": str(product_id)})
+                else:
+                    results.append({"product_id": str(document["_id"])})
+            
+            logger.info(f"Bulk created {len(upserted) + outcome.get('nInserted', 0)} products ({len(existing_ids)} already present, {len(failed)} failed)")
+            return results
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _create_products_bulk)
+    
     async def get_product_by_id(self, product_id: str) -> Optional[Dict[str, Any]]:
         """
         Get product by ID
@@ -958,6 +1051,7 @@ class SellerModel:
                 
                 result = self.collection.insert_one(seller_document)
                 logger.info(f"Created seller with ID: {result.inserted_id}")
+                record_seller_signup(self.db, seller_document["created_at"])
                 return str(result.inserted_id)
             except Exception as e:
                 logger.error(f"Error creating seller: {str(e)}")
@@ -997,6 +1091,30 @@ class SellerModel:
         
         await asyncio.get_event_loop().run_in_executor(None, _update_seller)
 
+    async def update_sellers_products_bulk(self, seller_categories: Dict[str, List[str]]):
+        """
+        Add product categories to many sellers in a single bulk write
+        """
+        def _update_sellers_bulk():
+            operations = [
+                UpdateOne(
+                    {"_id": ObjectId(seller_id)},
+                    {"$addToSet": {"specializes_in": {"$each": list(categories)}}}
+                )
+                for seller_id, categories in seller_categories.items()
+                if categories
+            ]
+            if not operations:
+                return
+            try:
+                self.collection.bulk_write(operations, ordered=False)
+                logger.info(f"Updated product categories for {len(operations)} sellers")
+            except Exception as e:
+                logger.error(f"Error updating sellers in bulk: {str(e)}")
+                raise Exception(f"Failed to update sellers: {str(e)}")
+        
+        await asyncio.get_event_loop().run_in_executor(None, _update_sellers_bulk)
+
     async def get_all_sellers(self) -> List[Dict[str, Any]]:
         """
         Retrieve all sellers from the database.
@@ -1172,3 +1290,189 @@ class CommentModel:
                 return 0
         
         return await asyncio.get_event_loop().run_in_executor(None, _get_count)
+
+class AnalysisCacheModel:
+    def __init__(self, db_connection: MongoDBConnection):
+        self.collection = db_connection.analysis_cache_collection
+        self.db = db_connection.db
+        try:
+            self.collection.create_index([("image_hash", 1), ("prompt_version", 1)], unique=True)
+        except Exception as e:
+            logger.warning(f"Could not create analysis cache index: {str(e)}")
+    
+    async def get_analysis(self, image_hash: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached AI analysis for an image hash and prompt version
+        """
+        def _get_analysis():
+            entry = self.collection.find_one(
+                {"image_hash": image_hash, "prompt_version": prompt_version},
+                {"ai_data": 1}
+            )
+            return entry.get("ai_data") if entry else None
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _get_analysis)
+    
+    async def save_analysis(self, image_hash: str, prompt_version: str, ai_data: Dict[str, Any]):
+        """
+        Store an AI analysis keyed by image hash and prompt version
+        """
+        def _save_analysis():
+            self.collection.update_one(
+                {"image_hash": image_hash, "prompt_version": prompt_version},
+                {
+                    "$set": {"ai_data": ai_data, "updated_at": datetime.utcnow()},
+                    "$setOnInsert": {"created_at": datetime.utcnow()}
+                },
+                upsert=True
+            )
+        
+        await asyncio.get_event_loop().run_in_executor(None, _save_analysis)
+
+class IngestionJobModel:
+    def __init__(self, db_connection: MongoDBConnection):
+        self.collection = db_connection.ingestion_jobs_collection
+        self.checkpoints_collection = db_connection.ingestion_checkpoints_collection
+        self.db = db_connection.db
+        try:
+            self.collection.create_index("job_id", unique=True)
+            self.checkpoints_collection.create_index([("job_id", 1), ("image_path", 1)], unique=True)
+        except Exception as e:
+            logger.warning(f"Could not create ingestion job indexes: {str(e)}")
+    
+    async def create_job(self, job_id: str, folder_path: str, total_images: int) -> Dict[str, Any]:
+        """
+        Create a queued ingestion job
+        """
+        def _create_job():
+            job_document = {
+                "job_id": job_id,
+                "folder_path": folder_path,
+                "status": "queued",
+                "total_images": total_images,
+                "committed_count": 0,
+                "failed_count": 0,
+                "cancel_requested": False,
+                "error": None,
+                "result_summary": None,
+                "created_at": datetime.utcnow(),
+                "updated_at": datetime.utcnow(),
+                "started_at": None,
+                "finished_at": None
+            }
+            self.collection.insert_one(job_document)
+            job_document.pop("_id", None)
+            return job_document
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _create_job)
+    
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get an ingestion job by its job ID
+        """
+        def _get_job():
+            return self.collection.find_one({"job_id": job_id}, {"_id": 0})
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _get_job)
+    
+    async def update_job(self, job_id: str, fields: Dict[str, Any]):
+        """
+        Set fields on an ingestion job
+        """
+        def _update_job():
+            fields["updated_at"] = datetime.utcnow()
+            self.collection.update_one({"job_id": job_id}, {"$set": fields})
+        
+        await asyncio.get_event_loop().run_in_executor(None, _update_job)
+    
+    async def request_cancel(self, job_id: str) -> bool:
+        """
+        Flag a queued or running job for cancellation
+        """
+        def _request_cancel():
+            result = self.collection.update_one(
+                {"job_id": job_id, "status": {"$in": ["queued", "running"]}},
+                {"$set": {"cancel_requested": True, "updated_at": datetime.utcnow()}}
+            )
+            return result.matched_count == 1
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _request_cancel)
+    
+    async def is_cancel_requested(self, job_id: str) -> bool:
+        """
+        Check whether cancellation has been requested for a job
+        """
+        def _is_cancel_requested():
+            job = self.collection.find_one({"job_id": job_id}, {"cancel_requested": 1})
+            return bool(job and job.get("cancel_requested"))
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _is_cancel_requested)
+    
+    async def record_checkpoints(self, job_id: str, committed: List[Dict[str, Any]], failed: List[Dict[str, Any]]):
+        """
+        Persist per-file checkpoints and bump the job's progress counters
+        """
+        def _record_checkpoints():
+            now = datetime.utcnow()
+            operations = []
+            for entry in committed:
+                operations.append(UpdateOne(
+                    {"job_id": job_id, "image_path": entry["image_path"]},
+                    {"$set": {
+                        "status": "committed",
+                        "product_id": entry.get("product_id"),
+                        "error": None,
+                        "updated_at": now
+                    }},
+                    upsert=True
+                ))
+            for entry in failed:
+                operations.append(UpdateOne(
+                    {"job_id": job_id, "image_path": entry["image_path"]},
+                    {"$set": {
+                        "status": "failed",
+                        "error": entry.get("error"),
+                        "updated_at": now
+                    }},
+                    upsert=True
+                ))
+            if not operations:
+                return
+            
+            self.checkpoints_collection.bulk_write(operations, ordered=False)
+            self.collection.update_one(
+                {"job_id": job_id},
+                {
+                    "$inc": {"committed_count": len(committed), "failed_count": len(failed)},
+                    "$set": {"updated_at": now}
+                }
+            )
+        
+        await asyncio.get_event_loop().run_in_executor(None, _record_checkpoints)
+    
+    async def get_committed_paths(self, job_id: str) -> set:
+        """
+        Get the image paths a job has already committed
+        """
+        def _get_committed_paths():
+            checkpoints = self.checkpoints_collection.find(
+                {"job_id": job_id, "status": "committed"},
+                {"image_path": 1, "_id": 0}
+            )
+            return {checkpoint["image_path"] for checkpoint in checkpoints}
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _get_committed_paths)
+    
+    async def get_failed_checkpoints(self, job_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        Get the most recent failed files for a job
+        """
+        def _get_failed_checkpoints():
+            return list(
+                self.checkpoints_collection.find(
+                    {"job_id": job_id, "status": "failed"},
+                    {"_id": 0, "image_path": 1, "error": 1, "updated_at": 1}
+                ).sort("updated_at", -1).limit(limit)
+            )
+        
+        return await asyncio.get_event_loop().run_in_executor(None, _get_failed_checkpoints)
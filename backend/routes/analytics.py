@@ -1,23 +1,69 @@
-from fastapi import APIRouter
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Query, Depends, BackgroundTasks
+from datetime import datetime, timedelta, timezone as dt_timezone
+from typing import Literal
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from models.payment import PaymentStatus
 from connection.database import client
+from routes.auth import verify_admin
+from services.rollup_service import (
+    SIGNUPS, SELLER_SIGNUPS, COMPLETED_REVENUE, COMPLETED_ORDERS, CATEGORY_SALES, SELLER_SALES,
+    ensure_rollup_indexes, rebuild_daily_rollups, rollups_ready,
+    rollup_totals_by_bucket, rollup_totals_by_dimension
+)
 from pymongo import MongoClient
+import logging
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-def generate_date_range(start_date, end_date):
-    current_date = start_date
+try:
+    ensure_rollup_indexes(client.climateFitAi)
+except Exception as e:
+    logger.warning(f"Could not create daily rollup indexes: {str(e)}")
+
+GrowthBucket = Literal["day", "week", "month"]
+SalesBucket = Literal["day", "week", "month", "quarter", "year"]
+
+# $dateTrunc counts binSize bins from 2000-01-01; weeks from the first Monday after it
+BUCKET_REFERENCE_DATE = datetime(2000, 1, 1)
+WEEK_REFERENCE_DATE = datetime(2000, 1, 3)
+MONTHS_PER_BUCKET = {"month": 1, "quarter": 3, "year": 12}
+
+def truncate_date(date: datetime, bucket: str, bin_size: int = 1) -> datetime:
+    """Python equivalent of $dateTrunc on naive wall-clock times (weeks starting Monday)"""
+    date = date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "day":
+        days = (date - BUCKET_REFERENCE_DATE).days
+        return BUCKET_REFERENCE_DATE + timedelta(days=days - days % bin_size)
+    if bucket == "week":
+        weeks = (date - WEEK_REFERENCE_DATE).days // 7
+        return WEEK_REFERENCE_DATE + timedelta(weeks=weeks - weeks % bin_size)
+    months_per_bin = MONTHS_PER_BUCKET[bucket] * bin_size
+    months = (date.year - 2000) * 12 + date.month - 1
+    months -= months % months_per_bin
+    return datetime(2000 + months // 12, months % 12 + 1, 1)
+
+def next_bucket(date: datetime, bucket: str, bin_size: int = 1) -> datetime:
+    if bucket == "day":
+        return date + timedelta(days=bin_size)
+    if bucket == "week":
+        return date + timedelta(weeks=bin_size)
+    months = date.year * 12 + date.month - 1 + MONTHS_PER_BUCKET[bucket] * bin_size
+    return datetime(months // 12, months % 12 + 1, 1)
+
+def generate_bucket_range(start_date: datetime, end_date: datetime, bucket: str, bin_size: int = 1):
+    current_date = truncate_date(start_date, bucket, bin_size)
     while current_date <= end_date:
         yield current_date
-        current_date += timedelta(days=1)
+        current_date = next_bucket(current_date, bucket, bin_size)
 
-@router.get("/analytics/user-seller-growth")
-async def user_seller_growth(filter: str = None, value: str = None):
-    db = client.climateFitAi
-    users_collection = db["users"]
-    sellers_collection = db["sellers"]
+def local_to_utc(date: datetime, tz: ZoneInfo) -> datetime:
+    """Naive wall-clock time in tz to the naive UTC datetime pymongo returns"""
+    return date.replace(tzinfo=tz).astimezone(dt_timezone.utc).replace(tzinfo=None)
 
-    # Determine the date range based on the filter
+def resolve_date_range(filter: str, value: str, default_days: int):
+    """Start and end dates for the dashboard's month/year filters"""
     if filter == "month" and value:
         start_date = datetime.strptime(value, "%B")
         start_date = start_date.replace(year=datetime.now().year)
@@ -27,75 +73,153 @@ async def user_seller_growth(filter: str = None, value: str = None):
         end_date = start_date.replace(month=12, day=31)
     else:
         end_date = datetime.now()
-        start_date = end_date - timedelta(days=30)  # Default to last 30 days
+        start_date = end_date - timedelta(days=default_days)
+    return start_date, end_date
+
+def count_by_bucket(collection, start_date: datetime, end_date: datetime, bucket: str):
+    """Count documents created in [start_date, end_date) per bucket with one aggregation"""
+    results = collection.aggregate([
+        {"$match": {"created_at": {"$gte": start_date, "$lt": end_date}}},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$created_at", "unit": bucket, "startOfWeek": "monday"}},
+            "count": {"$sum": 1}
+        }}
+    ])
+    return {result["_id"]: result["count"] for result in results}
 
-    user_growth = []
-    seller_growth = []
+@router.get("/analytics/user-seller-growth")
+def user_seller_growth(filter: str = None, value: str = None, bucket: GrowthBucket = "day"):
+    # Plain def: pymongo is blocking, so FastAPI runs this in its threadpool
+    db = client.climateFitAi
+    users_collection = db["users"]
+    sellers_collection = db["sellers"]
 
-    for date in generate_date_range(start_date, end_date):
-        next_date = date + timedelta(days=1)
+    # Determine the date range based on the filter (default to last 30 days)
+    start_date, end_date = resolve_date_range(filter, value, 30)
 
-        user_count = users_collection.count_documents({
-            "created_at": {"$gte": date, "$lt": next_date}
-        })
+    # Whole days, matching the previous per-day counts
+    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    range_end = end_date.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    # Read the daily rollups once they have been backfilled, otherwise count raw documents
+    if rollups_ready(db):
+        user_counts = rollup_totals_by_bucket(db, SIGNUPS, start_date, range_end, bucket)
+        seller_counts = rollup_totals_by_bucket(db, SELLER_SIGNUPS, start_date, range_end, bucket)
+    else:
+        user_counts = count_by_bucket(users_collection, start_date, range_end, bucket)
+        seller_counts = count_by_bucket(sellers_collection, start_date, range_end, bucket)
 
-        seller_count = sellers_collection.count_documents({
-            "created_at": {"$gte": date, "$lt": next_date}
-        })
+    user_growth = []
+    seller_growth = []
 
-        user_growth.append({"date": date.strftime("%Y-%m-%d"), "count": user_count})
-        seller_growth.append({"date": date.strftime("%Y-%m-%d"), "count": seller_count})
+    # Zero-fill buckets with no signups
+    for date in generate_bucket_range(start_date, end_date, bucket):
+        label = date.strftime("%Y-%m-%d")
+        user_growth.append({"date": label, "count": user_counts.get(date, 0)})
+        seller_growth.append({"date": label, "count": seller_counts.get(date, 0)})
 
-    return {"user_growth": user_growth, "seller_growth": seller_growth}
+    return {"user_growth": user_growth, "seller_growth": seller_growth, "bucket": bucket}
 
 @router.get("/analytics/monthly-sales")
-async def monthly_sales(filter: str = None, value: str = None):
+def monthly_sales(
+    filter: str = None,
+    value: str = None,
+    bucket: SalesBucket = "month",
+    bin_size: int = Query(1, ge=1, le=366),
+    timezone: str = "UTC"
+):
+    """
+    Completed sales summed per bucket (bin_size days, weeks, months, quarters
+    or years), with bucket boundaries and the date range taken in timezone
+    """
+    try:
+        tz = ZoneInfo(timezone)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Unknown timezone: {timezone}")
+
     db = client.climateFitAi
     payments_collection = db["payments"]
 
-    # Determine the date range based on the filter
-    if filter == "month" and value:
-        start_date = datetime.strptime(value, "%B")
-        start_date = start_date.replace(year=datetime.now().year)
-        end_date = start_date + timedelta(days=31)
-    elif filter == "year" and value:
-        start_date = datetime.strptime(value, "%Y")
-        end_date = start_date.replace(month=12, day=31)
-    else:
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=180)  # Default to last 6 months
+    # Determine the date range based on the filter (default to last 6 months)
+    start_date, end_date = resolve_date_range(filter, value, 180)
+    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    range_end = end_date.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
 
-    monthly_sales = {}
-
-    for date in generate_date_range(start_date, end_date):
-        month_year = date.strftime("%Y-%m")
-        if month_year not in monthly_sales:
-            monthly_sales[month_year] = 0
-
-        next_date = date + timedelta(days=1)
-
-        total_amount = payments_collection.aggregate([
+    # Daily rollups are kept in UTC days, so other time zones aggregate the payments directly
+    if timezone == "UTC" and rollups_ready(db):
+        totals = rollup_totals_by_bucket(db, COMPLETED_REVENUE, start_date, range_end, bucket, bin_size)
+    else:
+        # Statuses are written from the PaymentStatus enum, so an exact match can use
+        # the (payment_status, created_at) index
+        results = payments_collection.aggregate([
             {
                 "$match": {
-                    "payment_status": {"$regex": "^completed$", "$options": "i"},
-                    "created_at": {"$gte": date, "$lt": next_date}
+                    "payment_status": PaymentStatus.COMPLETED.value,
+                    "created_at": {"$gte": local_to_utc(start_date, tz), "$lt": local_to_utc(range_end, tz)}
                 }
             },
             {
                 "$group": {
-                    "_id": None,
+                    "_id": {"$dateTrunc": {
+                        "date": "$created_at",
+                        "unit": bucket,
+                        "binSize": bin_size,
+                        "timezone": timezone,
+                        "startOfWeek": "monday"
+                    }},
                     "total": {"$sum": "$total_amount"}
                 }
             }
         ])
+        totals = {result["_id"]: result["total"] for result in results}
 
-        for result in total_amount:
-            monthly_sales[month_year] += result["total"]
-
-    # Format the data for the frontend
+    # Format the data for the frontend, zero-filling empty buckets
+    label_format = "%Y-%m" if bucket in ("month", "quarter", "year") else "%Y-%m-%d"
     sales_data = [
-        {"month": month, "profit": round(profit, 2)}
-        for month, profit in sorted(monthly_sales.items())
+        {"month": date.strftime(label_format), "profit": round(totals.get(local_to_utc(date, tz), 0), 2)}
+        for date in generate_bucket_range(start_date, end_date, bucket, bin_size)
     ]
 
-    return {"sales_data": sales_data}
+    return {"sales_data": sales_data, "bucket": bucket, "bin_size": bin_size, "timezone": timezone}
+
+@router.get("/analytics/sales-breakdown")
+def sales_breakdown(
+    by: Literal["category", "seller"] = "category",
+    filter: str = None,
+    value: str = None
+):
+    """Completed item sales per category or seller, read from the daily rollups"""
+    db = client.climateFitAi
+    if not rollups_ready(db):
+        raise HTTPException(status_code=503, detail="Sales rollups have not been built yet")
+
+    # Determine the date range based on the filter (default to last 30 days)
+    start_date, end_date = resolve_date_range(filter, value, 30)
+    start_date = start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    range_end = end_date.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(days=1)
+
+    metric = CATEGORY_SALES if by == "category" else SELLER_SALES
+    breakdown = [
+        {by: row["_id"], "sales": round(row["value"], 2), "quantity": row["quantity"]}
+        for row in rollup_totals_by_dimension(db, metric, start_date, range_end)
+    ]
+    orders = rollup_totals_by_dimension(db, COMPLETED_ORDERS, start_date, range_end)
+
+    return {
+        "by": by,
+        "breakdown": breakdown,
+        "total_orders": orders[0]["value"] if orders else 0
+    }
+
+@router.post("/analytics/rollups/rebuild", status_code=202)
+def rebuild_rollups(background_tasks: BackgroundTasks, admin_user: str = Depends(verify_admin)):
+    """Admin job: regenerate the daily rollups from users, sellers and payments"""
+    background_tasks.add_task(run_rollup_rebuild, admin_user)
+    return {"success": True, "message": "Daily rollup rebuild started"}
+
+def run_rollup_rebuild(admin_user: str):
+    try:
+        result = rebuild_daily_rollups(client.climateFitAi)
+        logger.info(f"Daily rollup rebuild requested by {admin_user} finished: {result}")
+    except Exception as e:
+        logger.error(f"Daily rollup rebuild failed: {str(e)}")
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Query, Depends, HTTPException, Body, UploadFile,
 from fastapi.responses import FileResponse
 from pydantic import BaseModel
 from services.image_processing_service import ImageProcessingService
+from services.ingestion_job_service import IngestionJobService
 from typing import Optional, Dict, Any
 import os
 import tempfile
@@ -66,9 +67,10 @@ except ImportError:
 
             
 try:
-    from routes.auth import verify_token
+    from routes.auth import verify_token, invalidate_user_status
 except ImportError:
     def verify_token(): return "placeholder_user"
+    def invalidate_user_status(username: str = None): pass
 
 router = APIRouter()
 
@@ -78,6 +80,7 @@ product_model = ProductModel(db_connection)
 seller_model = SellerModel(db_connection)
 comment_model = CommentModel(db_connection)
 image_service = ImageProcessingService()
+ingestion_job_service = IngestionJobService(image_service)
 
 # Add Pydantic model for folder path request
 class FolderPathRequest(BaseModel):
@@ -566,6 +569,77 @@ async def process_images_folder(
             }
         )
 
+@router.post("/ai/ingestion-jobs", status_code=202)
+async def create_ingestion_job(
+    request: Request,
+    body: Optional[FolderPathRequest] = Body(None),
+    folder_path: Optional[str] = Form(None)
+):
+    """
+    Start a background ingestion job for a folder and return its job ID immediately
+    """
+    path = body.folder_path if body and body.folder_path else folder_path
+    if not path:
+        raise HTTPException(status_code=422, detail="folder_path is required")
+    
+    try:
+        job = await ingestion_job_service.start_job(path)
+    except FileNotFoundError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to start ingestion job: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to start ingestion job: {str(e)}")
+    
+    return {
+        "success": True,
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "total_images": job["total_images"],
+        "status_url": str(request.url_for("get_ingestion_job", job_id=job["job_id"]))
+    }
+
+@router.get("/ai/ingestion-jobs/{job_id}")
+async def get_ingestion_job(job_id: str):
+    """
+    Get progress and status of an ingestion job
+    """
+    job = await ingestion_job_service.get_job_status(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    return {"success": True, "data": job}
+
+@router.post("/ai/ingestion-jobs/{job_id}/cancel")
+async def cancel_ingestion_job(job_id: str):
+    """
+    Cancel a queued or running ingestion job; already committed products are kept
+    """
+    if not await ingestion_job_service.cancel_job(job_id):
+        raise HTTPException(status_code=404, detail="Ingestion job not found or not running")
+    return {"success": True, "message": "Cancellation requested", "job_id": job_id}
+
+@router.post("/ai/ingestion-jobs/{job_id}/resume", status_code=202)
+async def resume_ingestion_job(job_id: str, request: Request):
+    """
+    Resume an interrupted ingestion job, skipping files it already committed
+    """
+    try:
+        job = await ingestion_job_service.resume_job(job_id)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if not job:
+        raise HTTPException(status_code=404, detail="Ingestion job not found")
+    
+    return {
+        "success": True,
+        "job_id": job_id,
+        "status": job["status"],
+        "committed_count": job["committed_count"],
+        "status_url": str(request.url_for("get_ingestion_job", job_id=job_id))
+    }
+
 @router.post("/ai/process-single-image")
 async def process_single_image(
     image: UploadFile = File(...),
@@ -1092,6 +1166,8 @@ async def update_user_is_active(user_id: str, payload: dict):
 
         user_model = user_module.UserModel()
         result = user_model.update_is_active(user_id, is_active)
+        # Status is cached by username; the route only has the ID, so drop all entries
+        invalidate_user_status()
         return result
     except Exception as e:
         logger.error(f"Error updating user is_active status: {str(e)}")
@@ -1,27 +1,71 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, BackgroundTasks
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from connection.database import users_collection
+from connection.database import db, users_collection
 from models.user import UserRegistration, UserLogin, Address
 from passlib.context import CryptContext
 from jose import JWTError, jwt
+from pymongo import ReturnDocument
 from datetime import datetime, timedelta
 from bson import ObjectId
+from concurrent.futures import ThreadPoolExecutor
+from services.auth_cache import TokenCache, UserStatusCache
+from services.voucher_service import grant_welcome_vouchers_in_background
+from services.rollup_service import record_signup
+import asyncio
 import os
-import httpx
-
-router = APIRouter()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-security = HTTPBearer()
 
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 60))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 10000))
+USER_STATUS_CACHE_TTL_SECONDS = float(os.getenv("USER_STATUS_CACHE_TTL_SECONDS", 30))
+
+router = APIRouter()
+# Pinning min/max rounds makes verify_and_update flag hashes created with another cost factor
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS
+)
+security = HTTPBearer()
+token_cache = TokenCache(max_size=TOKEN_CACHE_SIZE)
+user_status_cache = UserStatusCache(ttl_seconds=USER_STATUS_CACHE_TTL_SECONDS)
+
+# bcrypt is CPU bound, so it runs on a small dedicated pool instead of the event loop
+password_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="password-hash")
+password_pool_stats = {"pending": 0, "peak_pending": 0, "completed": 0, "rehashed": 0}
+
+async def _run_password_task(func, *args):
+    password_pool_stats["pending"] += 1
+    password_pool_stats["peak_pending"] = max(password_pool_stats["peak_pending"], password_pool_stats["pending"])
+    try:
+        return await asyncio.get_event_loop().run_in_executor(password_executor, func, *args)
+    finally:
+        password_pool_stats["pending"] -= 1
+        password_pool_stats["completed"] += 1
 
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+async def hash_password(password: str) -> str:
+    return await _run_password_task(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    return await _run_password_task(pwd_context.verify, plain_password, hashed_password)
+
+async def verify_and_update_password(plain_password: str, hashed_password: str):
+    """Verify a password and return a new hash if the stored one uses outdated settings"""
+    return await _run_password_task(pwd_context.verify_and_update, plain_password, hashed_password)
+
+def get_password_pool_stats() -> dict:
+    """Queue depth and throughput of the password hashing pool"""
+    return {
+        **password_pool_stats,
+        "workers": PASSWORD_HASH_WORKERS,
+        "queued": max(0, password_pool_stats["pending"] - PASSWORD_HASH_WORKERS),
+        "bcrypt_rounds": BCRYPT_ROUNDS
+    }
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -30,32 +74,72 @@ def create_access_token(data: dict):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
+def _decode_token(token: str) -> dict:
+    """Return verified claims for a token, using the cache to skip repeat signature checks"""
+    claims = token_cache.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
             raise HTTPException(status_code=401, detail="Invalid token")
-        return username
-    except JWTError:
+        token_cache.put(token, claims)
+    
+    if claims.get("sub") is None:
         raise HTTPException(status_code=401, detail="Invalid token")
+    return claims
+
+def get_user_status(username: str) -> dict:
+    """Account status (exists, is_active, role) served from a short-TTL cache"""
+    status = user_status_cache.get(username)
+    if status is None:
+        user = users_collection.find_one({"username": username}, {"is_active": 1, "role": 1})
+        status = {
+            "exists": user is not None,
+            "is_active": bool(user and user.get("is_active", True)),
+            "role": user.get("role", "user") if user else None
+        }
+        user_status_cache.put(username, status)
+    return status
+
+def invalidate_user_status(username: str = None):
+    """Forget cached account status after activation or role changes"""
+    user_status_cache.invalidate(username)
+
+def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    claims = _decode_token(credentials.credentials)
+    username: str = claims["sub"]
+    
+    status = get_user_status(username)
+    if not status["exists"] or not status["is_active"]:
+        raise HTTPException(status_code=401, detail="Account not found or deactivated")
+    return username
 
 def verify_admin(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verify if the current user is an admin"""
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise HTTPException(status_code=401, detail="Invalid token")
-        
-        # Check if user is admin
-        user = users_collection.find_one({"username": username})
-        if not user or user.get("role") != "admin":
-            raise HTTPException(status_code=403, detail="Admin access required")
-        
-        return username
-    except JWTError:
-        raise HTTPException(status_code=401, detail="Invalid token")
+    claims = _decode_token(credentials.credentials)
+    username: str = claims["sub"]
+    
+    status = get_user_status(username)
+    if not status["exists"] or not status["is_active"]:
+        raise HTTPException(status_code=401, detail="Account not found or deactivated")
+    
+    # The signed role claim authorizes; tokens issued before roles were embedded fall back to the cached status
+    role = claims.get("role", status["role"])
+    if role != "admin":
+        raise HTTPException(status_code=403, detail="Admin access required")
+    
+    return username
+
+def serialize_addresses(addresses):
+    """Convert embedded address documents to JSON serializable format in place"""
+    for addr in addresses:
+        if "_id" in addr and isinstance(addr["_id"], ObjectId):
+            addr["_id"] = str(addr["_id"])
+        if "created_at" in addr and isinstance(addr["created_at"], datetime):
+            addr["created_at"] = addr["created_at"].isoformat()
+        if "updated_at" in addr and isinstance(addr["updated_at"], datetime):
+            addr["updated_at"] = addr["updated_at"].isoformat()
+    return addresses
 
 def serialize_user(user_doc):
     """Convert MongoDB document to JSON serializable format"""
@@ -66,13 +150,7 @@ def serialize_user(user_doc):
         
         # Handle addresses array if it exists
         if "addresses" in user_doc and isinstance(user_doc["addresses"], list):
-            for addr in user_doc["addresses"]:
-                if "_id" in addr and isinstance(addr["_id"], ObjectId):
-                    addr["_id"] = str(addr["_id"])
-                if "created_at" in addr:
-                    addr["created_at"] = addr["created_at"].isoformat()
-                if "updated_at" in addr:
-                    addr["updated_at"] = addr["updated_at"].isoformat()
+            serialize_addresses(user_doc["addresses"])
     
     return user_doc
 
@@ -82,7 +160,7 @@ async def register(user: UserRegistration):
     if users_collection.find_one({"$or": [{"username": user.username}, {"email": user.email}]}):
         raise HTTPException(status_code=400, detail="Username or email already taken")
     
-    hashed_password = hash_password(user.password)
+    hashed_password = await hash_password(user.password)
     user_data = user.dict()
     user_data["gender"] = user.gender
     user_data["password"] = hashed_password
@@ -92,15 +170,25 @@ async def register(user: UserRegistration):
     
     result = users_collection.insert_one(user_data)
     if result.inserted_id:
+        record_signup(db, user_data["created_at"])
         return {"message": "User registered successfully"}
     raise HTTPException(status_code=500, detail="Registration failed")
 
 @router.post("/login")
-async def login(user: UserLogin):
+async def login(user: UserLogin, background_tasks: BackgroundTasks):
     db_user = users_collection.find_one({"username": user.username})
-    if not db_user or not verify_password(user.password, db_user["password"]):
+    if not db_user:
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    is_valid, new_hash = await verify_and_update_password(user.password, db_user["password"])
+    if not is_valid:
+        raise HTTPException(status_code=401, detail="Invalid credentials")
+
+    # Transparently upgrade the stored hash when BCRYPT_ROUNDS has changed
+    if new_hash:
+        users_collection.update_one({"_id": db_user["_id"]}, {"$set": {"password": new_hash}})
+        password_pool_stats["rehashed"] += 1
+
     if not db_user.get("is_active", True):
         raise HTTPException(status_code=401, detail="Account deactivated")
 
@@ -110,30 +198,18 @@ async def login(user: UserLogin):
     # Include the role in the access token
     access_token = create_access_token(data={"sub": user.username, "role": user_role})
 
-    # Check if this is the first login and assign welcome vouchers
+    # On first login, grant welcome vouchers after the response is sent.
+    # The grant is idempotent per username, so repeated logins cannot double-assign.
     if not db_user.get("welcome_vouchers_assigned", False):
-        try:
-            async with httpx.AsyncClient() as client:
-                voucher_response = await client.post(f"http://localhost:8000/discounts/auto-assign-vouchers/{user.username}")
-                if voucher_response.status_code == 200:
-                    # Mark welcome vouchers as assigned
-                    users_collection.update_one(
-                        {"username": user.username},
-                        {"$set": {"welcome_vouchers_assigned": True}}
-                    )
-
-                    voucher_data = voucher_response.json()
-                    return {
-                        "access_token": access_token,
-                        "token_type": "bearer",
-                        "vouchers_assigned": voucher_data.get("assigned_count", 0),
-                        "voucher_message": "Welcome! 20 vouchers assigned for your first login!",
-                        "first_login": True,
-                        "role": user_role
-                    }
-        except Exception as e:
-            # If voucher assignment fails, still return login success but don't mark as assigned
-            pass
+        background_tasks.add_task(grant_welcome_vouchers_in_background, user.username)
+        return {
+            "access_token": access_token,
+            "token_type": "bearer",
+            "vouchers_pending": True,
+            "voucher_message": "Welcome! Your first-login vouchers are being added to your account.",
+            "first_login": True,
+            "role": user_role
+        }
 
     return {
         "access_token": access_token,
@@ -142,6 +218,11 @@ async def login(user: UserLogin):
         "role": user_role
     }
 
+@router.get("/admin/password-pool-stats")
+async def password_pool_metrics(admin_user: str = Depends(verify_admin)):
+    """Password hashing pool metrics (queue depth, throughput, rehash count)"""
+    return get_password_pool_stats()
+
 @router.get("/profile")
 async def get_profile(current_user: str = Depends(verify_token)):
     user = users_collection.find_one({"username": current_user}, {"password": 0})
@@ -151,6 +232,19 @@ async def get_profile(current_user: str = Depends(verify_token)):
     # Convert ObjectId to string for JSON serialization
     return serialize_user(user)
 
+def validate_address_fields(address: Address):
+    """Reject addresses with any required field left blank"""
+    if not all([address.street, address.barangay, address.city, address.region, 
+                address.postal_code, address.contact_number, address.recipient_name]):
+        raise HTTPException(status_code=400, detail="All address fields are required")
+
+def parse_address_id(address_id: str) -> ObjectId:
+    """Validate an address ID from the URL and convert it to an ObjectId"""
+    try:
+        return ObjectId(address_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid address ID format")
+
 @router.post("/users/{username}/addresses")
 async def add_user_address(
     username: str,
@@ -162,61 +256,60 @@ async def add_user_address(
     if current_user != username:
         raise HTTPException(status_code=403, detail="Can only add address to your own profile")
     
-    # Check if user exists
-    user = users_collection.find_one({"username": username})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    # Validate required fields
-    if not all([address.street, address.barangay, address.city, address.region, 
-                address.postal_code, address.contact_number, address.recipient_name]):
-        raise HTTPException(status_code=400, detail="All address fields are required")
+    validate_address_fields(address)
     
     # Prepare address data
     address_data = address.dict()
     address_data["_id"] = ObjectId()  # Generate ObjectId for the address
     address_data["created_at"] = datetime.utcnow()
     
-    # Check if user has any existing addresses
-    existing_addresses = user.get("addresses", [])
+    # Append the address in one atomic update. It becomes the default when it is
+    # the user's first address or explicitly marked as default, in which case every
+    # existing address loses its default flag. $literal keeps user input from being
+    # read as field paths or operators.
+    user = users_collection.find_one_and_update(
+        {"username": username},
+        [
+            {"$set": {"addresses": {"$ifNull": ["$addresses", []]}}},
+            {"$set": {"addresses": {"$let": {
+                "vars": {
+                    "make_default": {"$or": [
+                        {"$literal": address.is_default},
+                        {"$eq": [{"$size": "$addresses"}, 0]}
+                    ]}
+                },
+                "in": {"$concatArrays": [
+                    {"$map": {
+                        "input": "$addresses",
+                        "as": "addr",
+                        "in": {"$cond": [
+                            "$$make_default",
+                            {"$mergeObjects": ["$$addr", {"is_default": False}]},
+                            "$$addr"
+                        ]}
+                    }},
+                    [{"$mergeObjects": [{"$literal": address_data}, {"is_default": "$$make_default"}]}]
+                ]}
+            }}}}
+        ],
+        projection={"addresses": 1, "_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
     
-    # If this is the first address or marked as default, set as default
-    if not existing_addresses or address.is_default:
-        address_data["is_default"] = True
-        
-        # If there are existing addresses and this is being set as default,
-        # remove default flag from existing addresses
-        if existing_addresses and address.is_default:
-            users_collection.update_one(
-                {"username": username},
-                {"$set": {"addresses.$[].is_default": False}}
-            )
-    else:
-        # If there are existing addresses and this is not marked as default
-        address_data["is_default"] = False
-    
-    # Add the address to the user's addresses array
-    # Use $push to add to array, or $set if addresses field doesn't exist
-    if existing_addresses:
-        # Addresses array exists, just push the new address
-        result = users_collection.update_one(
-            {"username": username},
-            {"$push": {"addresses": address_data}}
-        )
-    else:
-        # Addresses array doesn't exist, create it with the first address
-        result = users_collection.update_one(
-            {"username": username},
-            {"$set": {"addresses": [address_data]}}
-        )
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
     
-    if result.modified_count == 1:
-        return {
-            "message": "Address added successfully", 
-            "address_id": str(address_data["_id"]),
-            "is_default": address_data["is_default"]
-        }
-    raise HTTPException(status_code=500, detail="Failed to add address")
+    addresses = user.get("addresses", [])
+    added = next((addr for addr in addresses if addr.get("_id") == address_data["_id"]), None)
+    if not added:
+        raise HTTPException(status_code=500, detail="Failed to add address")
+    
+    return {
+        "message": "Address added successfully", 
+        "address_id": str(address_data["_id"]),
+        "is_default": added.get("is_default", False),
+        "addresses": serialize_addresses(addresses)
+    }
 
 @router.get("/users/{username}/addresses")
 async def get_user_addresses(
@@ -235,18 +328,7 @@ async def get_user_addresses(
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    addresses = user.get("addresses", [])
-    
-    # Convert ObjectId to string for JSON serialization
-    for addr in addresses:
-        if "_id" in addr:
-            addr["_id"] = str(addr["_id"])
-        if "created_at" in addr:
-            addr["created_at"] = addr["created_at"].isoformat()
-        if "updated_at" in addr:
-            addr["updated_at"] = addr["updated_at"].isoformat()
-    
-    return addresses
+    return serialize_addresses(user.get("addresses", []))
 
 @router.put("/users/{username}/addresses/{address_id}")
 async def update_user_address(
@@ -259,53 +341,37 @@ async def update_user_address(
     if current_user != username:
         raise HTTPException(status_code=403, detail="Can only update your own addresses")
     
-    # Validate ObjectId format
-    try:
-        address_obj_id = ObjectId(address_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid address ID format")
-    
-    # Validate required fields
-    if not all([address.street, address.barangay, address.city, address.region, 
-                address.postal_code, address.contact_number, address.recipient_name]):
-        raise HTTPException(status_code=400, detail="All address fields are required")
+    address_obj_id = parse_address_id(address_id)
+    validate_address_fields(address)
     
-    # Check if address exists
-    user = users_collection.find_one(
-        {"username": username, "addresses._id": address_obj_id}
-    )
-    if not user:
-        raise HTTPException(status_code=404, detail="Address not found")
+    # Update the target address and, when it becomes the default, clear the flag
+    # on every other address in the same write
+    update_fields = {
+        f"addresses.$[target].{field}": value
+        for field, value in address.dict().items()
+    }
+    update_fields["addresses.$[target].updated_at"] = datetime.utcnow()
+    array_filters = [{"target._id": address_obj_id}]
     
-    # If this address is being set as default, remove default from others
     if address.is_default:
-        users_collection.update_one(
-            {"username": username},
-            {"$set": {"addresses.$[].is_default": False}}
-        )
+        update_fields["addresses.$[other].is_default"] = False
+        array_filters.append({"other._id": {"$ne": address_obj_id}})
     
-    # Update the specific address
-    result = users_collection.update_one(
+    user = users_collection.find_one_and_update(
         {"username": username, "addresses._id": address_obj_id},
-        {"$set": {
-            "addresses.$.street": address.street,
-            "addresses.$.barangay": address.barangay,
-            "addresses.$.city": address.city,
-            "addresses.$.province": address.province,
-            "addresses.$.region": address.region,
-            "addresses.$.postal_code": address.postal_code,
-            "addresses.$.country": address.country,
-            "addresses.$.is_default": address.is_default,
-            "addresses.$.contact_number": address.contact_number,
-            "addresses.$.recipient_name": address.recipient_name,
-            "addresses.$.address_type": address.address_type,
-            "addresses.$.updated_at": datetime.utcnow()
-        }}
+        {"$set": update_fields},
+        array_filters=array_filters,
+        projection={"addresses": 1, "_id": 0},
+        return_document=ReturnDocument.AFTER
     )
     
-    if result.modified_count == 1:
-        return {"message": "Address updated successfully"}
-    raise HTTPException(status_code=404, detail="Failed to update address")
+    if not user:
+        raise HTTPException(status_code=404, detail="Address not found")
+    
+    return {
+        "message": "Address updated successfully",
+        "addresses": serialize_addresses(user.get("addresses", []))
+    }
 
 @router.delete("/users/{username}/addresses/{address_id}")
 async def delete_user_address(
@@ -317,48 +383,51 @@ async def delete_user_address(
     if current_user != username:
         raise HTTPException(status_code=403, detail="Can only delete your own addresses")
     
-    # Validate ObjectId format
-    try:
-        address_obj_id = ObjectId(address_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid address ID format")
+    address_obj_id = parse_address_id(address_id)
     
-    # First check if this address exists and if it's the default
-    user = users_collection.find_one(
+    # Remove the address and, if it was the default, promote the first remaining
+    # address in the same write
+    user = users_collection.find_one_and_update(
         {"username": username, "addresses._id": address_obj_id},
-        {"addresses.$": 1}
+        [
+            {"$set": {"addresses": {"$let": {
+                "vars": {
+                    "removed_default": {"$anyElementTrue": [{"$map": {
+                        "input": "$addresses",
+                        "as": "addr",
+                        "in": {"$and": [
+                            {"$eq": ["$$addr._id", address_obj_id]},
+                            {"$eq": ["$$addr.is_default", True]}
+                        ]}
+                    }}]},
+                    "remaining": {"$filter": {
+                        "input": "$addresses",
+                        "as": "addr",
+                        "cond": {"$ne": ["$$addr._id", address_obj_id]}
+                    }}
+                },
+                "in": {"$map": {
+                    "input": {"$range": [0, {"$size": "$$remaining"}]},
+                    "as": "index",
+                    "in": {"$cond": [
+                        {"$and": ["$$removed_default", {"$eq": ["$$index", 0]}]},
+                        {"$mergeObjects": [{"$arrayElemAt": ["$$remaining", "$$index"]}, {"is_default": True}]},
+                        {"$arrayElemAt": ["$$remaining", "$$index"]}
+                    ]}
+                }}
+            }}}}
+        ],
+        projection={"addresses": 1, "_id": 0},
+        return_document=ReturnDocument.AFTER
     )
     
-    if not user or not user.get("addresses"):
+    if not user:
         raise HTTPException(status_code=404, detail="Address not found")
     
-    is_default = user["addresses"][0].get("is_default", False)
-    
-    # Remove the address
-    result = users_collection.update_one(
-        {"username": username},
-        {"$pull": {"addresses": {"_id": address_obj_id}}}
-    )
-    
-    if result.modified_count == 1:
-        # If we deleted the default address, set a new default if any addresses remain
-        if is_default:
-            remaining_user = users_collection.find_one(
-                {"username": username},
-                {"addresses": 1}
-            )
-            remaining_addresses = remaining_user.get("addresses", [])
-            
-            if remaining_addresses:
-                # Set the first remaining address as default
-                first_address_id = remaining_addresses[0]["_id"]
-                users_collection.update_one(
-                    {"username": username, "addresses._id": first_address_id},
-                    {"$set": {"addresses.$.is_default": True}}
-                )
-        
-        return {"message": "Address deleted successfully"}
-    raise HTTPException(status_code=500, detail="Failed to delete address")
+    return {
+        "message": "Address deleted successfully",
+        "addresses": serialize_addresses(user.get("addresses", []))
+    }
 
 @router.put("/users/{username}/addresses/{address_id}/set-default")
 async def set_default_address(
@@ -370,34 +439,30 @@ async def set_default_address(
     if current_user != username:
         raise HTTPException(status_code=403, detail="Can only modify your own addresses")
     
-    # Validate ObjectId format
-    try:
-        address_obj_id = ObjectId(address_id)
-    except Exception:
-        raise HTTPException(status_code=400, detail="Invalid address ID format")
+    address_obj_id = parse_address_id(address_id)
     
-    # Check if address exists
-    user = users_collection.find_one(
-        {"username": username, "addresses._id": address_obj_id}
+    # Flag the target as default and clear every other address in one write
+    user = users_collection.find_one_and_update(
+        {"username": username, "addresses._id": address_obj_id},
+        {"$set": {
+            "addresses.$[target].is_default": True,
+            "addresses.$[other].is_default": False
+        }},
+        array_filters=[
+            {"target._id": address_obj_id},
+            {"other._id": {"$ne": address_obj_id}}
+        ],
+        projection={"addresses": 1, "_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    
     if not user:
         raise HTTPException(status_code=404, detail="Address not found")
     
-    # First unset any existing default addresses
-    users_collection.update_one(
-        {"username": username},
-        {"$set": {"addresses.$[].is_default": False}}
-    )
-    
-    # Set the new default address
-    result = users_collection.update_one(
-        {"username": username, "addresses._id": address_obj_id},
-        {"$set": {"addresses.$.is_default": True}}
-    )
-    
-    if result.modified_count == 1:
-        return {"message": "Default address updated successfully"}
-    raise HTTPException(status_code=404, detail="Address not found")
+    return {
+        "message": "Default address updated successfully",
+        "addresses": serialize_addresses(user.get("addresses", []))
+    }
 
 # Optional: Add an endpoint to initialize addresses array for existing users
 @router.post("/users/{username}/addresses/initialize")
@@ -1,11 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends
 from connection.database import carts_collection, users_collection
-from models.cart import CartItem, CartItemAdd, CartItemUpdate, Cart, CartSummary
+from models.cart import (
+    CartItem, CartItemAdd, CartItemUpdate, Cart, CartSummary,
+    CartBatchRequest, CartBatchOperation, CartOperationType
+)
 from routes.auth import verify_token
+from services.cart_cache import cart_cache
 from datetime import datetime, timedelta
 from bson import ObjectId
+from pymongo import ReturnDocument
 import uuid
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional
 
 router = APIRouter()
 
@@ -17,7 +22,10 @@ def calculate_cart_totals(items: List[CartItem]) -> Dict[str, float]:
     """Calculate cart totals including tax and shipping estimates"""
     subtotal = sum(item.total_price for item in items)
     total_items = sum(item.quantity for item in items)
-    
+    return summarize_cart_totals(total_items, subtotal)
+
+def summarize_cart_totals(total_items: int, subtotal: float) -> Dict[str, float]:
+    """Derive tax, shipping and total estimates from stored cart totals"""
     # Calculate estimates (12% tax, 5% shipping up to $50)
     estimated_tax = round(subtotal * 0.12, 2)
     estimated_shipping = min(round(subtotal * 0.05, 2), 50.0) if subtotal > 0 else 0.0
@@ -31,6 +39,207 @@ def calculate_cart_totals(items: List[CartItem]) -> Dict[str, float]:
         "estimated_total": estimated_total
     }
 
+def cart_line_matches(product_id: str, size: Optional[str], color: Optional[str], item_var: str = "$$item") -> Dict[str, Any]:
+    """Aggregation expression: does a cart line have this product, size and color"""
+    return {"$and": [
+        {"$eq": [f"{item_var}.product_id", {"$literal": product_id}]},
+        {"$eq": [{"$ifNull": [f"{item_var}.size", None]}, {"$literal": size}]},
+        {"$eq": [{"$ifNull": [f"{item_var}.color", None]}, {"$literal": color}]}
+    ]}
+
+def cart_line_with_quantity(quantity_expr, item_var: str = "$$item") -> Dict[str, Any]:
+    """Aggregation expression: a cart line with a new quantity and recomputed line total"""
+    return {"$mergeObjects": [item_var, {
+        "quantity": quantity_expr,
+        "total_price": {"$round": [{"$multiply": [f"{item_var}.unit_price", quantity_expr]}, 2]}
+    }]}
+
+def cart_totals_stage() -> Dict[str, Any]:
+    """
+    Update-pipeline stage recomputing stored cart totals from the items array.
+    updated_at is stamped by the server when the update runs ($$NOW), so it
+    orders writes correctly for the batch endpoint's updated_at guard.
+    """
+    return {"$set": {
+        "total_items": {"$sum": "$items.quantity"},
+        "subtotal": {"$round": [{"$sum": "$items.total_price"}, 2]},
+        "updated_at": "$$NOW"
+    }}
+
+def add_line_stage(cart_item: Dict[str, Any]) -> Dict[str, Any]:
+    """Update-pipeline stage: bump the quantity of a matching line or append a new one"""
+    line_match = cart_line_matches(cart_item["product_id"], cart_item.get("size"), cart_item.get("color"))
+    return {"$set": {"items": {"$let": {
+        "vars": {"existing": {"$ifNull": ["$items", []]}},
+        "in": {"$cond": [
+            {"$anyElementTrue": [{"$map": {"input": "$$existing", "as": "item", "in": line_match}}]},
+            {"$map": {
+                "input": "$$existing",
+                "as": "item",
+                "in": {"$cond": [
+                    line_match,
+                    cart_line_with_quantity({"$add": ["$$item.quantity", cart_item["quantity"]]}),
+                    "$$item"
+                ]}
+            }},
+            {"$concatArrays": ["$$existing", [{"$literal": cart_item}]]}
+        ]}
+    }}}}
+
+def update_line_stage(
+    product_id: str,
+    old_size: Optional[str],
+    old_color: Optional[str],
+    quantity: int,
+    size: Optional[str] = None,
+    color: Optional[str] = None
+) -> Dict[str, Any]:
+    """Update-pipeline stage: rewrite the first line matching product_id (and old_size/old_color if given)"""
+    line_match = [{"$eq": ["$$item.product_id", {"$literal": product_id}]}]
+    if old_size is not None:
+        line_match.append({"$eq": ["$$item.size", {"$literal": old_size}]})
+    if old_color is not None:
+        line_match.append({"$eq": ["$$item.color", {"$literal": old_color}]})
+    
+    line_changes = {}
+    if size is not None:
+        line_changes["size"] = {"$literal": size}
+    if color is not None:
+        line_changes["color"] = {"$literal": color}
+    
+    return {"$set": {"items": {"$let": {
+        "vars": {
+            "target": {"$indexOfArray": [
+                {"$map": {"input": "$items", "as": "item", "in": {"$and": line_match}}},
+                True
+            ]}
+        },
+        "in": {"$map": {
+            "input": {"$range": [0, {"$size": "$items"}]},
+            "as": "index",
+            "in": {"$let": {
+                "vars": {"line": {"$arrayElemAt": ["$items", "$$index"]}},
+                "in": {"$cond": [
+                    {"$eq": ["$$index", "$$target"]},
+                    {"$mergeObjects": [
+                        cart_line_with_quantity(quantity, item_var="$$line"),
+                        line_changes
+                    ]},
+                    "$$line"
+                ]}
+            }}
+        }}
+    }}}}
+
+def remove_line_stage(product_id: str, size: Optional[str], color: Optional[str]) -> Dict[str, Any]:
+    """Update-pipeline stage: drop every line with this product, size and color"""
+    return {"$set": {"items": {"$filter": {
+        "input": "$items",
+        "as": "item",
+        "cond": {"$not": [cart_line_matches(product_id, size, color)]}
+    }}}}
+
+def apply_cart_operations(items: List[Dict[str, Any]], operations: List[CartBatchOperation]) -> List[Dict[str, Any]]:
+    """
+    Apply batch operations to a copy of the cart lines in Python, raising
+    HTTPException on the first invalid one, so a batch is validated as a whole
+    before anything is written
+    """
+    items = [dict(item) for item in items]
+    
+    for index, operation in enumerate(operations):
+        if operation.op == CartOperationType.ADD:
+            existing = next(
+                (
+                    item for item in items
+                    if item["product_id"] == operation.product_id
+                    and item.get("size") == operation.size
+                    and item.get("color") == operation.color
+                ),
+                None
+            )
+            if existing:
+                new_quantity = existing["quantity"] + operation.quantity
+                if new_quantity > 50:
+                    raise HTTPException(status_code=400, detail=f"Operation {index}: cannot add more than 50 items of the same product")
+                existing["quantity"] = new_quantity
+                existing["total_price"] = round(existing["unit_price"] * new_quantity, 2)
+            else:
+                items.append(batch_operation_to_cart_item(operation))
+        
+        elif operation.op == CartOperationType.UPDATE:
+            target = next(
+                (
+                    item for item in items
+                    if item["product_id"] == operation.product_id
+                    and (operation.old_size is None or item.get("size") == operation.old_size)
+                    and (operation.old_color is None or item.get("color") == operation.old_color)
+                ),
+                None
+            )
+            if not target:
+                raise HTTPException(status_code=404, detail=f"Operation {index}: item not found in cart")
+            target["quantity"] = operation.quantity
+            target["total_price"] = round(target["unit_price"] * operation.quantity, 2)
+            if operation.size is not None:
+                target["size"] = operation.size
+            if operation.color is not None:
+                target["color"] = operation.color
+        
+        else:
+            remaining = [
+                item for item in items
+                if not (item["product_id"] == operation.product_id and 
+                       item.get("size") == operation.size and 
+                       item.get("color") == operation.color)
+            ]
+            if len(remaining) == len(items):
+                raise HTTPException(status_code=404, detail=f"Operation {index}: item not found in cart")
+            items = remaining
+    
+    return items
+
+def batch_operation_to_cart_item(operation: CartBatchOperation) -> Dict[str, Any]:
+    """Build a new cart line from an add operation"""
+    return CartItem(
+        product_id=operation.product_id,
+        product_name=operation.product_name,
+        brand=operation.brand,
+        unit_price=operation.unit_price,
+        quantity=operation.quantity,
+        size=operation.size,
+        color=operation.color,
+        image_url=operation.image_url,
+        total_price=round(operation.unit_price * operation.quantity, 2)
+    ).dict()
+
+def batch_operation_stage(operation: CartBatchOperation) -> Dict[str, Any]:
+    """Translate a batch operation into its update-pipeline stage"""
+    if operation.op == CartOperationType.ADD:
+        return add_line_stage(batch_operation_to_cart_item(operation))
+    if operation.op == CartOperationType.UPDATE:
+        return update_line_stage(
+            operation.product_id, operation.old_size, operation.old_color,
+            operation.quantity, operation.size, operation.color
+        )
+    return remove_line_stage(operation.product_id, operation.size, operation.color)
+
+def get_cached_cart_totals(username: str) -> Dict[str, Any]:
+    """Cart item count and subtotal, from the cart cache or a projected read on a miss"""
+    totals = cart_cache.get_totals(username)
+    if totals is None:
+        cart = carts_collection.find_one(
+            {"username": username},
+            {"items.quantity": 1, "items.total_price": 1, "_id": 0}
+        )
+        items = cart.get("items", []) if cart else []
+        totals = {
+            "total_items": sum(item.get("quantity", 0) for item in items),
+            "subtotal": round(sum(item.get("total_price", 0.0) for item in items), 2)
+        }
+        cart_cache.put_totals(username, totals["total_items"], totals["subtotal"])
+    return totals
+
 def serialize_cart(cart_doc):
     """Convert MongoDB document to JSON serializable format"""
     if cart_doc:
@@ -47,11 +256,6 @@ def serialize_cart(cart_doc):
 async def add_to_cart(item_data: CartItemAdd, current_user: str = Depends(verify_token)):
     """Add an item to the user's cart"""
     try:
-        # Get user information
-        user = users_collection.find_one({"username": current_user})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
         # Calculate total price
         total_price = round(item_data.unit_price * item_data.quantity, 2)
         
@@ -68,51 +272,38 @@ async def add_to_cart(item_data: CartItemAdd, current_user: str = Depends(verify
             total_price=total_price
         )
         
-        # Find existing cart or create new one
-        existing_cart = carts_collection.find_one({"username": current_user})
+        # Merge into the existing cart in one atomic update: bump the quantity of a
+        # matching line or append a new one, then recompute the stored totals.
+        # The filter rejects the write if the merged line would exceed 50 items.
+        cart = carts_collection.find_one_and_update(
+            {
+                "username": current_user,
+                "items": {"$not": {"$elemMatch": {
+                    "product_id": item_data.product_id,
+                    "size": item_data.size,
+                    "color": item_data.color,
+                    "quantity": {"$gt": 50 - item_data.quantity}
+                }}}
+            },
+            [
+                add_line_stage(cart_item.dict()),
+                cart_totals_stage()
+            ],
+            projection={"cart_id": 1, "total_items": 1, "subtotal": 1},
+            return_document=ReturnDocument.AFTER
+        )
         
-        if existing_cart:
-            # Check if item already exists in cart
-            items = existing_cart.get("items", [])
-            item_found = False
-            
-            for i, existing_item in enumerate(items):
-                if (existing_item["product_id"] == item_data.product_id and 
-                    existing_item.get("size") == item_data.size and 
-                    existing_item.get("color") == item_data.color):
-                    # Update quantity of existing item
-                    new_quantity = existing_item["quantity"] + item_data.quantity
-                    if new_quantity > 50:
-                        raise HTTPException(status_code=400, detail="Cannot add more than 50 items of the same product")
-                    
-                    items[i]["quantity"] = new_quantity
-                    items[i]["total_price"] = round(existing_item["unit_price"] * new_quantity, 2)
-                    item_found = True
-                    break
-            
-            if not item_found:
-                # Add new item to cart
-                items.append(cart_item.dict())
-            
-            # Calculate new totals
-            cart_totals = calculate_cart_totals([CartItem(**item) for item in items])
-            
-            # Update cart
-            carts_collection.update_one(
-                {"_id": existing_cart["_id"]},
-                {
-                    "$set": {
-                        "items": items,
-                        "total_items": cart_totals["total_items"],
-                        "subtotal": cart_totals["subtotal"],
-                        "updated_at": datetime.utcnow()
-                    }
-                }
-            )
-            
-            cart_id = existing_cart["cart_id"]
+        if cart:
+            cart_id = cart["cart_id"]
+            cart_totals = summarize_cart_totals(cart["total_items"], cart["subtotal"])
+        elif carts_collection.find_one({"username": current_user}, {"_id": 1}):
+            raise HTTPException(status_code=400, detail="Cannot add more than 50 items of the same product")
         else:
             # Create new cart
+            user = users_collection.find_one({"username": current_user}, {"_id": 1})
+            if not user:
+                raise HTTPException(status_code=404, detail="User not found")
+            
             cart_id = generate_cart_id()
             cart_totals = calculate_cart_totals([cart_item])
             
@@ -132,6 +323,8 @@ async def add_to_cart(item_data: CartItemAdd, current_user: str = Depends(verify
             if not result.inserted_id:
                 raise HTTPException(status_code=500, detail="Failed to create cart")
         
+        cart_cache.put_totals(current_user, cart_totals["total_items"], cart_totals["subtotal"])
+        
         return {
             "message": "Item added to cart successfully",
             "cart_id": cart_id,
@@ -182,6 +375,7 @@ async def get_cart(current_user: str = Depends(verify_token)):
                     }
                 }
             )
+        cart_cache.put_totals(current_user, cart_totals["total_items"], cart_totals["subtotal"])
         
         return {
             "cart_id": cart["cart_id"],
@@ -206,53 +400,50 @@ async def update_cart_item(
 ):
     """Update quantity, size, or color of a cart item"""
     try:
-        cart = carts_collection.find_one({"username": current_user})
-        if not cart:
-            raise HTTPException(status_code=404, detail="Cart not found")
-        items = cart.get("items", [])
-        item_found = False
-        item_index = -1
-
         # Match by product_id and old_size/old_color if provided
-        for i, item in enumerate(items):
-            if item["product_id"] == product_id:
-                size_match = (old_size is None or item.get("size") == old_size)
-                color_match = (old_color is None or item.get("color") == old_color)
-                if size_match and color_match:
-                    item_index = i
-                    item_found = True
-                    break
-
-        if not item_found:
+        line_filter = {"product_id": product_id}
+        if old_size is not None:
+            line_filter["size"] = old_size
+        if old_color is not None:
+            line_filter["color"] = old_color
+        
+        # Rewrite only the first matching line server-side, then recompute totals
+        cart = carts_collection.find_one_and_update(
+            {"username": current_user, "items": {"$elemMatch": line_filter}},
+            [
+                update_line_stage(
+                    product_id, old_size, old_color,
+                    update_data.quantity, update_data.size, update_data.color
+                ),
+                cart_totals_stage()
+            ],
+            projection={"items": 1, "total_items": 1, "subtotal": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        
+        if not cart:
+            if not carts_collection.find_one({"username": current_user}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Cart not found")
             raise HTTPException(status_code=404, detail="Item not found in cart")
-
-        # Update the item
-        if update_data.quantity is not None:
-            items[item_index]["quantity"] = update_data.quantity
-            items[item_index]["total_price"] = round(items[item_index]["unit_price"] * update_data.quantity, 2)
-        if update_data.size is not None:
-            items[item_index]["size"] = update_data.size
-        if update_data.color is not None:
-            items[item_index]["color"] = update_data.color
-
-        # Calculate new totals
-        cart_totals = calculate_cart_totals([CartItem(**item) for item in items])
-        # Update cart
-        carts_collection.update_one(
-            {"_id": cart["_id"]},
-            {
-                "$set": {
-                    "items": items,
-                    "total_items": cart_totals["total_items"],
-                    "subtotal": cart_totals["subtotal"],
-                    "updated_at": datetime.utcnow()
-                }
-            }
+        
+        cart_cache.put_totals(current_user, cart["total_items"], cart["subtotal"])
+        
+        new_size = update_data.size if update_data.size is not None else old_size
+        new_color = update_data.color if update_data.color is not None else old_color
+        updated_item = next(
+            (
+                item for item in cart.get("items", [])
+                if item["product_id"] == product_id
+                and (new_size is None or item.get("size") == new_size)
+                and (new_color is None or item.get("color") == new_color)
+            ),
+            None
         )
+        
         return {
             "message": "Cart item updated successfully",
-            "updated_item": items[item_index],
-            "cart_summary": cart_totals
+            "updated_item": updated_item,
+            "cart_summary": summarize_cart_totals(cart["total_items"], cart["subtotal"])
         }
     except HTTPException:
         raise
@@ -268,50 +459,103 @@ async def remove_cart_item(
 ):
     """Remove an item from the cart"""
     try:
-        cart = carts_collection.find_one({"username": current_user})
+        # Drop the line and recompute totals in one atomic update
+        cart = carts_collection.find_one_and_update(
+            {
+                "username": current_user,
+                "items": {"$elemMatch": {"product_id": product_id, "size": size, "color": color}}
+            },
+            [
+                remove_line_stage(product_id, size, color),
+                cart_totals_stage()
+            ],
+            projection={"total_items": 1, "subtotal": 1},
+            return_document=ReturnDocument.AFTER
+        )
         
         if not cart:
-            raise HTTPException(status_code=404, detail="Cart not found")
-        
-        items = cart.get("items", [])
-        original_length = len(items)
-        
-        # Remove the item
-        items = [
-            item for item in items 
-            if not (item["product_id"] == product_id and 
-                   item.get("size") == size and 
-                   item.get("color") == color)
-        ]
-        
-        if len(items) == original_length:
+            if not carts_collection.find_one({"username": current_user}, {"_id": 1}):
+                raise HTTPException(status_code=404, detail="Cart not found")
             raise HTTPException(status_code=404, detail="Item not found in cart")
         
-        # Calculate new totals
-        cart_totals = calculate_cart_totals([CartItem(**item) for item in items])
+        cart_totals = summarize_cart_totals(cart["total_items"], cart["subtotal"])
+        cart_cache.put_totals(current_user, cart["total_items"], cart["subtotal"])
         
-        # Update cart
-        carts_collection.update_one(
-            {"_id": cart["_id"]},
-            {
-                "$set": {
-                    "items": items,
+        return {
+            "message": "Item removed from cart successfully",
+            "cart_summary": cart_totals
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to remove item from cart: {str(e)}")
+
+# Attempts before giving up when the cart keeps changing between validation and write
+CART_BATCH_MAX_ATTEMPTS = 3
+
+@router.post("/cart/items:batch")
+async def apply_cart_batch(batch: CartBatchRequest, current_user: str = Depends(verify_token)):
+    """Apply several add/update/remove operations to the cart in one atomic update"""
+    try:
+        for _ in range(CART_BATCH_MAX_ATTEMPTS):
+            cart = carts_collection.find_one({"username": current_user}, {"items": 1, "updated_at": 1})
+            
+            # Validate every operation against the current lines before writing anything
+            new_items = apply_cart_operations(cart.get("items", []) if cart else [], batch.operations)
+            
+            if not cart:
+                user = users_collection.find_one({"username": current_user}, {"_id": 1})
+                if not user:
+                    raise HTTPException(status_code=404, detail="User not found")
+                
+                cart_totals = calculate_cart_totals([CartItem(**item) for item in new_items])
+                cart = {
+                    "cart_id": generate_cart_id(),
+                    "user_id": str(user["_id"]),
+                    "username": current_user,
+                    "items": new_items,
                     "total_items": cart_totals["total_items"],
                     "subtotal": cart_totals["subtotal"],
-                    "updated_at": datetime.utcnow()
+                    "created_at": datetime.utcnow(),
+                    "updated_at": datetime.utcnow(),
+                    "expires_at": datetime.utcnow() + timedelta(days=30)  # Cart expires in 30 days
                 }
-            }
-        )
+                result = carts_collection.insert_one(cart)
+                if not result.inserted_id:
+                    raise HTTPException(status_code=500, detail="Failed to create cart")
+                break
+            
+            # Apply all operations server-side in one write, guarded on the cart
+            # not having changed since it was validated
+            cart = carts_collection.find_one_and_update(
+                {"_id": cart["_id"], "updated_at": cart.get("updated_at")},
+                [batch_operation_stage(operation) for operation in batch.operations] + [cart_totals_stage()],
+                return_document=ReturnDocument.AFTER
+            )
+            if cart:
+                break
+        else:
+            raise HTTPException(status_code=409, detail="Cart changed during the batch update, please retry")
+        
+        cart_totals = summarize_cart_totals(cart["total_items"], cart["subtotal"])
+        cart_cache.put_totals(current_user, cart["total_items"], cart["subtotal"])
         
         return {
-            "message": "Item removed from cart successfully",
-            "cart_summary": cart_totals
+            "message": f"Applied {len(batch.operations)} cart operations successfully",
+            "cart_id": cart["cart_id"],
+            "items": cart.get("items", []),
+            "total_items": cart_totals["total_items"],
+            "subtotal": cart_totals["subtotal"],
+            "created_at": cart["created_at"].isoformat(),
+            "updated_at": cart["updated_at"].isoformat(),
+            "summary": cart_totals
         }
     
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to remove item from cart: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to apply cart operations: {str(e)}")
 
 @router.delete("/cart/clear")
 async def clear_cart(current_user: str = Depends(verify_token)):
@@ -332,6 +576,7 @@ async def clear_cart(current_user: str = Depends(verify_token)):
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Cart not found")
         
+        cart_cache.invalidate(current_user)
         return {"message": "Cart cleared successfully"}
     
     except HTTPException:
@@ -343,21 +588,8 @@ async def clear_cart(current_user: str = Depends(verify_token)):
 async def get_cart_summary(current_user: str = Depends(verify_token)):
     """Get cart summary with totals"""
     try:
-        cart = carts_collection.find_one({"username": current_user})
-        
-        if not cart:
-            return CartSummary(
-                total_items=0,
-                subtotal=0.0,
-                estimated_tax=0.0,
-                estimated_shipping=0.0,
-                estimated_total=0.0
-            )
-        
-        items = [CartItem(**item) for item in cart.get("items", [])]
-        cart_totals = calculate_cart_totals(items)
-        
-        return CartSummary(**cart_totals)
+        totals = get_cached_cart_totals(current_user)
+        return CartSummary(**summarize_cart_totals(totals["total_items"], totals["subtotal"]))
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch cart summary: {str(e)}")
@@ -366,19 +598,7 @@ async def get_cart_summary(current_user: str = Depends(verify_token)):
 async def get_cart_item_count(current_user: str = Depends(verify_token)):
     """Get total number of items in cart (for badge display)"""
     try:
-        cart = carts_collection.find_one({"username": current_user})
-        
-        if not cart:
-            return {"item_count": 0}
-        
-        total_items = sum(item["quantity"] for item in cart.get("items", []))
-        
-        return {"item_count": total_items}
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Failed to fetch cart count: {str(e)}")
-        
-        return {"item_count": total_items}
+        return {"item_count": get_cached_cart_totals(current_user)["total_items"]}
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch cart count: {str(e)}")
@@ -1,21 +1,18 @@
-from fastapi import APIRouter, HTTPException, Depends
-from connection.database import discounts_collection, users_collection
+from fastapi import APIRouter, HTTPException, Depends, Query
+from connection.database import discounts_collection, users_collection, voucher_assignments_collection
 from models.discount import Discount, DiscountCreate, DiscountApply
 from models.user import UserDiscountAssignment
 from routes.auth import verify_token, verify_admin
-from datetime import datetime, timedelta
+from services.voucher_service import (
+    generate_discounts, grant_welcome_vouchers, new_assignment, bulk_assign_vouchers, find_user_vouchers
+)
+from datetime import datetime
 from bson import ObjectId
-import random
-import string
+from pymongo.errors import DuplicateKeyError
 from typing import List
 
 router = APIRouter()
 
-def generate_discount_code(length: int = 8) -> str:
-    """Generate a random discount code"""
-    characters = string.ascii_uppercase + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
-
 def serialize_discount(discount_doc):
     """Convert MongoDB document to JSON serializable format"""
     if discount_doc:
@@ -27,119 +24,25 @@ def serialize_discount(discount_doc):
     return discount_doc
 
 @router.post("/generate-discounts")
-async def generate_random_discounts():
-    """Generate 20 random discount codes with percentages from 5% to 50% and assign to all users"""
+def generate_random_discounts(
+    count: int = Query(20, ge=1, le=10000),
+    assign_to_all_users: bool = True,
+    admin_user: str = Depends(verify_admin)
+):
+    """
+    Admin function to generate random discount codes with percentages from 5% to 50%
+    and optionally assign them to all users. A plain def so the blocking inserts run
+    in the threadpool instead of on the event loop.
+    """
     try:
-        # Get all existing users
-        all_users = list(users_collection.find({}, {"username": 1}))
-        
-        valid_percentages = [5, 10, 15, 20, 25, 30, 35, 40, 45, 50]
-        
-        # Enhanced discount types with voucher categories
-        clothes_templates = [
-            {
-                "type": "Summer Sale",
-                "description": "Beat the heat with summer savings",
-                "detailed": "Get amazing discounts on summer collection including light fabrics, swimwear, and casual outfits."
-            },
-            {
-                "type": "Winter Clearance", 
-                "description": "Warm up with winter deals",
-                "detailed": "Stay cozy with discounts on winter essentials including jackets, sweaters, boots, and thermal wear."
-            },
-            {
-                "type": "Flash Sale",
-                "description": "Lightning fast clothing savings",
-                "detailed": "Limited time flash sale on trending fashion items. Grab your favorite clothes before they're gone!"
-            },
-            {
-                "type": "New Arrival",
-                "description": "Fresh fashion discounts", 
-                "detailed": "Be the first to wear the latest fashion trends with special discounts on new arrivals."
-            }
-        ]
-        
-        shipping_templates = [
-            {
-                "type": "Free Shipping",
-                "description": "Free delivery on your order",
-                "detailed": "Enjoy free shipping on your clothing purchases. No minimum order required."
-            },
-            {
-                "type": "Express Delivery",
-                "description": "Discounted express shipping",
-                "detailed": "Get your fashion items faster with discounted express delivery options."
-            },
-            {
-                "type": "Shipping Special",
-                "description": "Special shipping discount",
-                "detailed": "Save on shipping costs for your fashion purchases with this special voucher."
-            }
-        ]
-        
-        discounts_created = []
-        total_assignments = 0
-        
-        # Generate exactly 20 vouchers
-        for i in range(20):
-            code = generate_discount_code()
-            while discounts_collection.find_one({"code": code}):
-                code = generate_discount_code()
-            
-            percentage = random.choice(valid_percentages)
-            
-            # 70% clothes vouchers (14), 30% shipping vouchers (6)
-            voucher_type = "clothes" if i < 14 else "shipping"
-            templates = clothes_templates if voucher_type == "clothes" else shipping_templates
-            template = random.choice(templates)
-            
-            short_description = f"{template['type']} - {percentage}% off"
-            detailed_description = f"{template['description']} - {percentage}% discount. {template['detailed']}"
-            
-            expires_days = random.randint(30, 90)
-            expires_at = datetime.utcnow() + timedelta(days=expires_days)
-            usage_limit = random.choice([None, 50, 100, 200, 500])
-            
-            # Create user assignments for all existing users
-            user_assignments = []
-            for user in all_users:
-                user_assignment = {
-                    "username": user["username"],
-                    "discount_code": code,
-                    "collected_at": datetime.utcnow(),
-                    "assigned_at": datetime.utcnow(),
-                    "assigned_by": "system_auto_assign",
-                    "is_used": False,
-                    "used_at": None,
-                    "assignment_type": "global_distribution"
-                }
-                user_assignments.append(user_assignment)
-                total_assignments += 1
-            
-            discount_data = {
-                "code": code,
-                "percentage": percentage,
-                "description": short_description,
-                "detailed_description": detailed_description,
-                "is_active": True,
-                "created_at": datetime.utcnow(),
-                "expires_at": expires_at,
-                "usage_limit": usage_limit,
-                "used_count": 0,
-                "voucher_type": voucher_type,
-                "user_assignments": user_assignments
-            }
-            
-            result = discounts_collection.insert_one(discount_data)
-            if result.inserted_id:
-                discount_data["_id"] = str(result.inserted_id)
-                discounts_created.append(serialize_discount(discount_data))
+        result = generate_discounts(count, assign_to_all_users)
+        discounts_created = [serialize_discount(discount) for discount in result["discounts"]]
         
         return {
-            "message": f"Successfully created {len(discounts_created)} discount codes and assigned to {len(all_users)} users",
+            "message": f"Successfully created {len(discounts_created)} discount codes and assigned to {result['total_users']} users",
             "discounts_created": len(discounts_created),
-            "total_users": len(all_users),
-            "total_assignments": total_assignments,
+            "total_users": result["total_users"],
+            "total_assignments": result["total_assignments"],
             "discounts": discounts_created
         }
     
@@ -163,32 +66,15 @@ async def collect_voucher(voucher_data: dict, current_user: str = Depends(verify
         if not voucher:
             raise HTTPException(status_code=404, detail="Voucher not found or inactive")
         
-        # Check if user already collected this voucher
-        existing_assignment = discounts_collection.find_one({
-            "_id": ObjectId(voucher_id),
-            "user_assignments.username": current_user
-        })
-        
-        if existing_assignment:
-            raise HTTPException(status_code=400, detail="You have already collected this voucher")
-        
         # Check if voucher has expired
         if voucher.get("expires_at") and voucher["expires_at"] < datetime.utcnow():
             raise HTTPException(status_code=400, detail="This voucher has expired")
         
-        # Add user assignment
-        user_assignment = {
-            "username": current_user,
-            "discount_code": voucher["code"],
-            "collected_at": datetime.utcnow(),
-            "is_used": False,
-            "used_at": None
-        }
-        
-        discounts_collection.update_one(
-            {"_id": ObjectId(voucher_id)},
-            {"$push": {"user_assignments": user_assignment}}
-        )
+        # Add user assignment; the unique (username, code) index rejects a second collect
+        try:
+            voucher_assignments_collection.insert_one(new_assignment(current_user, voucher))
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="You have already collected this voucher")
         
         return {
             "message": f"Voucher {voucher['code']} collected successfully!",
@@ -210,43 +96,24 @@ async def collect_all_vouchers(current_user: str = Depends(verify_token)):
     """Collect all available vouchers for the user"""
     try:
         # Find all active vouchers that user hasn't collected yet
+        collected_codes = voucher_assignments_collection.distinct("code", {"username": current_user})
         available_vouchers = list(discounts_collection.find({
             "is_active": True,
             "expires_at": {"$gt": datetime.utcnow()},
-            "user_assignments.username": {"$ne": current_user}
+            "code": {"$nin": collected_codes}
         }))
         
-        collected_count = 0
-        collected_vouchers = []
-        
-        for voucher in available_vouchers:
-            # Check if user already has this voucher (double check)
-            has_voucher = any(
-                assignment.get("username") == current_user 
-                for assignment in voucher.get("user_assignments", [])
-            )
-            
-            if not has_voucher:
-                user_assignment = {
-                    "username": current_user,
-                    "discount_code": voucher["code"],
-                    "collected_at": datetime.utcnow(),
-                    "is_used": False,
-                    "used_at": None
-                }
-                
-                discounts_collection.update_one(
-                    {"_id": voucher["_id"]},
-                    {"$push": {"user_assignments": user_assignment}}
-                )
-                
-                collected_count += 1
-                collected_vouchers.append({
-                    "code": voucher["code"],
-                    "percentage": voucher["percentage"],
-                    "description": voucher["description"],
-                    "voucher_type": voucher.get("voucher_type", "clothes")
-                })
+        # One bulk_write for every voucher; ones collected concurrently are skipped
+        collected_vouchers = [
+            {
+                "code": voucher["code"],
+                "percentage": voucher["percentage"],
+                "description": voucher["description"],
+                "voucher_type": voucher.get("voucher_type", "clothes")
+            }
+            for voucher in bulk_assign_vouchers(current_user, available_vouchers)
+        ]
+        collected_count = len(collected_vouchers)
         
         return {
             "message": f"Successfully collected {collected_count} vouchers!",
@@ -261,33 +128,26 @@ async def collect_all_vouchers(current_user: str = Depends(verify_token)):
 async def get_available_vouchers(current_user: str = Depends(verify_token)):
     """Get all vouchers available for collection (not yet collected by user)"""
     try:
-        # Find all active vouchers
-        all_vouchers = list(discounts_collection.find({
-            "is_active": True,
-            "expires_at": {"$gt": datetime.utcnow()}
-        }))
-        
-        available_vouchers = []
-        
-        for voucher in all_vouchers:
-            # Check if user has already collected this voucher
-            user_has_voucher = any(
-                assignment.get("username") == current_user 
-                for assignment in voucher.get("user_assignments", [])
-            )
-            
-            if not user_has_voucher:
-                available_vouchers.append({
-                    "_id": str(voucher["_id"]),
-                    "code": voucher["code"],
-                    "percentage": voucher["percentage"],
-                    "description": voucher["description"],
-                    "detailed_description": voucher.get("detailed_description"),
-                    "expires_at": voucher["expires_at"].isoformat(),
-                    "usage_limit": voucher.get("usage_limit"),
-                    "used_count": voucher.get("used_count", 0),
-                    "voucher_type": voucher.get("voucher_type", "clothes")
-                })
+        # Find all active vouchers the user has not collected yet
+        collected_codes = voucher_assignments_collection.distinct("code", {"username": current_user})
+        available_vouchers = [
+            {
+                "_id": str(voucher["_id"]),
+                "code": voucher["code"],
+                "percentage": voucher["percentage"],
+                "description": voucher["description"],
+                "detailed_description": voucher.get("detailed_description"),
+                "expires_at": voucher["expires_at"].isoformat(),
+                "usage_limit": voucher.get("usage_limit"),
+                "used_count": voucher.get("used_count", 0),
+                "voucher_type": voucher.get("voucher_type", "clothes")
+            }
+            for voucher in discounts_collection.find({
+                "is_active": True,
+                "expires_at": {"$gt": datetime.utcnow()},
+                "code": {"$nin": collected_codes}
+            })
+        ]
         
         # Separate by type
         clothes_vouchers = [v for v in available_vouchers if v["voucher_type"] == "clothes"]
@@ -376,6 +236,8 @@ async def delete_discount(discount_id: str, current_user: str = Depends(verify_t
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Discount not found")
         
+        voucher_assignments_collection.delete_many({"discount_id": ObjectId(discount_id)})
+        
         return {"message": "Discount deleted successfully"}
     
     except HTTPException:
@@ -401,33 +263,16 @@ async def assign_discount_to_user(assignment: UserDiscountAssignment, admin_user
             raise HTTPException(status_code=404, detail="Discount code not found or inactive")
         
         # Create user-specific discount assignment
-        user_discount = {
-            "user_id": str(target_user["_id"]),
-            "username": assignment.username,
-            "discount_id": str(discount["_id"]),
-            "discount_code": assignment.discount_code.upper(),
-            "assigned_by": admin_user,
-            "assigned_at": datetime.utcnow(),
-            "notes": assignment.notes,
-            "is_used": False,
-            "used_at": None
-        }
-        
-        # Check if user already has this discount assigned
-        existing_assignment = discounts_collection.find_one({
-            "user_assignments.username": assignment.username,
-            "user_assignments.discount_code": assignment.discount_code.upper()
-        })
+        user_discount = new_assignment(
+            assignment.username, discount, admin_user,
+            user_id=str(target_user["_id"]), notes=assignment.notes
+        )
         
-        if existing_assignment:
+        try:
+            voucher_assignments_collection.insert_one(user_discount)
+        except DuplicateKeyError:
             raise HTTPException(status_code=400, detail="Discount already assigned to this user")
         
-        # Add assignment to discount document
-        discounts_collection.update_one(
-            {"_id": discount["_id"]},
-            {"$push": {"user_assignments": user_discount}}
-        )
-        
         return {
             "message": f"Discount {assignment.discount_code} successfully assigned to user {assignment.username}",
             "assignment": {
@@ -454,26 +299,19 @@ async def get_user_discounts(username: str, admin_user: str = Depends(verify_adm
             raise HTTPException(status_code=404, detail="User not found")
         
         # Find all discounts assigned to this user
-        user_discounts = list(discounts_collection.find({
-            "user_assignments.username": username
-        }))
-        
         assigned_discounts = []
-        for discount in user_discounts:
-            user_assignments = discount.get("user_assignments", [])
-            for assignment in user_assignments:
-                if assignment["username"] == username:
-                    assigned_discounts.append({
-                        "discount_code": assignment["discount_code"],
-                        "percentage": discount["percentage"],
-                        "description": discount["description"],
-                        "assigned_by": assignment["assigned_by"],
-                        "assigned_at": assignment["assigned_at"].isoformat(),
-                        "is_used": assignment["is_used"],
-                        "used_at": assignment["used_at"].isoformat() if assignment["used_at"] else None,
-                        "notes": assignment.get("notes"),
-                        "expires_at": discount["expires_at"].isoformat() if discount.get("expires_at") else None
-                    })
+        for assignment, discount in find_user_vouchers(username):
+            assigned_discounts.append({
+                "discount_code": assignment["code"],
+                "percentage": discount["percentage"],
+                "description": discount["description"],
+                "assigned_by": assignment.get("assigned_by"),
+                "assigned_at": assignment["assigned_at"].isoformat(),
+                "is_used": assignment["is_used"],
+                "used_at": assignment["used_at"].isoformat() if assignment["used_at"] else None,
+                "notes": assignment.get("notes"),
+                "expires_at": discount["expires_at"].isoformat() if discount.get("expires_at") else None
+            })
         
         return {
             "username": username,
@@ -490,32 +328,24 @@ async def get_user_discounts(username: str, admin_user: str = Depends(verify_adm
 async def get_my_assigned_discounts(current_user: str = Depends(verify_token)):
     """Get all discounts assigned to the current user"""
     try:
-        # Find all discounts assigned to this user
-        user_discounts = list(discounts_collection.find({
-            "user_assignments.username": current_user,
-            "is_active": True
-        }))
-        
+        # Find all active discounts assigned to this user
         my_discounts = []
-        for discount in user_discounts:
-            user_assignments = discount.get("user_assignments", [])
-            for assignment in user_assignments:
-                if assignment["username"] == current_user:
-                    # Check if discount is still valid
-                    is_expired = discount.get("expires_at") and discount["expires_at"] < datetime.utcnow()
-                    
-                    my_discounts.append({
-                        "discount_code": assignment["discount_code"],
-                        "percentage": discount["percentage"],
-                        "description": discount["description"],
-                        "assigned_at": assignment["assigned_at"].isoformat(),
-                        "is_used": assignment["is_used"],
-                        "used_at": assignment["used_at"].isoformat() if assignment["used_at"] else None,
-                        "expires_at": discount["expires_at"].isoformat() if discount.get("expires_at") else None,
-                        "is_expired": is_expired,
-                        "voucher_type": discount.get("voucher_type"),
-                        "notes": assignment.get("notes")
-                    })
+        for assignment, discount in find_user_vouchers(current_user, active_only=True):
+            # Check if discount is still valid
+            is_expired = discount.get("expires_at") and discount["expires_at"] < datetime.utcnow()
+            
+            my_discounts.append({
+                "discount_code": assignment["code"],
+                "percentage": discount["percentage"],
+                "description": discount["description"],
+                "assigned_at": assignment["assigned_at"].isoformat(),
+                "is_used": assignment["is_used"],
+                "used_at": assignment["used_at"].isoformat() if assignment["used_at"] else None,
+                "expires_at": discount["expires_at"].isoformat() if discount.get("expires_at") else None,
+                "is_expired": is_expired,
+                "voucher_type": discount.get("voucher_type"),
+                "notes": assignment.get("notes")
+            })
         
         return {
             "username": current_user,
@@ -530,26 +360,19 @@ async def get_my_assigned_discounts(current_user: str = Depends(verify_token)):
 async def apply_assigned_discount(discount_apply: DiscountApply, current_user: str = Depends(verify_token)):
     """Apply a discount code that was specifically assigned to the current user"""
     try:
-        # Find the discount with user assignment
+        # Find the user's assignment and the discount it refers to
+        user_assignment = voucher_assignments_collection.find_one({
+            "username": current_user,
+            "code": discount_apply.code.upper()
+        })
         discount = discounts_collection.find_one({
             "code": discount_apply.code.upper(),
-            "is_active": True,
-            "user_assignments.username": current_user
-        })
+            "is_active": True
+        }) if user_assignment else None
         
         if not discount:
             raise HTTPException(status_code=404, detail="Invalid discount code or not assigned to you")
         
-        # Find the specific assignment for this user
-        user_assignment = None
-        for assignment in discount.get("user_assignments", []):
-            if assignment["username"] == current_user:
-                user_assignment = assignment
-                break
-        
-        if not user_assignment:
-            raise HTTPException(status_code=404, detail="Discount not assigned to you")
-        
         # Check if already used
         if user_assignment["is_used"]:
             raise HTTPException(status_code=400, detail="This discount has already been used")
@@ -562,20 +385,13 @@ async def apply_assigned_discount(discount_apply: DiscountApply, current_user: s
         discount_amount = (discount_apply.total_amount * discount["percentage"]) / 100
         final_amount = discount_apply.total_amount - discount_amount
         
-        # Mark as used
-        discounts_collection.update_one(
-            {
-                "_id": discount["_id"],
-                "user_assignments.username": current_user,
-                "user_assignments.discount_code": discount_apply.code.upper()
-            },
-            {
-                "$set": {
-                    "user_assignments.$.is_used": True,
-                    "user_assignments.$.used_at": datetime.utcnow()
-                }
-            }
+        # Mark as used, unless a concurrent request got there first
+        result = voucher_assignments_collection.update_one(
+            {"_id": user_assignment["_id"], "is_used": False},
+            {"$set": {"is_used": True, "used_at": datetime.utcnow()}}
         )
+        if result.modified_count == 0:
+            raise HTTPException(status_code=400, detail="This discount has already been used")
         
         return {
             "original_amount": discount_apply.total_amount,
@@ -593,74 +409,15 @@ async def apply_assigned_discount(discount_apply: DiscountApply, current_user: s
         raise HTTPException(status_code=500, detail=f"Failed to apply assigned discount: {str(e)}")
 
 @router.post("/auto-assign-vouchers/{username}")
-async def auto_assign_vouchers(username: str):
-    """Auto-assign 20 mixed vouchers to a user (called during first login only)"""
+def auto_assign_vouchers(username: str, admin_user: str = Depends(verify_admin)):
+    """
+    Admin function to grant a user's 20 welcome vouchers, e.g. after a failed
+    background grant at login. A plain def so the blocking writes run in the threadpool.
+    """
     try:
-        # Check if user exists
-        user = users_collection.find_one({"username": username})
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Check if user already has welcome vouchers assigned
-        if user.get("welcome_vouchers_assigned", False):
-            return {
-                "message": f"User {username} has already received their welcome vouchers",
-                "assigned_count": 0,
-                "vouchers": []
-            }
-        
-        # Check if user already has any vouchers assigned (extra safety check)
-        existing_vouchers = list(discounts_collection.find({
-            "user_assignments.username": username
-        }))
-        
-        if existing_vouchers:
-            return {
-                "message": f"User {username} already has vouchers assigned",
-                "existing_vouchers_count": len(existing_vouchers),
-                "assigned_count": 0,
-                "vouchers": []
-            }
-        
-        # Generate 20 new vouchers for this user
-        voucher_response = await generate_random_discounts()
-        generated_vouchers = voucher_response["discounts"]
-        
-        # Auto-assign all generated vouchers to the user
-        assigned_count = 0
-        assigned_vouchers = []
-        
-        for voucher in generated_vouchers:
-            user_assignment = {
-                "username": username,
-                "discount_code": voucher["code"],
-                "collected_at": datetime.utcnow(),
-                "assigned_at": datetime.utcnow(),
-                "assigned_by": "system",
-                "is_used": False,
-                "used_at": None,
-                "assignment_type": "welcome_bonus"
-            }
-            
-            discounts_collection.update_one(
-                {"_id": ObjectId(voucher["_id"])},
-                {"$push": {"user_assignments": user_assignment}}
-            )
-            
-            assigned_count += 1
-            assigned_vouchers.append({
-                "code": voucher["code"],
-                "percentage": voucher["percentage"],
-                "description": voucher["description"],
-                "voucher_type": voucher.get("voucher_type", "clothes")
-            })
-        
-        return {
-            "message": f"Successfully auto-assigned {assigned_count} welcome vouchers to user {username}",
-            "assigned_count": assigned_count,
-            "vouchers": assigned_vouchers
-        }
+        return grant_welcome_vouchers(username)
     
+    except LookupError:
+        raise HTTPException(status_code=404, detail="User not found")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to auto-assign vouchers: {str(e)}")
-
@@ -1,5 +1,5 @@
 from fastapi import APIRouter, HTTPException, Depends
-from connection.database import payments_collection, users_collection, discounts_collection
+from connection.database import db, payments_collection, users_collection, discounts_collection, voucher_assignments_collection
 from models.payment import (
     PaymentCreate, PaymentUpdate, Payment, PaymentResponse, 
     PaymentStatus, PaymentMethod, Currency, ShippingStatus
@@ -7,12 +7,26 @@ from models.payment import (
 import os
 from models.payment import ShippingStatus
 from routes.auth import verify_token, verify_admin
-from datetime import datetime
+from services.cart_cache import cart_cache
+from services.rollup_service import record_completed_payment
+from services.payment_provider import payment_providers, get_payment_provider, generate_transaction_id
+from services.payment_queue import PaymentWorkQueue, RetryablePaymentError
+from services.idempotency import (
+    begin_idempotent_request, complete_idempotent_request,
+    release_idempotent_request, request_fingerprint
+)
+from datetime import datetime, timedelta
 from bson import ObjectId
 import uuid
 import random
-from typing import List, Dict, Any
-from fastapi import Body, Request
+import asyncio
+import json
+import base64
+from typing import List, Dict, Any, Optional, Literal
+from fastapi import Body, Request, Header, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pymongo import ReturnDocument
 from models.mongodb_models import MongoDBConnection, ProductModel
 import logging
 
@@ -21,14 +35,32 @@ logger = logging.getLogger(__name__)
 
 router = APIRouter()
 db_connection = MongoDBConnection()
+
+# Default and maximum page sizes for paginated payment listings
+PAYMENT_PAGE_SIZE = 50
+PAYMENT_PAGE_SIZE_MAX = 200
+
+# A queued/retrying payment untouched for this long is treated as abandoned by its process
+PAYMENT_RECOVERY_STALE_SECONDS = float(os.getenv("PAYMENT_RECOVERY_STALE_SECONDS", 300))
+# A charge is bounded by the provider timeout, so "charging" this long means the worker died mid-charge
+PAYMENT_CHARGING_STALE_SECONDS = float(os.getenv("PAYMENT_CHARGING_STALE_SECONDS", 300))
+
+# Processing states a worker may pick a payment up from
+CLAIMABLE_PROCESSING_STATES = ["queued", "retrying"]
+
+try:
+    payments_collection.create_index([("username", 1), ("payment_status", 1), ("created_at", -1)])
+    payments_collection.create_index([("username", 1), ("shipping_status", 1), ("created_at", -1)])
+    payments_collection.create_index([("created_at", -1), ("payment_id", -1)])
+    payments_collection.create_index([("payment_status", 1), ("created_at", -1)])
+    payments_collection.create_index([("shipping_status", 1), ("payment_status", 1), ("updated_at", -1)])
+except Exception as e:
+    logger.warning(f"Could not create payment indexes: {str(e)}")
+
 def generate_payment_id() -> str:
     """Generate a unique payment ID"""
     return f"PAY_{uuid.uuid4().hex[:12].upper()}"
 
-def generate_transaction_id() -> str:
-    """Generate a unique transaction ID"""
-    return f"TXN_{uuid.uuid4().hex[:16].upper()}"
-
 def calculate_tax(subtotal: float, tax_rate: float = 0.12) -> float:
     """Calculate tax amount (default 12% VAT)"""
     return round(subtotal * tax_rate, 2)
@@ -51,32 +83,31 @@ async def apply_discount_to_payment(discount_code: str, subtotal: float, usernam
         return 0.0, "", {}
     
     # First check for user-assigned discounts
-    user_discount = discounts_collection.find_one({
+    user_assignment = voucher_assignments_collection.find_one({
+        "username": username,
         "code": discount_code.upper(),
-        "is_active": True,
-        "user_assignments.username": username,
-        "user_assignments.is_used": False
+        "is_used": False
     })
+    user_discount = discounts_collection.find_one({
+        "code": discount_code.upper(),
+        "is_active": True
+    }) if user_assignment else None
     
     if user_discount:
-        # Find the specific assignment for this user
-        user_assignment = None
-        for assignment in user_discount.get("user_assignments", []):
-            if assignment["username"] == username and not assignment["is_used"]:
-                user_assignment = assignment
-                break
-        
-        if user_assignment:
-            # Check if discount has expired
-            if user_discount.get("expires_at") and user_discount["expires_at"] < datetime.utcnow():
-                raise HTTPException(status_code=400, detail="Discount code has expired")
-            
-            discount_amount = (subtotal * user_discount["percentage"]) / 100
-            return round(discount_amount, 2), user_discount["description"], {
-                "type": "user_assigned",
-                "discount_id": str(user_discount["_id"]),
-                "assignment": user_assignment
-            }
+        # Check if discount has expired
+        if user_discount.get("expires_at") and user_discount["expires_at"] < datetime.utcnow():
+            raise HTTPException(status_code=400, detail="Discount code has expired")
+        
+        assignment_id = user_assignment.pop("_id")
+        user_assignment["discount_id"] = str(user_assignment["discount_id"])
+        
+        discount_amount = (subtotal * user_discount["percentage"]) / 100
+        return round(discount_amount, 2), user_discount["description"], {
+            "type": "user_assigned",
+            "discount_id": str(user_discount["_id"]),
+            "assignment_id": str(assignment_id),
+            "assignment": user_assignment
+        }
     
     # Check for general public discounts
     discount = discounts_collection.find_one({
@@ -99,44 +130,50 @@ async def apply_discount_to_payment(discount_code: str, subtotal: float, usernam
         "discount_id": str(discount["_id"])
     }
 
-def simulate_payment_processing(payment_method: PaymentMethod):
-    """Simulate payment processing with different providers"""
-    # Simulate processing time
-    import time
-    import random
-    
-    time.sleep(1)  # Simulate processing delay
-    
-    # 95% success rate for simulation
-    success = random.random() < 0.95
-    
-    if success:
-        transaction_id = generate_transaction_id()
-        return {
-            "status": "success",
-            "transaction_id": transaction_id,
-            "provider_response": {
-                "payment_method": payment_method,
-                "processed_at": datetime.utcnow().isoformat(),
-                "provider_transaction_id": transaction_id,
-                "provider_status": "completed"
-            }
-        }
-    else:
+async def charge_with_provider(payment_method: PaymentMethod, amount: float) -> Dict[str, Any]:
+    """Charge a payment through the adapter registered for its payment method"""
+    provider = get_payment_provider(payment_method.value)
+    if not provider:
+        # queue_payment rejects these up front; fail rather than retry if one slips through
         return {
             "status": "failed",
             "transaction_id": None,
             "provider_response": {
-                "payment_method": payment_method,
+                "payment_method": payment_method.value,
                 "processed_at": datetime.utcnow().isoformat(),
-                "error_code": "PAYMENT_DECLINED",
-                "error_message": "Payment was declined by the provider"
+                "error_code": "UNSUPPORTED_PAYMENT_METHOD",
+                "error_message": f"Unsupported payment method: {payment_method.value}"
             }
         }
+    return await provider.process(payment_method.value, amount)
 
 @router.post("/create-payment", response_model=PaymentResponse)
-async def create_payment(payment_data: PaymentCreate, current_user: str = Depends(verify_token)):
-    """Create a new payment transaction"""
+async def create_payment(
+    payment_data: PaymentCreate,
+    current_user: str = Depends(verify_token),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Create a new payment transaction; retries with the same Idempotency-Key replay the first response"""
+    if not idempotency_key:
+        return await create_payment_record(payment_data, current_user)
+    
+    replay = begin_idempotent_request(
+        "create-payment", current_user, idempotency_key, request_fingerprint(payment_data.dict())
+    )
+    if replay:
+        return replay
+    
+    try:
+        response = await create_payment_record(payment_data, current_user)
+    except Exception:
+        release_idempotent_request("create-payment", current_user, idempotency_key)
+        raise
+    
+    complete_idempotent_request("create-payment", current_user, idempotency_key, 200, response)
+    return response
+
+async def create_payment_record(payment_data: PaymentCreate, current_user: str) -> PaymentResponse:
+    """Price the order, apply discounts and insert a PENDING payment"""
     try:
         print("Received payment data:", payment_data.dict())
 
@@ -219,94 +256,266 @@ async def create_payment(payment_data: PaymentCreate, current_user: str = Depend
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create payment: {str(e)}")
 
-@router.post("/process-payment/{payment_id}")
-async def process_payment(payment_id: str, current_user: str = Depends(verify_token)):
-    """Process a pending payment"""
+def consume_payment_discounts(payment: Dict[str, Any]):
+    """Mark the discounts applied to a completed payment as used"""
+    for applied in payment.get("discount_info") or []:
+        discount_info = applied.get("info") or {}
+        
+        if discount_info.get("type") == "user_assigned":
+            # Mark user-assigned discount as used
+            voucher_assignments_collection.update_one(
+                {"username": payment["username"], "code": applied["code"].upper()},
+                {"$set": {"is_used": True, "used_at": datetime.utcnow()}}
+            )
+        elif discount_info.get("type") == "public":
+            # Increment usage count for public discount
+            discounts_collection.update_one(
+                {"_id": ObjectId(discount_info["discount_id"])},
+                {"$inc": {"used_count": 1}}
+            )
+
+def mark_payment_retrying(payment_id: str, last_error: Dict[str, Any]):
+    """Hand a claimed payment back so the next attempt (or recovery) can claim it"""
+    payments_collection.update_one(
+        {
+            "payment_id": payment_id,
+            "payment_status": PaymentStatus.PROCESSING,
+            "payment_details.processing_state": "charging"
+        },
+        {"$set": {
+            "payment_details.processing_state": "retrying",
+            "payment_details.last_error": last_error,
+            "updated_at": datetime.utcnow()
+        }}
+    )
+
+async def run_payment_job(payment_id: str, attempt: int):
+    """Queue worker: charge a PROCESSING payment and record the outcome"""
+    # Claim the charge atomically, so a payment queued in two processes is charged once
+    payment = payments_collection.find_one_and_update(
+        {
+            "payment_id": payment_id,
+            "payment_status": PaymentStatus.PROCESSING,
+            "payment_details.processing_state": {"$in": CLAIMABLE_PROCESSING_STATES}
+        },
+        {"$set": {
+            "payment_details.processing_state": "charging",
+            "payment_details.attempts": attempt,
+            "updated_at": datetime.utcnow()
+        }},
+        return_document=ReturnDocument.AFTER
+    )
+    if not payment:
+        # Cancelled, settled or being charged elsewhere while it was queued
+        return
+    
     try:
-        # Find the payment
-        payment = payments_collection.find_one({
+        payment_result = await charge_with_provider(PaymentMethod(payment["payment_method"]), payment["total_amount"])
+    except Exception as e:
+        # Leave the payment claimable for the retry
+        mark_payment_retrying(payment_id, {"error_message": str(e)})
+        raise
+    provider_response = payment_result["provider_response"]
+    
+    if payment_result["status"] != "success" and provider_response.get("error_code") == "PROVIDER_TIMEOUT":
+        mark_payment_retrying(payment_id, provider_response)
+        raise RetryablePaymentError(provider_response["error_message"])
+    
+    if payment_result["status"] == "success":
+        # Payment successful
+        update_data = {
+            "payment_status": PaymentStatus.COMPLETED,
+            "transaction_id": payment_result["transaction_id"],
+            "completed_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow(),
+            "payment_details": {**provider_response, "processing_state": "done", "attempts": attempt}
+        }
+    else:
+        # Payment failed
+        update_data = {
+            "payment_status": PaymentStatus.FAILED,
+            "updated_at": datetime.utcnow(),
+            "payment_details": {**provider_response, "processing_state": "done", "attempts": attempt}
+        }
+    
+    # Guarded on PROCESSING so a cancellation made while charging is not overwritten
+    result = payments_collection.update_one(
+        {
             "payment_id": payment_id,
-            "username": current_user,
-            "payment_status": PaymentStatus.PENDING
-        })
-        
-        if not payment:
-            raise HTTPException(status_code=404, detail="Payment not found or already processed")
-        
-        # Update status to processing
+            "payment_status": PaymentStatus.PROCESSING,
+            "payment_details.processing_state": "charging"
+        },
+        {"$set": update_data}
+    )
+    
+    if not result.modified_count and payment_result["status"] == "success":
+        # The status changed under us after the provider took the money; keep the
+        # transaction so the payment can be refunded or reconciled
         payments_collection.update_one(
             {"payment_id": payment_id},
+            {"$set": {
+                "transaction_id": payment_result["transaction_id"],
+                "payment_details.orphaned_charge": provider_response,
+                "payment_details.reconciliation_required": True,
+                "updated_at": datetime.utcnow()
+            }}
+        )
+        logger.error(f"Payment {payment_id} was charged after leaving processing; flagged for reconciliation")
+    
+    if result.modified_count and payment_result["status"] == "success":
+        consume_payment_discounts(payment)
+        record_completed_payment(db, payment)
+        
+        # Checkout completed: the client clears the cart next, so drop cached totals now
+        cart_cache.invalidate(payment["username"])
+
+async def fail_payment_job(payment_id: str, attempts: int, error: str):
+    """Queue give-up hook: record a payment that exhausted its retries as failed"""
+    payments_collection.update_one(
+        {"payment_id": payment_id, "payment_status": PaymentStatus.PROCESSING},
+        {"$set": {
+            "payment_status": PaymentStatus.FAILED,
+            "updated_at": datetime.utcnow(),
+            "payment_details": {
+                "processing_state": "done",
+                "attempts": attempts,
+                "processed_at": datetime.utcnow().isoformat(),
+                "error_code": "PROCESSING_FAILED",
+                "error_message": error
+            }
+        }}
+    )
+
+def recover_abandoned_payments() -> List[str]:
+    """
+    Queue-recovery sweep, run in every process. Payments left "queued" or
+    "retrying" past PAYMENT_RECOVERY_STALE_SECONDS are claimed one by one with
+    a conditional update, so only one process re-queues each. Payments stuck
+    "charging" are failed rather than charged again, since the provider may
+    already have taken the money; they need manual reconciliation.
+    """
+    now = datetime.utcnow()
+    
+    interrupted = payments_collection.update_many(
+        {
+            "payment_status": PaymentStatus.PROCESSING,
+            "payment_details.processing_state": "charging",
+            "updated_at": {"$lt": now - timedelta(seconds=PAYMENT_CHARGING_STALE_SECONDS)}
+        },
+        {"$set": {
+            "payment_status": PaymentStatus.FAILED,
+            "updated_at": now,
+            "payment_details.processing_state": "done",
+            "payment_details.processed_at": now.isoformat(),
+            "payment_details.error_code": "PROCESSING_INTERRUPTED",
+            "payment_details.error_message": "Processing stopped while charging; check the provider before retrying"
+        }}
+    )
+    if interrupted.modified_count:
+        logger.warning(f"Failed {interrupted.modified_count} payments interrupted while charging")
+    
+    stale = {
+        "payment_status": PaymentStatus.PROCESSING,
+        "payment_details.processing_state": {"$in": CLAIMABLE_PROCESSING_STATES},
+        "updated_at": {"$lt": now - timedelta(seconds=PAYMENT_RECOVERY_STALE_SECONDS)}
+    }
+    claimed = []
+    for candidate in payments_collection.find(stale, {"payment_id": 1}):
+        # Refreshing updated_at is the claim: other processes no longer see it as stale
+        payment = payments_collection.find_one_and_update(
+            {**stale, "payment_id": candidate["payment_id"]},
+            {"$set": {
+                "payment_details.processing_state": "queued",
+                "payment_details.recovered_at": now,
+                "updated_at": now
+            }},
+            projection={"payment_id": 1}
+        )
+        if payment:
+            claimed.append(payment["payment_id"])
+    return claimed
+
+payment_queue = PaymentWorkQueue(run_payment_job, fail_payment_job, recover=recover_abandoned_payments)
+
+@router.get("/admin/payment-queue-stats")
+async def payment_queue_metrics(admin_user: str = Depends(verify_admin)):
+    """Payment queue metrics (workers, queue depth, in-flight and scheduled retries)"""
+    return payment_queue.stats()
+
+@router.post("/process-payment/{payment_id}", status_code=202)
+async def process_payment(
+    payment_id: str,
+    request: Request,
+    current_user: str = Depends(verify_token),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
+):
+    """Accept a pending payment for processing; poll status_url for the outcome"""
+    if not idempotency_key:
+        return await queue_payment(payment_id, request, current_user)
+    
+    replay = begin_idempotent_request(
+        "process-payment", current_user, idempotency_key, request_fingerprint({"payment_id": payment_id})
+    )
+    if replay:
+        return replay
+    
+    try:
+        response = await queue_payment(payment_id, request, current_user)
+    except Exception:
+        release_idempotent_request("process-payment", current_user, idempotency_key)
+        raise
+    
+    complete_idempotent_request("process-payment", current_user, idempotency_key, 202, response)
+    return response
+
+async def queue_payment(payment_id: str, request: Request, current_user: str) -> Dict[str, Any]:
+    """Move a PENDING payment to PROCESSING and hand it to the payment queue"""
+    try:
+        # Conditional state transition: only one of two racing requests can
+        # move the payment out of PENDING
+        payment = payments_collection.find_one_and_update(
+            {
+                "payment_id": payment_id,
+                "username": current_user,
+                "payment_status": PaymentStatus.PENDING,
+                "payment_method": {"$in": list(payment_providers)}
+            },
             {
                 "$set": {
                     "payment_status": PaymentStatus.PROCESSING,
-                    "updated_at": datetime.utcnow()
+                    "updated_at": datetime.utcnow(),
+                    "payment_details": {"processing_state": "queued", "attempts": 0}
                 }
-            }
+            },
+            projection={"total_amount": 1, "currency": 1},
+            return_document=ReturnDocument.AFTER
         )
         
-        # Simulate payment processing
-        payment_result = simulate_payment_processing(PaymentMethod(payment["payment_method"]))
-        
-        if payment_result["status"] == "success":
-            # Payment successful
-            update_data = {
-                "payment_status": PaymentStatus.COMPLETED,
-                "transaction_id": payment_result["transaction_id"],
-                "completed_at": datetime.utcnow(),
-                "updated_at": datetime.utcnow(),
-                "payment_details": payment_result["provider_response"]
-            }
-            
-            # Handle discount usage based on type
-            if payment.get("discount_code") and payment.get("discount_info"):
-                discount_info = payment["discount_info"]
-                
-                if discount_info.get("type") == "user_assigned":
-                    # Mark user-assigned discount as used
-                    discounts_collection.update_one(
-                        {
-                            "_id": ObjectId(discount_info["discount_id"]),
-                            "user_assignments.username": current_user,
-                            "user_assignments.discount_code": payment["discount_code"].upper()
-                        },
-                        {
-                            "$set": {
-                                "user_assignments.$.is_used": True,
-                                "user_assignments.$.used_at": datetime.utcnow()
-                            }
-                        }
-                    )
-                elif discount_info.get("type") == "public":
-                    # Increment usage count for public discount
-                    discounts_collection.update_one(
-                        {"_id": ObjectId(discount_info["discount_id"])},
-                        {"$inc": {"used_count": 1}}
-                    )
-        else:
-            # Payment failed
-            update_data = {
-                "payment_status": PaymentStatus.FAILED,
-                "updated_at": datetime.utcnow(),
-                "payment_details": payment_result["provider_response"]
-            }
-        
-        # Update payment
-        payments_collection.update_one(
-            {"payment_id": payment_id},
-            {"$set": update_data}
-        )
+        if not payment:
+            pending = payments_collection.find_one(
+                {"payment_id": payment_id, "username": current_user, "payment_status": PaymentStatus.PENDING},
+                {"payment_method": 1}
+            )
+            if pending:
+                raise HTTPException(status_code=400, detail=f"Unsupported payment method: {pending.get('payment_method')}")
+            raise HTTPException(status_code=404, detail="Payment not found or already processed")
         
-        # Get updated payment
-        updated_payment = payments_collection.find_one({"payment_id": payment_id})
+        try:
+            payment_queue.enqueue(payment_id)
+        except asyncio.QueueFull:
+            payments_collection.update_one(
+                {"payment_id": payment_id, "payment_status": PaymentStatus.PROCESSING},
+                {"$set": {"payment_status": PaymentStatus.PENDING, "payment_details": {}}}
+            )
+            raise HTTPException(status_code=503, detail="Payment queue is full, please retry shortly")
         
         return {
             "payment_id": payment_id,
-            "status": updated_payment["payment_status"],
-            "transaction_id": updated_payment.get("transaction_id"),
-            "total_amount": updated_payment["total_amount"],
-            "currency": updated_payment["currency"],
-            "message": "Payment processed successfully" if payment_result["status"] == "success" else "Payment processing failed",
-            "details": updated_payment.get("payment_details", {})
+            "status": PaymentStatus.PROCESSING,
+            "total_amount": payment["total_amount"],
+            "currency": payment["currency"],
+            "message": "Payment accepted for processing",
+            "status_url": str(request.url_for("get_payment_status", payment_id=payment_id))
         }
     
     except HTTPException:
@@ -349,15 +558,47 @@ async def get_payment_details(payment_id: str, current_user: str = Depends(verif
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch payment details: {str(e)}")
 
+@router.get("/payments/{payment_id}/status")
+async def get_payment_status(payment_id: str, current_user: str = Depends(verify_token)):
+    """Lightweight processing status of a payment, for polling after process-payment"""
+    try:
+        payment = payments_collection.find_one(
+            {"payment_id": payment_id, "username": current_user},
+            {"payment_status": 1, "transaction_id": 1, "total_amount": 1, "currency": 1, "payment_details": 1}
+        )
+        
+        if not payment:
+            raise HTTPException(status_code=404, detail="Payment not found")
+        
+        return {
+            "payment_id": payment_id,
+            "status": payment["payment_status"],
+            "transaction_id": payment.get("transaction_id"),
+            "total_amount": payment["total_amount"],
+            "currency": payment["currency"],
+            "details": payment.get("payment_details", {})
+        }
+    
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to fetch payment status: {str(e)}")
+
 @router.post("/cancel-payment/{payment_id}")
 async def cancel_payment(payment_id: str, current_user: str = Depends(verify_token)):
-    """Cancel a pending payment"""
+    """Cancel a pending payment, or a queued one that is not being charged right now"""
     try:
         result = payments_collection.update_one(
             {
                 "payment_id": payment_id,
                 "username": current_user,
-                "payment_status": {"$in": [PaymentStatus.PENDING, PaymentStatus.PROCESSING]}
+                "$or": [
+                    {"payment_status": PaymentStatus.PENDING},
+                    {
+                        "payment_status": PaymentStatus.PROCESSING,
+                        "payment_details.processing_state": {"$in": CLAIMABLE_PROCESSING_STATES}
+                    }
+                ]
             },
             {
                 "$set": {
@@ -368,6 +609,17 @@ async def cancel_payment(payment_id: str, current_user: str = Depends(verify_tok
         )
         
         if result.matched_count == 0:
+            charging = payments_collection.find_one(
+                {
+                    "payment_id": payment_id,
+                    "username": current_user,
+                    "payment_status": PaymentStatus.PROCESSING,
+                    "payment_details.processing_state": "charging"
+                },
+                {"_id": 1}
+            )
+            if charging:
+                raise HTTPException(status_code=409, detail="Payment is being charged and can no longer be cancelled")
             raise HTTPException(status_code=404, detail="Payment not found or cannot be cancelled")
         
         return {"message": "Payment cancelled successfully", "payment_id": payment_id}
@@ -391,11 +643,22 @@ async def get_all_payments(admin_user: str = Depends(verify_admin)):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch all payments: {str(e)}")
 
+def record_payment_status_change(previous_payment: Dict[str, Any], new_status: Optional[str]):
+    """Keep the daily rollups in step when an admin moves a payment into or out of completed"""
+    if not new_status:
+        return
+    was_completed = previous_payment.get("payment_status") == PaymentStatus.COMPLETED.value
+    is_completed = new_status == PaymentStatus.COMPLETED.value
+    if was_completed and not is_completed:
+        record_completed_payment(db, previous_payment, sign=-1)
+    elif is_completed and not was_completed:
+        record_completed_payment(db, previous_payment)
+
 @router.post("/admin/refund-payment/{payment_id}")
 async def refund_payment(payment_id: str, admin_user: str = Depends(verify_admin)):
     """Admin function to refund a completed payment"""
     try:
-        result = payments_collection.update_one(
+        refunded_payment = payments_collection.find_one_and_update(
             {
                 "payment_id": payment_id,
                 "payment_status": PaymentStatus.COMPLETED
@@ -408,9 +671,11 @@ async def refund_payment(payment_id: str, admin_user: str = Depends(verify_admin
             }
         )
         
-        if result.matched_count == 0:
+        if not refunded_payment:
             raise HTTPException(status_code=404, detail="Payment not found or cannot be refunded")
         
+        record_completed_payment(db, refunded_payment, sign=-1)
+        
         return {"message": "Payment refunded successfully", "payment_id": payment_id, "refunded_by": admin_user}
     
     except HTTPException:
@@ -419,7 +684,7 @@ async def refund_payment(payment_id: str, admin_user: str = Depends(verify_admin
         raise HTTPException(status_code=500, detail=f"Failed to refund payment: {str(e)}")
 
 @router.put("/admin/update-payment-status/{payment_id}")
-async def update_payment_status(payment_id: str, payload: dict):
+async def update_payment_status(payment_id: str, payload: dict, admin_user: str = Depends(verify_admin)):
     """
     Update the payment status of a specific payment.
     Admins can update the status, transaction ID, and payment details.
@@ -444,15 +709,17 @@ async def update_payment_status(payment_id: str, payload: dict):
         if payload.get("reason"):
             update_data["failure_reason"] = payload["reason"]
 
-        # Update the payment in the database
-        result = payments_collection.update_one(
+        # Update the payment in the database, keeping the previous version for the rollups
+        previous_payment = payments_collection.find_one_and_update(
             {"payment_id": payment_id},
             {"$set": update_data}
         )
 
         # Check if the update was successful
-        if result.matched_count == 0:
+        if not previous_payment:
             raise HTTPException(status_code=404, detail="Payment not found.")
+        
+        record_payment_status_change(previous_payment, update_data.get("payment_status"))
 
         # Ensure failure_reason is included in the response
         updated_payment = payments_collection.find_one({"payment_id": payment_id})
@@ -493,74 +760,71 @@ async def get_payment_statistics(current_user: str = Depends(verify_token)):
 @router.get("/payment-status-overview")
 async def get_payment_status_overview(
     request: Request, 
+    status: Optional[PaymentStatus] = None,
+    limit: int = Query(PAYMENT_PAGE_SIZE, ge=1, le=PAYMENT_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
     current_user: str = Depends(verify_token)
 ):
-    """Get overview of all payment statuses with product details and shipping status"""
+    """
+    Get overview of all payment statuses with product details and shipping status.
+    Each status bucket returns up to `limit` newest payments and a next_cursor;
+    pass status and cursor to load the next page of one bucket.
+    """
     try:
+        if cursor and not status:
+            raise HTTPException(status_code=400, detail="cursor requires a status")
+        
+        match = {"username": current_user}
+        if status:
+            match["payment_status"] = status.value
         
-        # Get all payments for the user
-        payments = list(payments_collection.find({"username": current_user}))
+        result = next(payments_collection.aggregate(bucketed_payments_pipeline(
+            match,
+            "$payment_status",
+            limit,
+            cursor=cursor,
+            projection={
+                "payment_id": 1,
+                "total_amount": 1,
+                "created_at": 1,
+                "payment_method": 1,
+                "payment_status": 1,
+                "transaction_id": 1,
+                "items": 1,
+                "shipping_status": 1,
+                "billing_address": 1,
+                "discount_amount": 1,
+                "tax_amount": 1,
+                "shipping_amount": 1
+            }
+        )))
         
         # Initialize status overview with shipping status
         status_overview = {
-            "PENDING": {"count": 0, "total_amount": 0.0, "payments": []},
-            "PROCESSING": {"count": 0, "total_amount": 0.0, "payments": []},
-            "COMPLETED": {"count": 0, "total_amount": 0.0, "payments": []},
-            "CANCELLED": {"count": 0, "total_amount": 0.0, "payments": []},
-            "REFUNDED": {"count": 0, "total_amount": 0.0, "payments": []},
+            key: {"count": 0, "total_amount": 0.0, "payments": [], "next_cursor": None}
+            for key in ["PENDING", "PROCESSING", "COMPLETED", "CANCELLED", "REFUNDED"]
         }
         
-        # Process each payment
-        for payment in payments:
-            status = payment["payment_status"].upper()
-            if status in status_overview:
-                # Fetch product details for each item
-                items_with_details = []
-                for item in payment.get("items", []):
-                    product_details = await get_product_details(item["product_id"], db_connection)
-                    
-                    item_with_details = {
-                        "product_id": item["product_id"],
-                        "product_name": product_details["name"],
-                        "product_image": process_product_image_url(product_details["image_path"], request),
-                        "quantity": item["quantity"],
-                        "unit_price": item["unit_price"],
-                        "total_price": item["total_price"]
-                    }
-                    items_with_details.append(item_with_details)
-                
-                # Ensure shipping status exists, default to not_shipped if missing
-                shipping_status = payment.get("shipping_status", ShippingStatus.NOT_SHIPPED.value)
-                
-                payment_info = {
-                    "payment_id": payment["payment_id"],
-                    "total_amount": payment["total_amount"],
-                    "created_at": payment["created_at"].isoformat(),
-                    "payment_method": payment["payment_method"],
-                    "payment_status": payment["payment_status"],
-                    "transaction_id": payment.get("transaction_id"),
-                    "items": items_with_details,
-                    "shipping_status": shipping_status,
-                    "billing_address": payment.get("billing_address", {}),
-                    "discount_amount": payment.get("discount_amount", 0.0),
-                    "tax_amount": payment.get("tax_amount", 0.0),
-                    "shipping_amount": payment.get("shipping_amount", 0.0)
-                }
-                
-                status_overview[status]["count"] += 1
-                status_overview[status]["total_amount"] += payment["total_amount"]
-                status_overview[status]["payments"].append(payment_info)
-        
-        # Round total amounts
-        for status in status_overview:
-            status_overview[status]["total_amount"] = round(status_overview[status]["total_amount"], 2)
+        total_payments = 0
+        for bucket in result["totals"]:
+            total_payments += bucket["count"]
+            key = str(bucket["_id"]).upper()
+            if key in status_overview:
+                status_overview[key]["count"] = bucket["count"]
+                status_overview[key]["total_amount"] = bucket["total_amount"]
         
-        # Close database connection
-        db_connection.close()
+        for payment in result["pages"]:
+            # Ensure shipping status exists, default to not_shipped if missing
+            payment["shipping_status"] = payment.get("shipping_status") or ShippingStatus.NOT_SHIPPED.value
+            payment["billing_address"] = payment.get("billing_address", {})
+            payment["discount_amount"] = payment.get("discount_amount", 0.0)
+            payment["tax_amount"] = payment.get("tax_amount", 0.0)
+            payment["shipping_amount"] = payment.get("shipping_amount", 0.0)
+        fill_payment_buckets(status_overview, result["pages"], limit, request, key=lambda bucket: str(bucket).upper())
         
         return {
             "user": current_user,
-            "total_payments": len(payments),
+            "total_payments": total_payments,
             "status_breakdown": status_overview,
             "summary": {
                 "pending": status_overview["PENDING"]["count"],
@@ -571,6 +835,8 @@ async def get_payment_status_overview(
             }
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error in payment status overview: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch payment status overview: {str(e)}")
@@ -659,6 +925,121 @@ def process_product_image_url(image_path: str, request: Request) -> str:
     
     return f"{base_url}/api/v1/serve-image/{filename}"
 
+def encode_payment_cursor(payment: Dict[str, Any]) -> str:
+    """Opaque keyset cursor pointing just after this payment in newest-first order"""
+    raw = json.dumps({"created_at": payment["created_at"].isoformat(), "payment_id": payment["payment_id"]})
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+def payment_cursor_match(cursor: str) -> Dict[str, Any]:
+    """$match condition selecting payments older than the cursor position"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        created_at = datetime.fromisoformat(position["created_at"])
+        payment_id = position["payment_id"]
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    
+    return {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "payment_id": {"$lt": payment_id}}
+    ]}
+
+def product_lookup_stages(projection: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """
+    Aggregation stages joining each payment's item products in one indexed
+    $lookup, projected to the fields the listings need
+    """
+    return [
+        {"$set": {"item_product_ids": {"$map": {
+            "input": {"$ifNull": ["$items", []]},
+            "as": "item",
+            "in": {"$convert": {"input": "$$item.product_id", "to": "objectId", "onError": None, "onNull": None}}
+        }}}},
+        {"$lookup": {
+            "from": "products",
+            "localField": "item_product_ids",
+            "foreignField": "_id",
+            "pipeline": [{"$project": projection or {"name": 1, "image_path": 1}}],
+            "as": "item_products"
+        }},
+        {"$unset": "item_product_ids"}
+    ]
+
+def attach_item_details(payment: Dict[str, Any], request: Request) -> List[Dict[str, Any]]:
+    """Build item details from the products joined by product_lookup_stages"""
+    products = {str(product["_id"]): product for product in payment.pop("item_products", [])}
+    
+    items_with_details = []
+    for item in payment.get("items", []):
+        product = products.get(item.get("product_id"), {})
+        items_with_details.append({
+            "product_id": item.get("product_id", "unknown"),
+            "product_name": product.get("name", "Product Not Found"),
+            "product_image": process_product_image_url(product.get("image_path", ""), request),
+            "quantity": item.get("quantity", 1),
+            "unit_price": item.get("unit_price", 0),
+            "total_price": item.get("total_price", 0)
+        })
+    return items_with_details
+
+def bucketed_payments_pipeline(
+    match: Dict[str, Any],
+    bucket_expr: Any,
+    limit: int,
+    cursor: Optional[str] = None,
+    projection: Optional[Dict[str, Any]] = None
+) -> List[Dict[str, Any]]:
+    """
+    One aggregation returning, per bucket, the count and rounded total of all
+    matching payments ("totals") plus the newest limit + 1 payments after the
+    cursor with their products joined ("pages", each tagged with "bucket")
+    """
+    page_stages = [{"$match": payment_cursor_match(cursor)}] if cursor else []
+    page_stages += [
+        {"$sort": {"created_at": -1, "payment_id": -1}},
+        {"$group": {
+            "_id": "$bucket",
+            "payments": {"$firstN": {"input": "$$ROOT", "n": limit + 1}}
+        }},
+        {"$unwind": "$payments"},
+        {"$replaceRoot": {"newRoot": "$payments"}},
+        {"$project": {**projection, "_id": 0, "bucket": 1} if projection else {"_id": 0}},
+        *product_lookup_stages(),
+        {"$sort": {"created_at": -1, "payment_id": -1}}
+    ]
+    
+    return [
+        {"$match": match},
+        {"$set": {"bucket": bucket_expr}},
+        {"$facet": {
+            "totals": [
+                {"$group": {
+                    "_id": "$bucket",
+                    "count": {"$sum": 1},
+                    "total_amount": {"$sum": "$total_amount"}
+                }},
+                {"$set": {"total_amount": {"$round": ["$total_amount", 2]}}}
+            ],
+            "pages": page_stages
+        }}
+    ]
+
+def fill_payment_buckets(buckets: Dict[str, Dict[str, Any]], pages: List[Dict[str, Any]], limit: int, request: Request, key=lambda bucket: bucket):
+    """Distribute page results into buckets, attaching item details and next_cursor"""
+    for payment in pages:
+        bucket = buckets.get(key(payment.pop("bucket")))
+        if bucket is None:
+            continue
+        if len(bucket["payments"]) == limit:
+            bucket["next_cursor"] = encode_payment_cursor(bucket["payments"][-1])
+            continue
+        payment["items"] = attach_item_details(payment, request)
+        bucket["payments"].append(payment)
+    
+    for bucket in buckets.values():
+        for payment in bucket["payments"]:
+            payment["created_at"] = payment["created_at"].isoformat()
+
 @router.get("/payments/shipping-status/{shipping_status}")
 async def get_payments_by_shipping_status_v2(
     shipping_status: str,
@@ -727,113 +1108,49 @@ async def get_payments_by_shipping_status_v2(
 @router.get("/payments/all-shipping-statuses")
 async def get_all_shipping_status_payments(
     request: Request,
+    shipping_status: Optional[ShippingStatus] = None,
+    limit: int = Query(PAYMENT_PAGE_SIZE, ge=1, le=PAYMENT_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
     current_user: str = Depends(verify_token)
 ):
-    """Get all payments grouped by shipping status for the current user"""
+    """
+    Get all payments grouped by shipping status for the current user.
+    Each bucket returns up to `limit` newest payments and a next_cursor;
+    pass shipping_status and cursor to load more of one bucket.
+    """
     try:
         logger.info(f"Fetching all shipping status payments for user: {current_user}")
         
-        # Initialize MongoDB connection for product lookups
-        try:
-            db_connection = MongoDBConnection()
-        except Exception as db_error:
-            logger.error(f"Failed to connect to database: {str(db_error)}")
-            raise HTTPException(status_code=500, detail="Database connection failed")
+        if cursor and not shipping_status:
+            raise HTTPException(status_code=400, detail="cursor requires a shipping_status")
         
-        shipping_data = {}
+        # Missing and null shipping statuses count as not_shipped
+        normalized_status = {"$ifNull": ["$shipping_status", ShippingStatus.NOT_SHIPPED.value]}
+        match = {"username": current_user}
+        if shipping_status == ShippingStatus.NOT_SHIPPED:
+            match["shipping_status"] = {"$in": [ShippingStatus.NOT_SHIPPED.value, None]}
+        elif shipping_status:
+            match["shipping_status"] = shipping_status.value
         
-        # Fetch payments for each shipping status
-        for status in ShippingStatus:
-            try:
-                logger.info(f"Processing shipping status: {status.value}")
-                
-                # Find payments with specific shipping status, including null/missing values for not_shipped
-                if status == ShippingStatus.NOT_SHIPPED:
-                    query = {
-                        "username": current_user,
-                        "$or": [
-                            {"shipping_status": status.value},
-                            {"shipping_status": {"$exists": False}},
-                            {"shipping_status": None}
-                        ]
-                    }
-                else:
-                    query = {
-                        "username": current_user,
-                        "shipping_status": status.value
-                    }
-                
-                payments = list(payments_collection.find(query).sort("created_at", -1))
-                logger.info(f"Found {len(payments)} payments for status {status.value}")
-                
-                # Process each payment to include product details
-                processed_payments = []
-                for payment in payments:
-                    try:
-                        # Fetch product details for each item
-                        items_with_details = []
-                        for item in payment.get("items", []):
-                            try:
-                                product_details = await get_product_details(item["product_id"], db_connection)
-                                
-                                item_with_details = {
-                                    "product_id": item["product_id"],
-                                    "product_name": product_details["name"],
-                                    "product_image": process_product_image_url(product_details["image_path"], request),
-                                    "quantity": item["quantity"],
-                                    "unit_price": item["unit_price"],
-                                    "total_price": item["total_price"]
-                                }
-                                items_with_details.append(item_with_details)
-                            except Exception as item_error:
-                                logger.error(f"Error processing item {item.get('product_id')}: {str(item_error)}")
-                                # Add item with basic info if product details fail
-                                items_with_details.append({
-                                    "product_id": item.get("product_id", "unknown"),
-                                    "product_name": item.get("product_name", "Unknown Product"),
-                                    "product_image": "https://via.placeholder.com/300x400?text=Fashion+Item",
-                                    "quantity": item.get("quantity", 1),
-                                    "unit_price": item.get("unit_price", 0),
-                                    "total_price": item.get("total_price", 0)
-                                })
-                        
-                        # Serialize payment and add product details
-                        serialized_payment = serialize_payment(payment.copy())
-                        serialized_payment["items"] = items_with_details
-                        # Ensure shipping_status is set
-                        serialized_payment["shipping_status"] = payment.get("shipping_status", ShippingStatus.NOT_SHIPPED.value)
-                        processed_payments.append(serialized_payment)
-                        
-                    except Exception as payment_error:
-                        logger.error(f"Error processing payment {payment.get('payment_id')}: {str(payment_error)}")
-                        # Add payment with minimal info to avoid complete failure
-                        try:
-                            minimal_payment = serialize_payment(payment.copy())
-                            minimal_payment["items"] = []
-                            minimal_payment["shipping_status"] = payment.get("shipping_status", ShippingStatus.NOT_SHIPPED.value)
-                            processed_payments.append(minimal_payment)
-                        except:
-                            continue
-                
-                shipping_data[status.value] = {
-                    "count": len(processed_payments),
-                    "payments": processed_payments,
-                    "total_amount": round(sum(p.get("total_amount", 0) for p in processed_payments), 2)
-                }
-                
-            except Exception as e:
-                logger.error(f"Error fetching {status.value} payments: {str(e)}")
-                shipping_data[status.value] = {
-                    "count": 0,
-                    "payments": [],
-                    "total_amount": 0.0
-                }
+        result = next(payments_collection.aggregate(bucketed_payments_pipeline(
+            match, normalized_status, limit, cursor=cursor
+        )))
         
-        # Close database connection
-        try:
-            db_connection.close()
-        except Exception as close_error:
-            logger.warning(f"Error closing database connection: {str(close_error)}")
+        statuses = [shipping_status] if shipping_status else list(ShippingStatus)
+        shipping_data = {
+            status.value: {"count": 0, "payments": [], "total_amount": 0.0, "next_cursor": None}
+            for status in statuses
+        }
+        for bucket in result["totals"]:
+            if bucket["_id"] in shipping_data:
+                shipping_data[bucket["_id"]]["count"] = bucket["count"]
+                shipping_data[bucket["_id"]]["total_amount"] = bucket["total_amount"]
+        
+        for payment in result["pages"]:
+            serialize_payment(payment)
+            # Ensure shipping_status is set
+            payment["shipping_status"] = payment["bucket"]
+        fill_payment_buckets(shipping_data, result["pages"], limit, request)
         
         total_payments = sum(data["count"] for data in shipping_data.values())
         total_amount = round(sum(data["total_amount"] for data in shipping_data.values()), 2)
@@ -854,53 +1171,120 @@ async def get_all_shipping_status_payments(
         logger.error(f"Error fetching all shipping status payments: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to fetch shipping payments: {str(e)}")
     
+# Product fields included with each admin order
+ADMIN_ORDER_PRODUCT_FIELDS = {
+    "name": 1,
+    "category": 1,
+    "price_php": 1,
+    "image_path": 1,
+    "color": 1,
+    "seller_id": 1
+}
+
+def admin_orders_match(
+    payment_status: Optional[PaymentStatus],
+    shipping_status: Optional[ShippingStatus],
+    username: Optional[str],
+    from_date: Optional[datetime],
+    to_date: Optional[datetime]
+) -> Dict[str, Any]:
+    """Build the $match filter for admin order listings"""
+    match: Dict[str, Any] = {}
+    if payment_status:
+        match["payment_status"] = payment_status.value
+    if shipping_status:
+        match["shipping_status"] = shipping_status.value
+    if username:
+        match["username"] = username
+    if from_date or to_date:
+        match["created_at"] = {}
+        if from_date:
+            match["created_at"]["$gte"] = from_date
+        if to_date:
+            match["created_at"]["$lt"] = to_date
+    return match
+
+def serialize_admin_order(order: Dict[str, Any]) -> Dict[str, Any]:
+    """Attach joined products in item order and make the order JSON serializable"""
+    products = {str(product["_id"]): product for product in order.pop("item_products", [])}
+    order["_id"] = str(order["_id"])
+    order["products"] = []
+    for item in order.get("items", []):
+        product = products.get(item.get("product_id"))
+        if product:
+            order["products"].append({**product, "_id": str(product["_id"])})
+    
+    # Ensure failure_reason is included in each order
+    order["failure_reason"] = order.get("failure_reason", None)
+    return order
+
 @router.get("/admin/orders")
-async def get_orders():
+async def get_orders(
+    payment_status: Optional[PaymentStatus] = None,
+    shipping_status: Optional[ShippingStatus] = None,
+    username: Optional[str] = None,
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    limit: int = Query(PAYMENT_PAGE_SIZE, ge=1, le=PAYMENT_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    format: Literal["json", "ndjson"] = "json",
+    admin_user: str = Depends(verify_admin)
+):
     """
-    Fetch all orders for the admin, including associated product details.
+    Fetch orders for the admin, newest first, including associated product details.
+    Returns one page plus next_cursor; format=ndjson streams every matching order
+    as newline-delimited JSON for export instead.
     """
     try:
+        match = admin_orders_match(payment_status, shipping_status, username, from_date, to_date)
+        
+        if format == "ndjson":
+            pipeline = [
+                {"$match": match},
+                {"$sort": {"created_at": -1, "payment_id": -1}},
+                *product_lookup_stages(ADMIN_ORDER_PRODUCT_FIELDS)
+            ]
+            
+            def export_orders():
+                for order in payments_collection.aggregate(pipeline, allowDiskUse=True):
+                    yield json.dumps(jsonable_encoder(serialize_admin_order(order))) + "\n"
+            
+            return StreamingResponse(
+                export_orders(),
+                media_type="application/x-ndjson",
+                headers={"Content-Disposition": "attachment; filename=orders.ndjson"}
+            )
+        
+        if cursor:
+            match = {"$and": [match, payment_cursor_match(cursor)]} if match else payment_cursor_match(cursor)
+        
+        orders = list(payments_collection.aggregate([
+            {"$match": match},
+            {"$sort": {"created_at": -1, "payment_id": -1}},
+            {"$limit": limit + 1},
+            *product_lookup_stages(ADMIN_ORDER_PRODUCT_FIELDS)
+        ]))
         
-        payments_collection = db_connection.db.payments
-        products_collection = db_connection.db.products
-
-        # Fetch all payments (orders)
-        orders = list(payments_collection.find())
-
-        # Enrich each order with product details
-        for order in orders:
-            order["_id"] = str(order["_id"])
-            order["products"] = []
-
-            # Fetch product details for each item in the order
-            for item in order.get("items", []):
-                product_id = item.get("product_id")
-                if not product_id:
-                    logger.warning(f"Missing product_id in order item: {item}")
-                    continue
-
-                try:
-                    product = products_collection.find_one({"_id": ObjectId(product_id)})
-                    if product:
-                        product["_id"] = str(product["_id"])
-                        order["products"].append(product)
-                    else:
-                        logger.warning(f"Product not found for product_id: {product_id}")
-                except Exception as e:
-                    logger.error(f"Error fetching product with product_id {product_id}: {str(e)}")
-
-        # Ensure failure_reason is included in each order
-        for order in orders:
-            order["failure_reason"] = order.get("failure_reason", None)
-
-        return {"success": True, "orders": orders}
+        next_cursor = None
+        if len(orders) > limit:
+            orders = orders[:limit]
+            next_cursor = encode_payment_cursor(orders[-1])
+        
+        return {
+            "success": True,
+            "orders": [serialize_admin_order(order) for order in orders],
+            "count": len(orders),
+            "next_cursor": next_cursor
+        }
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error fetching orders: {str(e)}")
         return {"success": False, "error": str(e)}
 
 
 @router.put("/admin/admin-update-payment-status/{payment_id}")
-async def update_payment_status(payment_id: str, payload: PaymentUpdate):
+async def admin_update_payment_status(payment_id: str, payload: PaymentUpdate, admin_user: str = Depends(verify_admin)):
     """
     Update the payment status of a specific order.
     """
@@ -917,15 +1301,17 @@ async def update_payment_status(payment_id: str, payload: PaymentUpdate):
         db_connection = MongoDBConnection()
         orders_collection = db_connection.db.payments
 
-        # Update the payment status in the database
-        result = orders_collection.update_one(
+        # Update the payment status in the database, keeping the previous version for the rollups
+        previous_payment = orders_collection.find_one_and_update(
             {"payment_id": payment_id},
             {"$set": {"payment_status": payload.status, "updated_at": datetime.utcnow()}}
         )
 
         # Check if the update was successful
-        if result.matched_count == 0:
+        if not previous_payment:
             raise HTTPException(status_code=404, detail="Order not found.")
+        
+        record_payment_status_change(previous_payment, payload.status)
 
         return {"success": True, "message": "Payment status updated successfully."}
     except HTTPException:
@@ -934,55 +1320,181 @@ async def update_payment_status(payment_id: str, payload: PaymentUpdate):
         logger.error(f"Error updating payment status: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Failed to update payment status: {str(e)}")
 
+# Platform commission on delivered orders; the remainder goes to sellers
+ADMIN_SHARE_RATE = 0.07
+
+def revenue_match(from_date: Optional[datetime], to_date: Optional[datetime]) -> Dict[str, Any]:
+    """Delivered, completed payments, optionally limited to a delivery date range"""
+    match: Dict[str, Any] = {
+        "shipping_status": ShippingStatus.DELIVERED.value,
+        "payment_status": PaymentStatus.COMPLETED.value  # Only count completed payments
+    }
+    if from_date or to_date:
+        match["updated_at"] = {}
+        if from_date:
+            match["updated_at"]["$gte"] = from_date
+        if to_date:
+            match["updated_at"]["$lt"] = to_date
+    return match
+
+def revenue_share_stage(amount_field: str) -> Dict[str, Any]:
+    """Round a summed amount and split it into admin and seller shares"""
+    return {"$set": {
+        amount_field: {"$round": [f"${amount_field}", 2]},
+        "admin_share": {"$round": [{"$multiply": [f"${amount_field}", ADMIN_SHARE_RATE]}, 2]},
+        "seller_share": {"$round": [{"$multiply": [f"${amount_field}", 1 - ADMIN_SHARE_RATE]}, 2]}
+    }}
+
 @router.get("/admin/revenue")
-async def get_admin_revenue(admin_user: str = Depends(verify_admin)):
+async def get_admin_revenue(
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    group_by: Optional[Literal["day", "week", "month", "seller"]] = None,
+    admin_user: str = Depends(verify_admin)
+):
     """
     Admin function to get revenue from delivered orders.
-    Calculates total revenue and 7% admin share from delivered payments.
+    Calculates total revenue and 7% admin share from delivered payments,
+    optionally within a delivery date range and broken down by day, week,
+    month or seller. Per-payment details are at /admin/revenue/payments.
     """
     try:
-        # Fetch all payments with 'delivered' shipping status
-        delivered_payments = list(payments_collection.find({
-            "shipping_status": ShippingStatus.DELIVERED.value,
-            "payment_status": PaymentStatus.COMPLETED.value  # Only count completed payments
-        }))
-        
-        # Calculate totals
-        total_revenue = 0.0
-        admin_share_rate = 0.07  # 7%
-        payment_details = []
+        facets: Dict[str, List[Dict[str, Any]]] = {
+            "summary": [
+                {"$group": {
+                    "_id": None,
+                    "total_delivered_orders": {"$sum": 1},
+                    "total_revenue": {"$sum": "$total_amount"}
+                }}
+            ]
+        }
+        
+        if group_by == "seller":
+            # Seller revenue is the item subtotal of their products (before discounts, tax and shipping)
+            facets["breakdown"] = [
+                {"$unwind": "$items"},
+                {"$set": {"product_oid": {"$convert": {
+                    "input": "$items.product_id", "to": "objectId", "onError": None, "onNull": None
+                }}}},
+                {"$lookup": {
+                    "from": "products",
+                    "localField": "product_oid",
+                    "foreignField": "_id",
+                    "pipeline": [{"$project": {"seller_id": 1}}],
+                    "as": "product"
+                }},
+                {"$group": {
+                    "_id": {"$ifNull": [{"$first": "$product.seller_id"}, "unknown"]},
+                    "orders": {"$addToSet": "$payment_id"},
+                    "items_sold": {"$sum": "$items.quantity"},
+                    "revenue": {"$sum": "$items.total_price"}
+                }},
+                {"$set": {"orders": {"$size": "$orders"}}},
+                revenue_share_stage("revenue"),
+                {"$sort": {"revenue": -1}}
+            ]
+        elif group_by:
+            facets["breakdown"] = [
+                {"$group": {
+                    "_id": {"$dateTrunc": {
+                        "date": {"$ifNull": ["$updated_at", "$created_at"]},
+                        "unit": group_by
+                    }},
+                    "orders": {"$sum": 1},
+                    "revenue": {"$sum": "$total_amount"}
+                }},
+                revenue_share_stage("revenue"),
+                {"$sort": {"_id": 1}}
+            ]
         
-        for payment in delivered_payments:
+        result = next(payments_collection.aggregate([
+            {"$match": revenue_match(from_date, to_date)},
+            {"$facet": facets}
+        ]))
+        
+        summary = result["summary"][0] if result["summary"] else {"total_delivered_orders": 0, "total_revenue": 0.0}
+        total_revenue = summary["total_revenue"]
+        total_admin_share = total_revenue * ADMIN_SHARE_RATE
+        
+        response = {
+            "success": True,
+            "summary": {
+                "total_delivered_orders": summary["total_delivered_orders"],
+                "total_revenue": round(total_revenue, 2),
+                "admin_share_percentage": ADMIN_SHARE_RATE * 100,
+                "total_admin_share": round(total_admin_share, 2),
+                "seller_share": round(total_revenue - total_admin_share, 2)
+            },
+            "from_date": from_date.isoformat() if from_date else None,
+            "to_date": to_date.isoformat() if to_date else None,
+            "calculated_by": admin_user,
+            "calculation_date": datetime.utcnow().isoformat()
+        }
+        
+        if group_by:
+            breakdown = []
+            for group in result["breakdown"]:
+                key = group.pop("_id")
+                group["period" if group_by != "seller" else "seller_id"] = key.isoformat() if isinstance(key, datetime) else key
+                breakdown.append(group)
+            response["group_by"] = group_by
+            response["breakdown"] = breakdown
+        
+        return response
+    
+    except Exception as e:
+        logger.error(f"Error calculating admin revenue: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to calculate admin revenue: {str(e)}")
+
+@router.get("/admin/revenue/payments")
+async def get_admin_revenue_payments(
+    from_date: Optional[datetime] = None,
+    to_date: Optional[datetime] = None,
+    limit: int = Query(PAYMENT_PAGE_SIZE, ge=1, le=PAYMENT_PAGE_SIZE_MAX),
+    cursor: Optional[str] = None,
+    admin_user: str = Depends(verify_admin)
+):
+    """Paginated per-payment detail for /admin/revenue, newest orders first"""
+    try:
+        match = revenue_match(from_date, to_date)
+        if cursor:
+            match = {"$and": [match, payment_cursor_match(cursor)]}
+        
+        payments = list(payments_collection.find(
+            match,
+            {
+                "payment_id": 1, "username": 1, "total_amount": 1, "created_at": 1,
+                "updated_at": 1, "payment_method": 1, "items.product_id": 1
+            }
+        ).sort([("created_at", -1), ("payment_id", -1)]).limit(limit + 1))
+        
+        next_cursor = None
+        if len(payments) > limit:
+            payments = payments[:limit]
+            next_cursor = encode_payment_cursor(payments[-1])
+        
+        payment_details = []
+        for payment in payments:
             payment_amount = payment.get("total_amount", 0.0)
-            admin_share = payment_amount * admin_share_rate
-            total_revenue += payment_amount
-            
             payment_details.append({
                 "payment_id": payment["payment_id"],
                 "username": payment["username"],
                 "total_amount": payment_amount,
-                "admin_share": round(admin_share, 2),
-                "delivered_date": payment.get("updated_at", payment["created_at"]).isoformat(),
+                "admin_share": round(payment_amount * ADMIN_SHARE_RATE, 2),
+                "delivered_date": (payment.get("updated_at") or payment["created_at"]).isoformat(),
                 "items_count": len(payment.get("items", [])),
                 "payment_method": payment["payment_method"]
             })
         
-        total_admin_share = total_revenue * admin_share_rate
-        
         return {
             "success": True,
-            "summary": {
-                "total_delivered_orders": len(delivered_payments),
-                "total_revenue": round(total_revenue, 2),
-                "admin_share_percentage": admin_share_rate * 100,
-                "total_admin_share": round(total_admin_share, 2),
-                "seller_share": round(total_revenue - total_admin_share, 2)
-            },
             "delivered_payments": payment_details,
-            "calculated_by": admin_user,
-            "calculation_date": datetime.utcnow().isoformat()
+            "count": len(payment_details),
+            "next_cursor": next_cursor
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
-        logger.error(f"Error calculating admin revenue: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to calculate admin revenue: {str(e)}")
\ No newline at end of file
+        logger.error(f"Error fetching revenue payments: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to fetch revenue payments: {str(e)}")
@@ -1,5 +1,9 @@
 import os
 import random
+import asyncio
+import hashlib
+import io
+from concurrent.futures import ThreadPoolExecutor
 from PIL import Image
 import google.generativeai as genai
 from typing import Dict, List, Any
@@ -29,8 +33,84 @@ except Exception as e:
     logger.error(f"Failed to configure Gemini AI: {str(e)}")
     model = None
 
+# Dedicated pool for image decoding so PIL work never runs on the event loop
+IMAGE_DECODE_WORKERS = int(os.getenv("IMAGE_DECODE_WORKERS", 4))
+image_decode_executor = ThreadPoolExecutor(max_workers=IMAGE_DECODE_WORKERS, thread_name_prefix="image-decode")
+
+# Upper bound on concurrent Gemini requests per worker
+AI_MAX_CONCURRENT_REQUESTS = int(os.getenv("AI_MAX_CONCURRENT_REQUESTS", 4))
+ai_request_semaphore = asyncio.Semaphore(AI_MAX_CONCURRENT_REQUESTS)
+
+# Bump whenever ANALYSIS_PROMPT changes so cached analyses are not reused
+ANALYSIS_PROMPT_VERSION = "v1"
+
+# Detailed prompt for product analysis
+ANALYSIS_PROMPT = """
+Analyze this clothing/fashion item image and provide detailed product information in JSON format:
+
+{
+    "name": "Product name",
+    "description": "Detailed description of the item including style, color, material, and features",
+    "category": "Category from: T-Shirts, Jeans, Dresses, Jackets, Shoes, Accessories, Hoodies, Skirts, Pants, Shorts",
+    "color": "Primary color of the item",
+    "material": "Estimated material type",
+    "style": "Style description (casual, formal, sporty, etc.)",
+    "season": "Suitable season (Spring, Summer, Fall, Winter, All-season)",
+    "gender": "Target gender (Men, Women, Unisex)",
+    "brand_style": "Estimated brand style or type",
+    "footwear_type": "If shoes, specify type (Sneakers, Sandals, Boots, etc.)"
+}
+
+Be specific and detailed in your analysis. Focus on visible characteristics.
+Return only valid JSON format.
+"""
+
+def _hash_image_file(image_path: str) -> str:
+    """
+    Compute the SHA-256 digest of an image file's bytes
+    """
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as image_file:
+        for chunk in iter(lambda: image_file.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Images are downscaled and re-encoded before analysis; originals on disk are untouched
+AI_IMAGE_MAX_EDGE = int(os.getenv("AI_IMAGE_MAX_EDGE", 1024))
+AI_IMAGE_JPEG_QUALITY = int(os.getenv("AI_IMAGE_JPEG_QUALITY", 85))
+
+def _normalize_image(image_path: str) -> Dict[str, Any]:
+    """
+    Decode, downscale and re-encode an image as JPEG for AI analysis
+    (runs in the decode executor)
+    """
+    image = Image.open(image_path)
+    original_size = image.size
+    
+    # JPEG draft mode lets libjpeg decode directly at a reduced scale
+    if image.format == "JPEG":
+        image.draft("RGB", (AI_IMAGE_MAX_EDGE, AI_IMAGE_MAX_EDGE))
+    
+    # Convert to RGB if necessary
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    
+    image.thumbnail((AI_IMAGE_MAX_EDGE, AI_IMAGE_MAX_EDGE), Image.LANCZOS)
+    
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=AI_IMAGE_JPEG_QUALITY, optimize=True)
+    
+    return {
+        "mime_type": "image/jpeg",
+        "data": buffer.getvalue(),
+        "original_size": original_size,
+        "size": image.size
+    }
+
 class AIImageProcessor:
-    def __init__(self):
+    def __init__(self, analysis_cache=None):
+        # Optional persistent cache of AI analyses keyed by image content hash
+        self.analysis_cache = analysis_cache
         self.clothing_categories = [
             "T-Shirts", "Jeans", "Dresses", "Jackets", "Shoes", 
             "Accessories", "Hoodies", "Skirts", "Pants", "Shorts"
@@ -53,59 +133,66 @@ class AIImageProcessor:
             if not image_path.lower().endswith(valid_extensions):
                 raise ValueError(f"Invalid image format. Supported: {valid_extensions}")
             
-            # Open and validate image
-            try:
-                image = Image.open(image_path)
-                # Convert to RGB if necessary
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
-                logger.info(f"Image opened successfully: {image.size}")
-            except Exception as e:
-                raise ValueError(f"Cannot open image file: {str(e)}")
-            
-            # Create detailed prompt for product analysis
-            prompt = """
-            Analyze this clothing/fashion item image and provide detailed product information in JSON format:
+            loop = asyncio.get_event_loop()
             
-            {
-                "name": "Product name",
-                "description": "Detailed description of the item including style, color, material, and features",
-                "category": "Category from: T-Shirts, Jeans, Dresses, Jackets, Shoes, Accessories, Hoodies, Skirts, Pants, Shorts",
-                "color": "Primary color of the item",
-                "material": "Estimated material type",
-                "style": "Style description (casual, formal, sporty, etc.)",
-                "season": "Suitable season (Spring, Summer, Fall, Winter, All-season)",
-                "gender": "Target gender (Men, Women, Unisex)",
-                "brand_style": "Estimated brand style or type",
-                "footwear_type": "If shoes, specify type (Sneakers, Sandals, Boots, etc.)"
-            }
-            
-            Be specific and detailed in your analysis. Focus on visible characteristics.
-            Return only valid JSON format.
-            """
+            # Look up a previous analysis of the same image bytes
+            image_hash = None
+            cached_ai_data = None
+            if self.analysis_cache:
+                try:
+                    image_hash = await loop.run_in_executor(image_decode_executor, _hash_image_file, image_path)
+                    cached_ai_data = await self.analysis_cache.get_analysis(image_hash, ANALYSIS_PROMPT_VERSION)
+                except Exception as cache_error:
+                    logger.warning(f"Analysis cache lookup failed: {str(cache_error)}")
             
-            # Check if Gemini API is configured
-            if not model or not os.getenv("GEMINI_API_KEY"):
-                logger.warning("GEMINI_API_KEY not found, using fallback data")
-                ai_data = self._generate_fallback_data()
+            if cached_ai_data:
+                logger.info(f"Analysis cache hit for image: {image_path}")
+                ai_data = cached_ai_data
             else:
+                # Open, validate and normalize image off the event loop
                 try:
-                    logger.info("Sending image to Gemini AI for analysis")
-                    # Generate content using Gemini
-                    response = model.generate_content([prompt, image])
-                    
-                    if not response or not response.text:
-                        raise Exception("Empty response from AI model")
-                    
-                    logger.info("Received response from Gemini AI")
-                    # Parse AI response
-                    ai_data = self._parse_ai_response(response.text)
-                except Exception as ai_error:
-                    logger.error(f"AI processing failed: {str(ai_error)}, using fallback")
+                    normalized = await loop.run_in_executor(image_decode_executor, _normalize_image, image_path)
+                    logger.info(
+                        f"Image normalized: {normalized['original_size']} -> {normalized['size']}, "
+                        f"{os.path.getsize(image_path)} -> {len(normalized['data'])} bytes"
+                    )
+                except Exception as e:
+                    raise ValueError(f"Cannot open image file: {str(e)}")
+                
+                # Check if Gemini API is configured
+                if not model or not os.getenv("GEMINI_API_KEY"):
+                    logger.warning("GEMINI_API_KEY not found, using fallback data")
                     ai_data = self._generate_fallback_data()
+                else:
+                    try:
+                        logger.info("Sending image to Gemini AI for analysis")
+                        # Generate content using Gemini's async API
+                        async with ai_request_semaphore:
+                            response = await model.generate_content_async([
+                                ANALYSIS_PROMPT,
+                                {"mime_type": normalized["mime_type"], "data": normalized["data"]}
+                            ])
+                        
+                        if not response or not response.text:
+                            raise Exception("Empty response from AI model")
+                        
+                        logger.info("Received response from Gemini AI")
+                        # Parse AI response
+                        ai_data = self._parse_ai_response(response.text)
+                        
+                        # Only genuine model output is cached, never fallback data
+                        if self.analysis_cache and image_hash:
+                            try:
+                                await self.analysis_cache.save_analysis(image_hash, ANALYSIS_PROMPT_VERSION, ai_data)
+                            except Exception as cache_error:
+                                logger.warning(f"Failed to cache analysis: {str(cache_error)}")
+                    except Exception as ai_error:
+                        logger.error(f"AI processing failed: {str(ai_error)}, using fallback")
+                        ai_data = self._generate_fallback_data()
             
             # Generate additional product data
             product_data = self._generate_product_data(ai_data, image_path)
+            product_data["analysis_cache_hit"] = bool(cached_ai_data)
             logger.info(f"Generated product data: {product_data.get('name')}")
             
             return product_data
@@ -134,7 +221,8 @@ class AIImageProcessor:
     
     def _parse_ai_response(self, response_text: str) -> Dict[str, Any]:
         """
-        Parse AI response and extract JSON data
+        Parse AI response and extract JSON data.
+        Raises ValueError when the response does not contain valid JSON.
         """
         try:
             # Clean response text and extract JSON
@@ -165,7 +253,7 @@ class AIImageProcessor:
             return parsed_data
         except Exception as e:
             logger.error(f"JSON parsing failed: {str(e)}")
-            return self._generate_fallback_data()
+            raise ValueError(f"Invalid AI response: {str(e)}")
     
     def _get_default_value(self, field: str) -> str:
         """
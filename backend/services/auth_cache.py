@@ -0,0 +1,76 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+class TokenCache:
+    """
+    LRU cache of verified JWT claims keyed by token digest.
+    Entries are dropped once the token's exp claim has passed.
+    """
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        # Sync dependencies run in FastAPI's threadpool, so access must be locked
+        self._lock = threading.Lock()
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        digest = _token_digest(token)
+        with self._lock:
+            claims = self._entries.get(digest)
+            if claims is None:
+                return None
+            if claims.get("exp") is not None and claims["exp"] <= time.time():
+                del self._entries[digest]
+                return None
+            self._entries.move_to_end(digest)
+            return claims
+
+    def put(self, token: str, claims: Dict[str, Any]):
+        digest = _token_digest(token)
+        with self._lock:
+            self._entries[digest] = claims
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+class UserStatusCache:
+    """
+    Short-TTL cache of per-user account status (is_active, role)
+    so deactivation takes effect without a DB read on every request.
+    """
+    def __init__(self, ttl_seconds: float = 30.0, max_size: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            status, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[username]
+                return None
+            return status
+
+    def put(self, username: str, status: Dict[str, Any]):
+        with self._lock:
+            self._entries[username] = (status, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None):
+        """Drop one user's cached status, or every entry when username is None"""
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
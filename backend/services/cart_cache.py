@@ -0,0 +1,117 @@
+import os
+import json
+import threading
+import time
+import logging
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+CART_CACHE_TTL_SECONDS = float(os.getenv("CART_CACHE_TTL_SECONDS", 300))
+CART_CACHE_MAX_SIZE = int(os.getenv("CART_CACHE_MAX_SIZE", 10000))
+# Set to share cached cart totals between worker processes
+CART_CACHE_REDIS_URL = os.getenv("CART_CACHE_REDIS_URL")
+
+class InMemoryCacheBackend:
+    """
+    Process-local LRU store with per-entry expiry (the default backend).
+    Each worker process keeps its own copy, so writes from other workers
+    are only seen once the entry expires.
+    """
+    def __init__(self, max_size: int = 10000):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Sync dependencies and routes run in FastAPI's threadpool, so access must be locked
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return dict(value)
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: float):
+        with self._lock:
+            self._entries[key] = (dict(value), time.monotonic() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._entries.pop(key, None)
+
+class RedisCacheBackend:
+    """Shared store so every worker process reads the same cached values"""
+    def __init__(self, url: str):
+        import redis
+        self.client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = self.client.get(key)
+        return json.loads(raw) if raw else None
+
+    def set(self, key: str, value: Dict[str, Any], ttl_seconds: float):
+        self.client.set(key, json.dumps(value), ex=max(1, int(ttl_seconds)))
+
+    def delete(self, key: str):
+        self.client.delete(key)
+
+class CartCache:
+    """
+    Per-user cache of cart totals (item count and subtotal), kept current
+    write-through by the cart mutation endpoints. Backend errors are logged
+    and treated as cache misses so the cart keeps working from MongoDB.
+    """
+    def __init__(self, backend=None, ttl_seconds: float = 300.0):
+        self.backend = backend or InMemoryCacheBackend()
+        self.ttl_seconds = ttl_seconds
+
+    @staticmethod
+    def _key(username: str) -> str:
+        return f"cart_totals:{username}"
+
+    def get_totals(self, username: str) -> Optional[Dict[str, Any]]:
+        try:
+            return self.backend.get(self._key(username))
+        except Exception as e:
+            logger.warning(f"Cart cache read failed for {username}: {str(e)}")
+            return None
+
+    def put_totals(self, username: str, total_items: int, subtotal: float):
+        try:
+            self.backend.set(
+                self._key(username),
+                {"total_items": total_items, "subtotal": round(subtotal, 2)},
+                self.ttl_seconds
+            )
+        except Exception as e:
+            logger.warning(f"Cart cache write failed for {username}: {str(e)}")
+
+    def invalidate(self, username: str):
+        try:
+            self.backend.delete(self._key(username))
+        except Exception as e:
+            logger.warning(f"Cart cache invalidation failed for {username}: {str(e)}")
+
+def create_cart_cache_backend():
+    """Use Redis when configured and installed, otherwise the in-process store"""
+    if CART_CACHE_REDIS_URL:
+        try:
+            return RedisCacheBackend(CART_CACHE_REDIS_URL)
+        except ImportError:
+            logger.warning("CART_CACHE_REDIS_URL is set but redis is not installed; using in-process cart cache")
+    return InMemoryCacheBackend(max_size=CART_CACHE_MAX_SIZE)
+
+cart_cache = CartCache(create_cart_cache_backend(), ttl_seconds=CART_CACHE_TTL_SECONDS)
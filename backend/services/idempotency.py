@@ -0,0 +1,86 @@
+import os
+import json
+import hashlib
+from datetime import datetime
+from typing import Dict, Any, Optional
+import logging
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pymongo.errors import DuplicateKeyError
+from connection.database import idempotency_collection
+
+# Load environment variables
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# How long a stored response can be replayed for the same Idempotency-Key
+IDEMPOTENCY_KEY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_KEY_TTL_SECONDS", 24 * 60 * 60))
+
+try:
+    idempotency_collection.create_index(
+        [("scope", 1), ("username", 1), ("key", 1)], unique=True
+    )
+    idempotency_collection.create_index("created_at", expireAfterSeconds=IDEMPOTENCY_KEY_TTL_SECONDS)
+except Exception as e:
+    logger.warning(f"Could not create idempotency key indexes: {str(e)}")
+
+def request_fingerprint(payload: Any) -> str:
+    """Stable hash of a request payload, to detect a key reused for a different request"""
+    encoded = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def begin_idempotent_request(scope: str, username: str, key: str, fingerprint: str) -> Optional[JSONResponse]:
+    """
+    Claim an Idempotency-Key for a request. Returns None when this request
+    owns the key and should run, or the stored response when the key was
+    already completed. Raises 409 while the first request is still running
+    and 422 if the key was used for a different payload.
+    """
+    try:
+        idempotency_collection.insert_one({
+            "scope": scope,
+            "username": username,
+            "key": key,
+            "fingerprint": fingerprint,
+            "state": "in_progress",
+            "created_at": datetime.utcnow()
+        })
+        return None
+    except DuplicateKeyError:
+        pass
+
+    record = idempotency_collection.find_one({"scope": scope, "username": username, "key": key})
+    if not record:
+        # Expired between the insert and the read; let the caller retry
+        raise HTTPException(status_code=409, detail="Idempotency key is being reset, please retry")
+    if record["fingerprint"] != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+    if record["state"] != "completed":
+        raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still being processed")
+
+    return JSONResponse(
+        status_code=record["status_code"],
+        content=record["response"],
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+def complete_idempotent_request(scope: str, username: str, key: str, status_code: int, response: Any):
+    """Store the first response for an Idempotency-Key so retries replay it"""
+    idempotency_collection.update_one(
+        {"scope": scope, "username": username, "key": key},
+        {"$set": {
+            "state": "completed",
+            "status_code": status_code,
+            "response": jsonable_encoder(response),
+            "completed_at": datetime.utcnow()
+        }}
+    )
+
+def release_idempotent_request(scope: str, username: str, key: str):
+    """Forget an unfinished key after an error so the client can retry with it"""
+    idempotency_collection.delete_one(
+        {"scope": scope, "username": username, "key": key, "state": "in_progress"}
+    )
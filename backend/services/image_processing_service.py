@@ -1,6 +1,6 @@
 import os
 import glob
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Set, Callable, Awaitable
 from services.ai_image_service import AIImageProcessor
 import logging
 from dotenv import load_dotenv
@@ -12,9 +12,12 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Number of analyzed products accumulated before a bulk insert
+INGESTION_BATCH_SIZE = int(os.getenv("INGESTION_BATCH_SIZE", 100))
+
 # Try to import MongoDB models, create placeholders if they don't exist
 try:
-    from models.mongodb_models import MongoDBConnection, ProductModel, SellerModel
+    from models.mongodb_models import MongoDBConnection, ProductModel, SellerModel, AnalysisCacheModel
     MONGODB_AVAILABLE = True
     logger.info("MongoDB models imported successfully")
 except ImportError as e:
@@ -30,6 +33,9 @@ except ImportError as e:
         async def create_product(self, product_data: dict, seller_id: str): 
             logger.info(f"Placeholder: Would create product {product_data.get('name')}")
             return f"product_{hash(str(product_data))}"
+        async def create_products_bulk(self, products: list): 
+            logger.info(f"Placeholder: Would create {len(products)} products")
+            return [{"product_id": f"product_{hash(str(entry['product_data']))}"} for entry in products]
     
     class SellerModel:
         def __init__(self, db_connection): pass
@@ -38,22 +44,69 @@ except ImportError as e:
             return f"seller_{hash(str(seller_data))}"
         async def update_seller_products(self, seller_id: str, category: str): 
             logger.info(f"Placeholder: Would update seller {seller_id} with category {category}")
+        async def update_sellers_products_bulk(self, seller_categories: dict): 
+            logger.info(f"Placeholder: Would update {len(seller_categories)} sellers with categories")
+    
+    class AnalysisCacheModel:
+        def __init__(self, db_connection): pass
+        async def get_analysis(self, image_hash: str, prompt_version: str): return None
+        async def save_analysis(self, image_hash: str, prompt_version: str, ai_data: dict): pass
 
 class ImageProcessingService:
     def __init__(self):
-        self.ai_processor = AIImageProcessor()
         try:
             self.db_connection = MongoDBConnection()
             self.product_model = ProductModel(self.db_connection)
             self.seller_model = SellerModel(self.db_connection)
+            self.ai_processor = AIImageProcessor(analysis_cache=AnalysisCacheModel(self.db_connection))
             logger.info("ImageProcessingService initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize ImageProcessingService: {str(e)}")
             raise Exception(f"Service initialization failed: {str(e)}")
     
-    async def process_images_in_folder(self, folder_path: str) -> Dict[str, Any]:
+    def find_image_files(self, folder_path: str) -> List[str]:
+        """
+        List all image files in a folder, sorted for a stable processing order
+        """
+        # Normalize path for cross-platform compatibility
+        folder_path = os.path.normpath(folder_path)
+        
+        if not os.path.exists(folder_path):
+            raise FileNotFoundError(f"Folder not found: {folder_path}")
+        
+        if not os.path.isdir(folder_path):
+            raise ValueError(f"Path is not a directory: {folder_path}")
+        
+        # Get all image files with more comprehensive search
+        image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.gif', '*.webp']
+        image_files = []
+        
+        for extension in image_extensions:
+            # Search for both lowercase and uppercase extensions
+            image_files.extend(glob.glob(os.path.join(folder_path, extension)))
+            image_files.extend(glob.glob(os.path.join(folder_path, extension.upper())))
+            # Also search with mixed case
+            if extension.startswith('*.j'):
+                image_files.extend(glob.glob(os.path.join(folder_path, extension.replace('*.j', '*.J'))))
+        
+        # Remove duplicates
+        return sorted(set(image_files))
+    
+    async def process_images_in_folder(
+        self,
+        folder_path: str,
+        skip_paths: Optional[Set[str]] = None,
+        on_progress: Optional[Callable[[List[Dict[str, Any]], List[Dict[str, Any]]], Awaitable[None]]] = None,
+        should_cancel: Optional[Callable[[], Awaitable[bool]]] = None,
+        batch_size: int = INGESTION_BATCH_SIZE,
+        job_id: Optional[str] = None
+    ) -> Dict[str, Any]:
         """
-        Process all images in a folder and create products/sellers in MongoDB
+        Process all images in a folder and create products/sellers in MongoDB.
+        Files in skip_paths are left untouched; on_progress is awaited with the
+        committed and failed entries of each flushed batch; should_cancel is
+        polled before every image. With a job_id, products are keyed on the job
+        and image path so a resumed job does not insert the same image twice.
         """
         try:
             logger.info(f"Starting to process images in folder: {folder_path}")
@@ -61,44 +114,41 @@ class ImageProcessingService:
             # Normalize path for cross-platform compatibility
             folder_path = os.path.normpath(folder_path)
             
-            if not os.path.exists(folder_path):
-                raise FileNotFoundError(f"Folder not found: {folder_path}")
-            
-            if not os.path.isdir(folder_path):
-                raise ValueError(f"Path is not a directory: {folder_path}")
-            
-            # Get all image files with more comprehensive search
-            image_extensions = ['*.jpg', '*.jpeg', '*.png', '*.bmp', '*.gif', '*.webp']
-            image_files = []
-            
-            for extension in image_extensions:
-                # Search for both lowercase and uppercase extensions
-                image_files.extend(glob.glob(os.path.join(folder_path, extension)))
-                image_files.extend(glob.glob(os.path.join(folder_path, extension.upper())))
-                # Also search with mixed case
-                if extension.startswith('*.j'):
-                    image_files.extend(glob.glob(os.path.join(folder_path, extension.replace('*.j', '*.J'))))
-            
-            # Remove duplicates
-            image_files = list(set(image_files))
+            image_files = self.find_image_files(folder_path)
             
             logger.info(f"Found {len(image_files)} image files")
             
             if not image_files:
                 raise ValueError(f"No image files found in the specified folder: {folder_path}")
             
+            skipped_files = 0
+            if skip_paths:
+                remaining_files = [f for f in image_files if f not in skip_paths]
+                skipped_files = len(image_files) - len(remaining_files)
+                logger.info(f"Skipping {skipped_files} already committed files")
+            else:
+                remaining_files = image_files
+            
             # Log some sample filenames for debugging
-            sample_files = image_files[:3]
+            sample_files = remaining_files[:3]
             logger.info(f"Sample files found: {[os.path.basename(f) for f in sample_files]}")
             
             processed_products = []
             created_sellers = {}
             errors = []
+            pending_products = []
+            seller_categories = {}
+            cancelled = False
             
-            for i, image_path in enumerate(image_files):
+            for i, image_path in enumerate(remaining_files):
+                if should_cancel and await should_cancel():
+                    logger.info(f"Cancellation requested, stopping after {i} images")
+                    cancelled = True
+                    break
+                
                 try:
                     image_filename = os.path.basename(image_path)
-                    logger.info(f"Processing image {i+1}/{len(image_files)}: {image_filename}")
+                    logger.info(f"Processing image {i+1}/{len(remaining_files)}: {image_filename}")
                     
                     # Verify file exists and is accessible
                     if not os.path.exists(image_path):
@@ -127,49 +177,64 @@ class ImageProcessingService:
                         created_sellers[category] = seller_id
                         logger.info(f"Created seller with ID: {seller_id}")
                     
-                    # Create product
-                    logger.info(f"Creating product for seller: {seller_id}")
-                    product_id = await self.product_model.create_product(product_data, seller_id)
-                    logger.info(f"Created product with ID: {product_id}")
-                    
-                    # Update seller's product categories
-                    await self.seller_model.update_seller_products(seller_id, category)
-                    
-                    processed_products.append({
-                        "product_id": product_id,
+                    # Queue product for the next bulk insert
+                    pending_products.append({
+                        "product_data": product_data,
                         "seller_id": seller_id,
                         "image_path": image_path,
                         "image_filename": image_filename,
-                        "product_name": product_data.get("name"),
                         "category": category,
-                        "price_php": product_data.get("price_php")
+                        "ingestion_source": f"{job_id}:{image_path}" if job_id else None
                     })
+                    seller_categories.setdefault(seller_id, set()).add(category)
                     
-                    logger.info(f"Successfully processed: {product_data.get('name')} from {image_filename}")
+                    if len(pending_products) >= batch_size:
+                        await self._flush_pending_products(pending_products, processed_products, errors, on_progress)
+                        pending_products = []
                     
                 except Exception as e:
                     error_msg = f"Failed to process {image_filename}: {str(e)}"
                     logger.error(error_msg)
                     import traceback
                     traceback.print_exc()
-                    errors.append({
+                    error_entry = {
                         "image_path": image_path,
                         "image_filename": image_filename,
                         "error": str(e)
-                    })
+                    }
+                    errors.append(error_entry)
+                    if on_progress:
+                        await on_progress([], [error_entry])
+            
+            # Persist whatever is left, then update seller categories in one bulk write
+            await self._flush_pending_products(pending_products, processed_products, errors, on_progress)
+            if seller_categories:
+                try:
+                    await self.seller_model.update_sellers_products_bulk(seller_categories)
+                except Exception as e:
+                    logger.error(f"Failed to update seller categories: {str(e)}")
+            
+            cache_hits = sum(1 for product in processed_products if product.get("analysis_cache_hit"))
             
             result = {
                 "folder_path": folder_path,
                 "total_images": len(image_files),
+                "skipped_images": skipped_files,
+                "cancelled": cancelled,
                 "successfully_processed": len(processed_products),
                 "errors": len(errors),
                 "products": processed_products,
                 "sellers_created": list(created_sellers.values()),
                 "processing_errors": errors,
+                "analysis_cache": {
+                    "hits": cache_hits,
+                    "misses": len(processed_products) - cache_hits,
+                    "hit_rate": round(cache_hits / len(processed_products), 3) if processed_products else 0.0
+                },
                 "mongodb_available": MONGODB_AVAILABLE
             }
             
-            logger.info(f"Processing complete. Successfully processed: {len(processed_products)}, Errors: {len(errors)}")
+            logger.info(f"Processing complete. Successfully processed: {len(processed_products)}, Errors: {len(errors)}, Cache hits: {cache_hits}")
             return result
             
         except Exception as e:
@@ -178,6 +243,47 @@ class ImageProcessingService:
             traceback.print_exc()
             raise Exception(f"Image processing service failed: {str(e)}")
     
+    async def _flush_pending_products(self, pending_products: List[Dict[str, Any]], processed_products: List[Dict[str, Any]], errors: List[Dict[str, Any]], on_progress=None):
+        """
+        Bulk insert queued products and record per-image success or failure
+        """
+        if not pending_products:
+            return
+        
+        committed = []
+        failed = []
+        
+        logger.info(f"Flushing {len(pending_products)} products to MongoDB")
+        results = await self.product_model.create_products_bulk(pending_products)
+        
+        for entry, outcome in zip(pending_products, results):
+            product_data = entry["product_data"]
+            if outcome.get("error"):
+                logger.error(f"Failed to persist {entry['image_filename']}: {outcome['error']}")
+                failed.append({
+                    "image_path": entry["image_path"],
+                    "image_filename": entry["image_filename"],
+                    "error": outcome["error"]
+                })
+                continue
+            
+            committed.append({
+                "product_id": outcome["product_id"],
+                "seller_id": entry["seller_id"],
+                "image_path": entry["image_path"],
+                "image_filename": entry["image_filename"],
+                "product_name": product_data.get("name"),
+                "category": entry["category"],
+                "price_php": product_data.get("price_php"),
+                "analysis_cache_hit": product_data.get("analysis_cache_hit", False)
+            })
+            logger.info(f"Successfully processed: {product_data.get('name')} from {entry['image_filename']}")
+        
+        processed_products.extend(committed)
+        errors.extend(failed)
+        if on_progress:
+            await on_progress(committed, failed)
+    
     async def process_single_image(self, image_path: str, seller_id: str = None) -> Dict[str, Any]:
         """
         Process a single image and create product in MongoDB
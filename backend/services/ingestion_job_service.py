@@ -0,0 +1,142 @@
+import os
+import uuid
+import asyncio
+from datetime import datetime
+from typing import Dict, Any, Optional
+import logging
+from dotenv import load_dotenv
+from services.image_processing_service import ImageProcessingService
+from models.mongodb_models import IngestionJobModel
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Smaller batches than synchronous ingestion so progress is checkpointed often
+INGESTION_JOB_BATCH_SIZE = int(os.getenv("INGESTION_JOB_BATCH_SIZE", 20))
+
+def generate_job_id() -> str:
+    """Generate a unique ingestion job ID"""
+    return f"JOB_{uuid.uuid4().hex[:12].upper()}"
+
+class IngestionJobService:
+    def __init__(self, image_service: ImageProcessingService):
+        self.image_service = image_service
+        self.job_model = IngestionJobModel(image_service.db_connection)
+        # Keep references to running tasks so they are not garbage collected
+        self.running_tasks: Dict[str, asyncio.Task] = {}
+
+    async def start_job(self, folder_path: str) -> Dict[str, Any]:
+        """
+        Create an ingestion job for a folder and start it in the background
+        """
+        folder_path = os.path.normpath(folder_path)
+        image_files = self.image_service.find_image_files(folder_path)
+        if not image_files:
+            raise ValueError(f"No image files found in the specified folder: {folder_path}")
+
+        job = await self.job_model.create_job(generate_job_id(), folder_path, len(image_files))
+        self._launch(job["job_id"], folder_path)
+        logger.info(f"Started ingestion job {job['job_id']} for {folder_path} ({len(image_files)} images)")
+        return job
+
+    async def resume_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Restart an interrupted, failed or cancelled job, skipping files it already committed
+        """
+        job = await self.job_model.get_job(job_id)
+        if not job:
+            return None
+
+        if job_id in self.running_tasks:
+            raise ValueError(f"Job {job_id} is already running")
+        if job["status"] == "completed":
+            raise ValueError(f"Job {job_id} has already completed")
+
+        committed_paths = await self.job_model.get_committed_paths(job_id)
+        await self.job_model.update_job(job_id, {
+            "status": "queued",
+            "cancel_requested": False,
+            "error": None,
+            "committed_count": len(committed_paths),
+            "failed_count": 0,
+            "finished_at": None
+        })
+        self._launch(job_id, job["folder_path"])
+        logger.info(f"Resumed ingestion job {job_id} ({len(committed_paths)} files already committed)")
+        return await self.job_model.get_job(job_id)
+
+    async def cancel_job(self, job_id: str) -> bool:
+        """
+        Request cancellation; the worker stops before its next image
+        """
+        return await self.job_model.request_cancel(job_id)
+
+    async def get_job_status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a job's progress along with its most recent failures
+        """
+        job = await self.job_model.get_job(job_id)
+        if not job:
+            return None
+
+        processed = job.get("committed_count", 0) + job.get("failed_count", 0)
+        total = job.get("total_images") or 0
+        job["progress_percentage"] = round(processed / total * 100, 1) if total else 0.0
+        job["is_running"] = job_id in self.running_tasks
+        job["recent_failures"] = await self.job_model.get_failed_checkpoints(job_id)
+        return job
+
+    def _launch(self, job_id: str, folder_path: str):
+        task = asyncio.create_task(self._run_job(job_id, folder_path))
+        self.running_tasks[job_id] = task
+        task.add_done_callback(lambda _: self.running_tasks.pop(job_id, None))
+
+    async def _run_job(self, job_id: str, folder_path: str):
+        """
+        Worker body: process the folder, checkpointing every flushed batch
+        """
+        try:
+            await self.job_model.update_job(job_id, {"status": "running", "started_at": datetime.utcnow()})
+            committed_paths = await self.job_model.get_committed_paths(job_id)
+
+            async def on_progress(committed, failed):
+                await self.job_model.record_checkpoints(job_id, committed, failed)
+
+            async def should_cancel():
+                return await self.job_model.is_cancel_requested(job_id)
+
+            result = await self.image_service.process_images_in_folder(
+                folder_path,
+                skip_paths=committed_paths,
+                on_progress=on_progress,
+                should_cancel=should_cancel,
+                batch_size=INGESTION_JOB_BATCH_SIZE,
+                job_id=job_id
+            )
+
+            await self.job_model.update_job(job_id, {
+                "status": "cancelled" if result.get("cancelled") else "completed",
+                "finished_at": datetime.utcnow(),
+                "result_summary": {
+                    "successfully_processed": result["successfully_processed"],
+                    "errors": result["errors"],
+                    "skipped_images": result["skipped_images"],
+                    "sellers_created": result["sellers_created"],
+                    "analysis_cache": result["analysis_cache"]
+                }
+            })
+            logger.info(f"Ingestion job {job_id} finished: {result['successfully_processed']} committed, {result['errors']} errors")
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {str(e)}")
+            try:
+                await self.job_model.update_job(job_id, {
+                    "status": "failed",
+                    "error": str(e),
+                    "finished_at": datetime.utcnow()
+                })
+            except Exception as update_error:
+                logger.error(f"Failed to record failure for job {job_id}: {str(update_error)}")
@@ -0,0 +1,132 @@
+import os
+import uuid
+import random
+import asyncio
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import Dict, Any, Optional
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Defaults for every provider; override per provider with PAYMENT_<PROVIDER>_<SETTING>
+PAYMENT_PROVIDER_TIMEOUT_SECONDS = float(os.getenv("PAYMENT_PROVIDER_TIMEOUT_SECONDS", 10))
+PAYMENT_PROVIDER_MAX_CONCURRENCY = int(os.getenv("PAYMENT_PROVIDER_MAX_CONCURRENCY", 50))
+PAYMENT_SIMULATED_LATENCY_SECONDS = float(os.getenv("PAYMENT_SIMULATED_LATENCY_SECONDS", 1.0))
+PAYMENT_SIMULATED_LATENCY_JITTER_SECONDS = float(os.getenv("PAYMENT_SIMULATED_LATENCY_JITTER_SECONDS", 0.5))
+PAYMENT_SIMULATED_FAILURE_RATE = float(os.getenv("PAYMENT_SIMULATED_FAILURE_RATE", 0.05))
+
+def generate_transaction_id() -> str:
+    """Generate a unique transaction ID"""
+    return f"TXN_{uuid.uuid4().hex[:16].upper()}"
+
+def _provider_setting(provider_name: str, setting: str, default: float) -> float:
+    return float(os.getenv(f"PAYMENT_{provider_name.upper()}_{setting}", default))
+
+class PaymentProviderAdapter(ABC):
+    """
+    Base class for payment providers. Subclasses implement charge(); callers
+    use process(), which enforces the provider's timeout and concurrency limit
+    and always returns a result dict with status "success" or "failed".
+    """
+    def __init__(self, name: str, timeout_seconds: float, max_concurrency: int):
+        self.name = name
+        self.timeout_seconds = timeout_seconds
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    @abstractmethod
+    async def charge(self, payment_method: str, amount: float) -> Dict[str, Any]:
+        """Charge the provider and return success() or failure()"""
+
+    async def process(self, payment_method: str, amount: float) -> Dict[str, Any]:
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(self.charge(payment_method, amount), timeout=self.timeout_seconds)
+            except asyncio.TimeoutError:
+                logger.warning(f"Payment provider {self.name} timed out after {self.timeout_seconds}s")
+                return self.failure(payment_method, "PROVIDER_TIMEOUT", f"Payment provider did not respond within {self.timeout_seconds} seconds")
+
+    def success(self, payment_method: str, transaction_id: str) -> Dict[str, Any]:
+        return {
+            "status": "success",
+            "transaction_id": transaction_id,
+            "provider_response": {
+                "payment_method": payment_method,
+                "provider": self.name,
+                "processed_at": datetime.utcnow().isoformat(),
+                "provider_transaction_id": transaction_id,
+                "provider_status": "completed"
+            }
+        }
+
+    def failure(self, payment_method: str, error_code: str, error_message: str) -> Dict[str, Any]:
+        return {
+            "status": "failed",
+            "transaction_id": None,
+            "provider_response": {
+                "payment_method": payment_method,
+                "provider": self.name,
+                "processed_at": datetime.utcnow().isoformat(),
+                "error_code": error_code,
+                "error_message": error_message
+            }
+        }
+
+class SimulatedPaymentProvider(PaymentProviderAdapter):
+    """
+    Provider stand-in that waits a random latency (mean ± uniform jitter)
+    without blocking the event loop and declines a fraction of payments
+    """
+    def __init__(
+        self,
+        name: str,
+        latency_seconds: float = PAYMENT_SIMULATED_LATENCY_SECONDS,
+        latency_jitter_seconds: float = PAYMENT_SIMULATED_LATENCY_JITTER_SECONDS,
+        failure_rate: float = PAYMENT_SIMULATED_FAILURE_RATE,
+        timeout_seconds: float = PAYMENT_PROVIDER_TIMEOUT_SECONDS,
+        max_concurrency: int = PAYMENT_PROVIDER_MAX_CONCURRENCY
+    ):
+        super().__init__(name, timeout_seconds, max_concurrency)
+        self.latency_seconds = latency_seconds
+        self.latency_jitter_seconds = latency_jitter_seconds
+        self.failure_rate = failure_rate
+
+    async def charge(self, payment_method: str, amount: float) -> Dict[str, Any]:
+        latency = self.latency_seconds + random.uniform(-self.latency_jitter_seconds, self.latency_jitter_seconds)
+        await asyncio.sleep(max(0.0, latency))
+
+        if random.random() < self.failure_rate:
+            return self.failure(payment_method, "PAYMENT_DECLINED", "Payment was declined by the provider")
+        return self.success(payment_method, generate_transaction_id())
+
+def create_simulated_provider(provider_name: str, **defaults) -> SimulatedPaymentProvider:
+    """Build a simulated provider, letting PAYMENT_<PROVIDER>_* variables override the defaults"""
+    return SimulatedPaymentProvider(
+        provider_name,
+        latency_seconds=_provider_setting(provider_name, "LATENCY_SECONDS", defaults.get("latency_seconds", PAYMENT_SIMULATED_LATENCY_SECONDS)),
+        latency_jitter_seconds=_provider_setting(provider_name, "LATENCY_JITTER_SECONDS", defaults.get("latency_jitter_seconds", PAYMENT_SIMULATED_LATENCY_JITTER_SECONDS)),
+        failure_rate=_provider_setting(provider_name, "FAILURE_RATE", defaults.get("failure_rate", PAYMENT_SIMULATED_FAILURE_RATE)),
+        timeout_seconds=_provider_setting(provider_name, "TIMEOUT_SECONDS", defaults.get("timeout_seconds", PAYMENT_PROVIDER_TIMEOUT_SECONDS)),
+        max_concurrency=int(_provider_setting(provider_name, "MAX_CONCURRENCY", defaults.get("max_concurrency", PAYMENT_PROVIDER_MAX_CONCURRENCY)))
+    )
+
+# One adapter per payment method value; swap in real integrations here
+payment_providers: Dict[str, PaymentProviderAdapter] = {
+    "gcash": create_simulated_provider("gcash"),
+    "paymaya": create_simulated_provider("paymaya"),
+    # Cash on delivery only records the order, so it settles almost immediately
+    "cash_on_delivery": create_simulated_provider(
+        "cash_on_delivery", latency_seconds=0.05, latency_jitter_seconds=0.0, failure_rate=0.0, timeout_seconds=2
+    )
+}
+
+def get_payment_provider(payment_method: str) -> Optional[PaymentProviderAdapter]:
+    """Look up the adapter for a payment method value"""
+    return payment_providers.get(payment_method)
@@ -0,0 +1,130 @@
+import os
+import random
+import asyncio
+from typing import Callable, Awaitable, Dict, Any, List, Optional, Set
+import logging
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAYMENT_QUEUE_WORKERS = int(os.getenv("PAYMENT_QUEUE_WORKERS", 4))
+PAYMENT_QUEUE_MAX_SIZE = int(os.getenv("PAYMENT_QUEUE_MAX_SIZE", 1000))
+PAYMENT_MAX_ATTEMPTS = int(os.getenv("PAYMENT_MAX_ATTEMPTS", 3))
+PAYMENT_RETRY_BASE_DELAY_SECONDS = float(os.getenv("PAYMENT_RETRY_BASE_DELAY_SECONDS", 1.0))
+# How often every process sweeps for payments abandoned by a crashed or restarted worker
+PAYMENT_RECOVERY_INTERVAL_SECONDS = float(os.getenv("PAYMENT_RECOVERY_INTERVAL_SECONDS", 60))
+
+class RetryablePaymentError(Exception):
+    """Raised by a payment handler when the attempt may succeed if retried"""
+    pass
+
+class PaymentWorkQueue:
+    """
+    In-process payment queue drained by a fixed pool of asyncio workers.
+    A handler that raises is retried with exponential backoff and jitter up to
+    max_attempts; after that on_give_up records the final failure. Call start()
+    from the application's startup hook: it needs the running event loop, and
+    it begins the periodic recover() sweep, which must return only payments it
+    has claimed for this process.
+    """
+    def __init__(
+        self,
+        handler: Callable[[str, int], Awaitable[None]],
+        on_give_up: Callable[[str, int, str], Awaitable[None]],
+        recover: Optional[Callable[[], List[str]]] = None,
+        recovery_interval_seconds: float = PAYMENT_RECOVERY_INTERVAL_SECONDS,
+        workers: int = PAYMENT_QUEUE_WORKERS,
+        max_size: int = PAYMENT_QUEUE_MAX_SIZE,
+        max_attempts: int = PAYMENT_MAX_ATTEMPTS,
+        base_delay_seconds: float = PAYMENT_RETRY_BASE_DELAY_SECONDS
+    ):
+        self.handler = handler
+        self.on_give_up = on_give_up
+        self.recover = recover
+        self.recovery_interval_seconds = recovery_interval_seconds
+        self.worker_count = workers
+        self.max_size = max_size
+        self.max_attempts = max_attempts
+        self.base_delay_seconds = base_delay_seconds
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+        self._recovery_task: Optional[asyncio.Task] = None
+        # Keep references to pending retries so they are not garbage collected
+        self._retry_tasks: Set[asyncio.Task] = set()
+        self._in_flight = 0
+
+    async def start(self):
+        """Start the workers and the recovery sweep (idempotent)"""
+        self._ensure_started()
+
+    def enqueue(self, payment_id: str, attempt: int = 1):
+        """Queue a payment for processing; raises asyncio.QueueFull when saturated"""
+        self._ensure_started()
+        self._queue.put_nowait((payment_id, attempt))
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": len(self._workers),
+            "queued": self._queue.qsize() if self._queue else 0,
+            "in_flight": self._in_flight,
+            "retries_scheduled": len(self._retry_tasks)
+        }
+
+    def _ensure_started(self):
+        if self._workers:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.worker_count)]
+        logger.info(f"Started {self.worker_count} payment workers")
+
+        # Pick up payments left behind by a restart, now and periodically
+        if self.recover:
+            self._recovery_task = asyncio.create_task(self._recovery_loop())
+
+    async def _recovery_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                # recover() uses blocking database calls, so keep it off the event loop
+                payment_ids = await loop.run_in_executor(None, self.recover)
+                for payment_id in payment_ids:
+                    # Already claimed for this process, so wait for room rather than drop it
+                    await self._queue.put((payment_id, 1))
+                if payment_ids:
+                    logger.info(f"Recovered {len(payment_ids)} abandoned payments")
+            except Exception as e:
+                logger.error(f"Failed to recover queued payments: {str(e)}")
+            await asyncio.sleep(self.recovery_interval_seconds)
+
+    async def _worker(self):
+        while True:
+            payment_id, attempt = await self._queue.get()
+            self._in_flight += 1
+            try:
+                await self.handler(payment_id, attempt)
+            except Exception as e:
+                if attempt < self.max_attempts:
+                    delay = self.base_delay_seconds * (2 ** (attempt - 1)) + random.uniform(0, self.base_delay_seconds)
+                    logger.warning(f"Payment {payment_id} attempt {attempt} failed ({str(e)}), retrying in {delay:.1f}s")
+                    task = asyncio.create_task(self._retry_after(delay, payment_id, attempt + 1))
+                    self._retry_tasks.add(task)
+                    task.add_done_callback(self._retry_tasks.discard)
+                else:
+                    logger.error(f"Payment {payment_id} failed after {attempt} attempts: {str(e)}")
+                    try:
+                        await self.on_give_up(payment_id, attempt, str(e))
+                    except Exception as give_up_error:
+                        logger.error(f"Failed to record failure for payment {payment_id}: {str(give_up_error)}")
+            finally:
+                self._in_flight -= 1
+                self._queue.task_done()
+
+    async def _retry_after(self, delay: float, payment_id: str, attempt: int):
+        await asyncio.sleep(delay)
+        # Retries wait for room rather than being dropped
+        await self._queue.put((payment_id, attempt))
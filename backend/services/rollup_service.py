@@ -0,0 +1,230 @@
+from datetime import datetime
+from typing import Dict, Any, List, Optional
+import logging
+from bson import ObjectId
+from pymongo import UpdateOne
+from models.payment import PaymentStatus
+
+logger = logging.getLogger(__name__)
+
+# Metrics stored in daily_rollups, one document per (date, metric, dimension)
+SIGNUPS = "signups"
+SELLER_SIGNUPS = "seller_signups"
+COMPLETED_REVENUE = "completed_revenue"
+COMPLETED_ORDERS = "completed_orders"
+CATEGORY_SALES = "category_sales"  # dimension: product category
+SELLER_SALES = "seller_sales"  # dimension: seller_id
+
+# Dimension for metrics that are not broken down
+ALL_DIMENSION = "all"
+UNKNOWN_DIMENSION = "unknown"
+
+ROLLUP_STATE_ID = "daily_rollups"
+# Rebuilds are written here and then renamed over daily_rollups
+ROLLUP_REBUILD_COLLECTION = "daily_rollups_rebuild"
+
+# Set once a rebuild has completed, so readers stop checking
+_rollups_ready = False
+
+def rollup_date(date: datetime) -> datetime:
+    """UTC day a timestamp is counted under"""
+    return date.replace(hour=0, minute=0, second=0, microsecond=0)
+
+def ensure_rollup_indexes(db, collection_name: str = "daily_rollups"):
+    # The unique key is also what $merge matches on during a rebuild
+    db[collection_name].create_index([("date", 1), ("metric", 1), ("dimension", 1)], unique=True)
+    db[collection_name].create_index([("metric", 1), ("dimension", 1), ("date", 1)])
+
+def rollup_increment(date: datetime, metric: str, dimension: str, value: float, quantity: Optional[int] = None) -> UpdateOne:
+    increments: Dict[str, Any] = {"value": value}
+    if quantity is not None:
+        increments["quantity"] = quantity
+    return UpdateOne(
+        {"date": rollup_date(date), "metric": metric, "dimension": dimension},
+        {"$inc": increments},
+        upsert=True
+    )
+
+def apply_rollup_increments(db, operations: List[UpdateOne]):
+    """
+    Write rollup increments in one round trip. Failures are logged rather
+    than raised: the rollups are derived data and a rebuild restores them.
+    """
+    if not operations:
+        return
+    try:
+        db.daily_rollups.bulk_write(operations, ordered=False)
+    except Exception as e:
+        logger.warning(f"Failed to update daily rollups: {str(e)}")
+
+def record_signup(db, created_at: datetime):
+    apply_rollup_increments(db, [rollup_increment(created_at, SIGNUPS, ALL_DIMENSION, 1)])
+
+def record_seller_signup(db, created_at: datetime):
+    apply_rollup_increments(db, [rollup_increment(created_at, SELLER_SIGNUPS, ALL_DIMENSION, 1)])
+
+def record_completed_payment(db, payment: Dict[str, Any], sign: int = 1):
+    """
+    Count a payment that just completed, under the day it was created.
+    Pass sign=-1 to take it back out when it leaves completed (e.g. a refund).
+    """
+    try:
+        created_at = payment["created_at"]
+        items = payment.get("items", [])
+
+        product_ids = [ObjectId(item["product_id"]) for item in items if ObjectId.is_valid(item.get("product_id", ""))]
+        products = {
+            str(product["_id"]): product
+            for product in db.products.find({"_id": {"$in": product_ids}}, {"category": 1, "seller_id": 1})
+        } if product_ids else {}
+
+        sales: Dict[tuple, Dict[str, float]] = {}
+        for item in items:
+            product = products.get(item.get("product_id"), {})
+            for metric, dimension in (
+                (CATEGORY_SALES, product.get("category") or UNKNOWN_DIMENSION),
+                (SELLER_SALES, str(product["seller_id"]) if product.get("seller_id") else UNKNOWN_DIMENSION)
+            ):
+                totals = sales.setdefault((metric, dimension), {"value": 0.0, "quantity": 0})
+                totals["value"] += sign * item.get("total_price", 0.0)
+                totals["quantity"] += sign * item.get("quantity", 0)
+
+        operations = [
+            rollup_increment(created_at, COMPLETED_REVENUE, ALL_DIMENSION, sign * payment.get("total_amount", 0.0)),
+            rollup_increment(created_at, COMPLETED_ORDERS, ALL_DIMENSION, sign)
+        ] + [
+            rollup_increment(created_at, metric, dimension, totals["value"], totals["quantity"])
+            for (metric, dimension), totals in sales.items()
+        ]
+    except Exception as e:
+        logger.warning(f"Failed to build rollups for payment {payment.get('payment_id')}: {str(e)}")
+        return
+
+    apply_rollup_increments(db, operations)
+
+def _day(field: str) -> Dict[str, Any]:
+    return {"$dateTrunc": {"date": field, "unit": "day"}}
+
+def _merge_into_rollups() -> Dict[str, Any]:
+    return {"$merge": {
+        "into": ROLLUP_REBUILD_COLLECTION,
+        "on": ["date", "metric", "dimension"],
+        "whenMatched": "replace",
+        "whenNotMatched": "insert"
+    }}
+
+def rebuild_daily_rollups(db) -> Dict[str, Any]:
+    """
+    Regenerate every rollup from users, sellers and payments. Each metric is
+    recomputed server-side into a scratch collection, which then replaces
+    daily_rollups in one rename, so rows with no remaining source data
+    disappear and readers never see a half-built set. Increments made while
+    a rebuild is running are lost and need the next rebuild.
+    """
+    started_at = datetime.utcnow()
+    db.drop_collection(ROLLUP_REBUILD_COLLECTION)
+    ensure_rollup_indexes(db, ROLLUP_REBUILD_COLLECTION)
+
+    for collection, metric in ((db.users, SIGNUPS), (db.sellers, SELLER_SIGNUPS)):
+        collection.aggregate([
+            {"$match": {"created_at": {"$type": "date"}}},
+            {"$group": {"_id": _day("$created_at"), "value": {"$sum": 1}}},
+            {"$project": {"_id": 0, "date": "$_id", "metric": {"$literal": metric}, "dimension": {"$literal": ALL_DIMENSION}, "value": 1}},
+            _merge_into_rollups()
+        ])
+
+    completed = {"$match": {"payment_status": PaymentStatus.COMPLETED.value, "created_at": {"$type": "date"}}}
+
+    # Revenue and order count per day, as two rollup rows per group
+    db.payments.aggregate([
+        completed,
+        {"$group": {"_id": _day("$created_at"), "revenue": {"$sum": "$total_amount"}, "orders": {"$sum": 1}}},
+        {"$project": {"_id": 0, "rows": [
+            {"date": "$_id", "metric": {"$literal": COMPLETED_REVENUE}, "dimension": {"$literal": ALL_DIMENSION}, "value": "$revenue"},
+            {"date": "$_id", "metric": {"$literal": COMPLETED_ORDERS}, "dimension": {"$literal": ALL_DIMENSION}, "value": "$orders"}
+        ]}},
+        {"$unwind": "$rows"},
+        {"$replaceWith": "$rows"},
+        _merge_into_rollups()
+    ])
+
+    # Item sales per category and per seller from one pass over the line items
+    db.payments.aggregate([
+        completed,
+        {"$unwind": "$items"},
+        {"$set": {"product_oid": {"$convert": {
+            "input": "$items.product_id", "to": "objectId", "onError": None, "onNull": None
+        }}}},
+        {"$lookup": {
+            "from": "products",
+            "localField": "product_oid",
+            "foreignField": "_id",
+            "pipeline": [{"$project": {"category": 1, "seller_id": 1}}],
+            "as": "product"
+        }},
+        {"$set": {"product": {"$first": "$product"}}},
+        {"$group": {
+            "_id": {
+                "date": _day("$created_at"),
+                "category": {"$ifNull": ["$product.category", UNKNOWN_DIMENSION]},
+                "seller_id": {"$ifNull": [{"$toString": "$product.seller_id"}, UNKNOWN_DIMENSION]}
+            },
+            "value": {"$sum": "$items.total_price"},
+            "quantity": {"$sum": "$items.quantity"}
+        }},
+        {"$project": {"_id": 0, "rows": [
+            {"date": "$_id.date", "metric": {"$literal": CATEGORY_SALES}, "dimension": "$_id.category", "value": "$value", "quantity": "$quantity"},
+            {"date": "$_id.date", "metric": {"$literal": SELLER_SALES}, "dimension": "$_id.seller_id", "value": "$value", "quantity": "$quantity"}
+        ]}},
+        {"$unwind": "$rows"},
+        {"$group": {
+            "_id": {"date": "$rows.date", "metric": "$rows.metric", "dimension": "$rows.dimension"},
+            "value": {"$sum": "$rows.value"},
+            "quantity": {"$sum": "$rows.quantity"}
+        }},
+        {"$project": {"_id": 0, "date": "$_id.date", "metric": "$_id.metric", "dimension": "$_id.dimension", "value": 1, "quantity": 1}},
+        _merge_into_rollups()
+    ])
+
+    db[ROLLUP_REBUILD_COLLECTION].rename("daily_rollups", dropTarget=True)
+
+    completed_at = datetime.utcnow()
+    db.rollup_state.update_one(
+        {"_id": ROLLUP_STATE_ID},
+        {"$set": {"started_at": started_at, "completed_at": completed_at}},
+        upsert=True
+    )
+    logger.info(f"Rebuilt daily rollups in {(completed_at - started_at).total_seconds():.1f}s")
+    return {"started_at": started_at.isoformat(), "completed_at": completed_at.isoformat()}
+
+def rollups_ready(db) -> bool:
+    """True once a rebuild has backfilled history; until then readers use the raw collections"""
+    global _rollups_ready
+    if not _rollups_ready:
+        try:
+            _rollups_ready = db.rollup_state.find_one({"_id": ROLLUP_STATE_ID, "completed_at": {"$exists": True}}) is not None
+        except Exception as e:
+            logger.warning(f"Could not read rollup state: {str(e)}")
+    return _rollups_ready
+
+def rollup_totals_by_bucket(
+    db, metric: str, start_date: datetime, end_date: datetime,
+    bucket: str, bin_size: int = 1, dimension: str = ALL_DIMENSION
+) -> Dict[datetime, float]:
+    """Sum a metric's daily values in [start_date, end_date) into UTC $dateTrunc buckets"""
+    results = db.daily_rollups.aggregate([
+        {"$match": {"metric": metric, "dimension": dimension, "date": {"$gte": start_date, "$lt": end_date}}},
+        {"$group": {
+            "_id": {"$dateTrunc": {"date": "$date", "unit": bucket, "binSize": bin_size, "startOfWeek": "monday"}},
+            "value": {"$sum": "$value"}
+        }}
+    ])
+    return {result["_id"]: result["value"] for result in results}
+
+def rollup_totals_by_dimension(db, metric: str, start_date: datetime, end_date: datetime) -> List[Dict[str, Any]]:
+    """Totals per dimension (category or seller) in [start_date, end_date), largest first"""
+    return list(db.daily_rollups.aggregate([
+        {"$match": {"metric": metric, "date": {"$gte": start_date, "$lt": end_date}}},
+        {"$group": {"_id": "$dimension", "value": {"$sum": "$value"}, "quantity": {"$sum": "$quantity"}}},
+        {"$sort": {"value": -1}}
+    ]))
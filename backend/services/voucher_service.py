@@ -0,0 +1,383 @@
+from connection.database import discounts_collection, users_collection, voucher_assignments_collection
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Optional, Iterable
+from itertools import islice
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import random
+import string
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Global distributions insert one assignment per user, in batches of this size
+ASSIGNMENT_BATCH_SIZE = 1000
+
+# Collisions are rare (36^8 codes), so a few rounds of regeneration is plenty
+CODE_GENERATION_MAX_ROUNDS = 10
+
+# A claim older than this is treated as abandoned (e.g. the worker crashed mid-grant)
+WELCOME_VOUCHER_CLAIM_TIMEOUT = timedelta(minutes=10)
+
+VALID_PERCENTAGES = [5, 10, 15, 20, 25, 30, 35, 40, 45, 50]
+
+# Enhanced discount types with voucher categories
+CLOTHES_TEMPLATES = [
+    {
+        "type": "Summer Sale",
+        "description": "Beat the heat with summer savings",
+        "detailed": "Get amazing discounts on summer collection including light fabrics, swimwear, and casual outfits."
+    },
+    {
+        "type": "Winter Clearance",
+        "description": "Warm up with winter deals",
+        "detailed": "Stay cozy with discounts on winter essentials including jackets, sweaters, boots, and thermal wear."
+    },
+    {
+        "type": "Flash Sale",
+        "description": "Lightning fast clothing savings",
+        "detailed": "Limited time flash sale on trending fashion items. Grab your favorite clothes before they're gone!"
+    },
+    {
+        "type": "New Arrival",
+        "description": "Fresh fashion discounts",
+        "detailed": "Be the first to wear the latest fashion trends with special discounts on new arrivals."
+    }
+]
+
+SHIPPING_TEMPLATES = [
+    {
+        "type": "Free Shipping",
+        "description": "Free delivery on your order",
+        "detailed": "Enjoy free shipping on your clothing purchases. No minimum order required."
+    },
+    {
+        "type": "Express Delivery",
+        "description": "Discounted express shipping",
+        "detailed": "Get your fashion items faster with discounted express delivery options."
+    },
+    {
+        "type": "Shipping Special",
+        "description": "Special shipping discount",
+        "detailed": "Save on shipping costs for your fashion purchases with this special voucher."
+    }
+]
+
+def new_assignment(
+    username: str,
+    voucher: Dict[str, Any],
+    assigned_by: Optional[str] = None,
+    assignment_type: Optional[str] = None,
+    **extra
+) -> Dict[str, Any]:
+    """Build a voucher_assignments document for one user and discount"""
+    now = datetime.utcnow()
+    return {
+        "username": username,
+        "code": voucher["code"],
+        "discount_id": voucher["_id"],
+        "collected_at": now,
+        "assigned_at": now,
+        "assigned_by": assigned_by,
+        "assignment_type": assignment_type,
+        "is_used": False,
+        "used_at": None,
+        **extra
+    }
+
+def insert_assignments(assignments: Iterable[Dict[str, Any]]) -> int:
+    """
+    Insert assignments in batches, skipping users who already hold the
+    voucher. Returns the number of new assignments.
+    """
+    inserted = 0
+    assignments = iter(assignments)
+    while True:
+        batch = list(islice(assignments, ASSIGNMENT_BATCH_SIZE))
+        if not batch:
+            break
+        try:
+            inserted += len(voucher_assignments_collection.insert_many(batch, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            # Duplicate (username, code) pairs are expected; anything else is a real failure
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            inserted += e.details.get("nInserted", 0)
+    return inserted
+
+def bulk_assign_vouchers(
+    username: str,
+    vouchers: List[Dict[str, Any]],
+    assigned_by: Optional[str] = None,
+    assignment_type: Optional[str] = None,
+    replace_existing: bool = False
+) -> List[Dict[str, Any]]:
+    """
+    Assign several vouchers to a user with one bulk_write of upserts.
+    Vouchers the user already holds are left alone unless replace_existing
+    is set. Returns the vouchers whose assignment was written.
+    """
+    if not vouchers:
+        return []
+
+    operator = "$set" if replace_existing else "$setOnInsert"
+    operations = [
+        UpdateOne(
+            {"username": username, "code": voucher["code"]},
+            {operator: new_assignment(username, voucher, assigned_by, assignment_type)},
+            upsert=True
+        )
+        for voucher in vouchers
+    ]
+
+    try:
+        result = voucher_assignments_collection.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        # A concurrent upsert of the same (username, code) loses on the unique index
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+        result = e.details
+
+    if replace_existing:
+        failed = {error["index"] for error in result.get("writeErrors", [])}
+        return [voucher for index, voucher in enumerate(vouchers) if index not in failed]
+    return [vouchers[upserted["index"]] for upserted in result.get("upserted", [])]
+
+def find_user_vouchers(username: str, active_only: bool = False) -> List[tuple]:
+    """(assignment, discount) pairs for a user, read through the (username, code) index"""
+    assignments = list(voucher_assignments_collection.find({"username": username}))
+    if not assignments:
+        return []
+
+    discount_query: Dict[str, Any] = {"code": {"$in": [assignment["code"] for assignment in assignments]}}
+    if active_only:
+        discount_query["is_active"] = True
+    discounts = {discount["code"]: discount for discount in discounts_collection.find(discount_query)}
+
+    return [
+        (assignment, discounts[assignment["code"]])
+        for assignment in assignments
+        if assignment["code"] in discounts
+    ]
+
+def migrate_embedded_assignments() -> int:
+    """
+    Move user_assignments arrays embedded in discount documents into
+    voucher_assignments. Safe to re-run: existing assignments are kept and
+    the arrays are only removed once copied. Returns the discounts migrated.
+    """
+    pending = {"user_assignments.0": {"$exists": True}}
+    migrated = discounts_collection.count_documents(pending)
+    if not migrated:
+        return 0
+
+    discounts_collection.aggregate([
+        {"$match": pending},
+        {"$unwind": "$user_assignments"},
+        # Older grants could list a user twice; keep the used entry if there is one
+        {"$sort": {"user_assignments.is_used": -1}},
+        {"$group": {
+            "_id": {"username": "$user_assignments.username", "code": "$code"},
+            "discount_id": {"$first": "$_id"},
+            "assignment": {"$first": "$user_assignments"}
+        }},
+        {"$replaceWith": {"$mergeObjects": [
+            "$assignment",
+            {"username": "$_id.username", "code": "$_id.code", "discount_id": "$discount_id"}
+        ]}},
+        {"$unset": "discount_code"},
+        {"$merge": {
+            "into": "voucher_assignments",
+            "on": ["username", "code"],
+            "whenMatched": "keepExisting",
+            "whenNotMatched": "insert"
+        }}
+    ])
+    discounts_collection.update_many(pending, {"$unset": {"user_assignments": ""}})
+
+    logger.info(f"Migrated embedded voucher assignments from {migrated} discounts")
+    return migrated
+
+try:
+    discounts_collection.create_index("code", unique=True)
+except Exception as e:
+    logger.warning(f"Could not create unique discount code index: {str(e)}")
+
+try:
+    voucher_assignments_collection.create_index([("username", 1), ("code", 1)], unique=True)
+    voucher_assignments_collection.create_index([("code", 1), ("is_used", 1)])
+    migrate_embedded_assignments()
+except Exception as e:
+    logger.warning(f"Could not prepare voucher assignments: {str(e)}")
+
+def generate_discount_code(length: int = 8) -> str:
+    """Generate a random discount code"""
+    characters = string.ascii_uppercase + string.digits
+    return ''.join(random.choice(characters) for _ in range(length))
+
+def build_discount(voucher_type: str) -> Dict[str, Any]:
+    """Random discount document of the given type, without a code"""
+    percentage = random.choice(VALID_PERCENTAGES)
+    templates = CLOTHES_TEMPLATES if voucher_type == "clothes" else SHIPPING_TEMPLATES
+    template = random.choice(templates)
+
+    short_description = f"{template['type']} - {percentage}% off"
+    detailed_description = f"{template['description']} - {percentage}% discount. {template['detailed']}"
+
+    expires_days = random.randint(30, 90)
+    expires_at = datetime.utcnow() + timedelta(days=expires_days)
+    usage_limit = random.choice([None, 50, 100, 200, 500])
+
+    return {
+        "percentage": percentage,
+        "description": short_description,
+        "detailed_description": detailed_description,
+        "is_active": True,
+        "created_at": datetime.utcnow(),
+        "expires_at": expires_at,
+        "usage_limit": usage_limit,
+        "used_count": 0,
+        "voucher_type": voucher_type
+    }
+
+def insert_discounts_with_unique_codes(discounts: List[Dict[str, Any]]):
+    """
+    Give each discount a random code and insert them with insert_many.
+    The unique index on code rejects collisions with existing discounts;
+    only those documents get a new code and are inserted again.
+    """
+    pending = discounts
+    for _ in range(CODE_GENERATION_MAX_ROUNDS):
+        # Codes are also kept unique within the batch itself
+        codes = set()
+        for discount in pending:
+            code = generate_discount_code()
+            while code in codes:
+                code = generate_discount_code()
+            codes.add(code)
+            discount["code"] = code
+
+        try:
+            discounts_collection.insert_many(pending, ordered=False)
+            return
+        except BulkWriteError as e:
+            write_errors = e.details.get("writeErrors", [])
+            if any(error.get("code") != 11000 for error in write_errors):
+                raise
+            pending = [pending[error["index"]] for error in write_errors]
+            logger.info(f"Regenerating {len(pending)} colliding discount codes")
+
+    raise RuntimeError(f"Could not generate unique codes for {len(pending)} discounts")
+
+def generate_discounts(count: int = 20, assign_to_all_users: bool = True) -> Dict[str, Any]:
+    """Generate random discount codes (70% clothes, 30% shipping) and optionally assign them to all users"""
+    clothes_count = round(count * 0.7)
+    discounts_created = [
+        build_discount("clothes" if i < clothes_count else "shipping")
+        for i in range(count)
+    ]
+    insert_discounts_with_unique_codes(discounts_created)
+
+    if not assign_to_all_users:
+        return {"discounts": discounts_created, "total_users": 0, "total_assignments": 0}
+
+    # Get all existing users
+    all_users = list(users_collection.find({}, {"username": 1, "_id": 0}))
+
+    # Assign every new discount to all existing users
+    total_assignments = insert_assignments(
+        new_assignment(user["username"], discount, "system_auto_assign", "global_distribution")
+        for discount in discounts_created
+        for user in all_users
+    )
+
+    return {
+        "discounts": discounts_created,
+        "total_users": len(all_users),
+        "total_assignments": total_assignments
+    }
+
+def grant_welcome_vouchers(username: str) -> Dict[str, Any]:
+    """
+    Generate and assign the first-login welcome vouchers for a user.
+    Idempotent per username: the grant is claimed atomically on the user
+    document, so concurrent or repeated calls assign vouchers at most once.
+    """
+    now = datetime.utcnow()
+    claimed_user = users_collection.find_one_and_update(
+        {
+            "username": username,
+            "welcome_vouchers_assigned": {"$ne": True},
+            "$or": [
+                {"welcome_vouchers_claimed_at": None},
+                {"welcome_vouchers_claimed_at": {"$lt": now - WELCOME_VOUCHER_CLAIM_TIMEOUT}}
+            ]
+        },
+        {"$set": {"welcome_vouchers_claimed_at": now}}
+    )
+
+    if not claimed_user:
+        user = users_collection.find_one({"username": username}, {"welcome_vouchers_assigned": 1})
+        if not user:
+            raise LookupError(f"User {username} not found")
+        return {
+            "message": f"User {username} has already received their welcome vouchers",
+            "assigned_count": 0,
+            "vouchers": []
+        }
+
+    try:
+        # Check if user already has any vouchers assigned (extra safety check)
+        existing_vouchers_count = voucher_assignments_collection.count_documents({"username": username})
+
+        if existing_vouchers_count:
+            users_collection.update_one(
+                {"username": username},
+                {"$set": {"welcome_vouchers_assigned": True}, "$unset": {"welcome_vouchers_claimed_at": ""}}
+            )
+            return {
+                "message": f"User {username} already has vouchers assigned",
+                "existing_vouchers_count": existing_vouchers_count,
+                "assigned_count": 0,
+                "vouchers": []
+            }
+
+        # Generate 20 new vouchers for this user only
+        generated_vouchers = generate_discounts(assign_to_all_users=False)["discounts"]
+
+        # Auto-assign all generated vouchers to the user
+        assigned_vouchers: List[Dict[str, Any]] = [
+            {
+                "code": voucher["code"],
+                "percentage": voucher["percentage"],
+                "description": voucher["description"],
+                "voucher_type": voucher.get("voucher_type", "clothes")
+            }
+            for voucher in bulk_assign_vouchers(username, generated_vouchers, "system", "welcome_bonus")
+        ]
+
+        users_collection.update_one(
+            {"username": username},
+            {"$set": {"welcome_vouchers_assigned": True}, "$unset": {"welcome_vouchers_claimed_at": ""}}
+        )
+
+        logger.info(f"Assigned {len(assigned_vouchers)} welcome vouchers to {username}")
+        return {
+            "message": f"Successfully auto-assigned {len(assigned_vouchers)} welcome vouchers to user {username}",
+            "assigned_count": len(assigned_vouchers),
+            "vouchers": assigned_vouchers
+        }
+    except Exception:
+        # Release the claim so the next login can retry
+        users_collection.update_one(
+            {"username": username},
+            {"$unset": {"welcome_vouchers_claimed_at": ""}}
+        )
+        raise
+
+def grant_welcome_vouchers_in_background(username: str):
+    """Background-task entry point: log failures instead of raising"""
+    try:
+        grant_welcome_vouchers(username)
+    except Exception as e:
+        logger.error(f"Failed to grant welcome vouchers to {username}: {str(e)}")
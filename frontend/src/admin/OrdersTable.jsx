@@ -36,7 +36,9 @@ const OrdersTable = () => {
   const [orders, setOrders] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
-  const { user, logout } = useAuth();
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
+  const { user, logout, token } = useAuth();
   const navigate = useNavigate();
 
   const handleLogout = () => {
@@ -44,15 +46,26 @@ const OrdersTable = () => {
     navigate("/");
   };
 
+  // The endpoint is paginated: load the first page, then more on demand via next_cursor
+  const fetchOrdersPage = async (cursor) => {
+    const response = await axios.get("http://localhost:8000/api/v1/admin/orders", {
+      params: cursor ? { cursor } : {},
+      headers: {
+        Authorization: `Bearer ${token}`,
+      },
+    });
+    const pageOrders = (response.data.orders || []).map((order) => ({
+      ...order,
+      payment_details: order.payment_details || {}, // Ensure payment_details exists
+    }));
+    setNextCursor(response.data.next_cursor || null);
+    return pageOrders;
+  };
+
   useEffect(() => {
     const fetchOrders = async () => {
       try {
-        const response = await axios.get("http://localhost:8000/api/v1/admin/orders");
-        const updatedOrders = response.data.orders.map((order) => ({
-          ...order,
-          payment_details: order.payment_details || {}, // Ensure payment_details exists
-        }));
-        setOrders(updatedOrders);
+        setOrders(await fetchOrdersPage(null));
         setLoading(false);
       } catch (err) {
         setError("Failed to fetch orders.");
@@ -61,7 +74,20 @@ const OrdersTable = () => {
     };
 
     fetchOrders();
-  }, []);
+  }, [token]);
+
+  const loadMoreOrders = async () => {
+    if (!nextCursor) return;
+    setLoadingMore(true);
+    try {
+      const pageOrders = await fetchOrdersPage(nextCursor);
+      setOrders((prevOrders) => [...prevOrders, ...pageOrders]);
+    } catch (err) {
+      alert("Failed to load more orders.");
+    } finally {
+      setLoadingMore(false);
+    }
+  };
 
   const handleStatusChange = (event, paymentId) => {
     const newStatus = event.target.value;
@@ -89,6 +115,10 @@ const OrdersTable = () => {
       await axios.put(`http://localhost:8000/api/v1/admin/update-payment-status/${paymentId}`, {
         status: updatedOrder.payment_status,
         reason: updatedOrder.reason,
+      }, {
+        headers: {
+          Authorization: `Bearer ${token}`,
+        },
       });
       alert("Status updated successfully.");
     } catch (err) {
@@ -773,6 +803,29 @@ const OrdersTable = () => {
               </TableBody>
             </Table>
           </TableContainer>
+          {nextCursor && (
+            <Box display="flex" justifyContent="center" mt={3}>
+              <Button
+                variant="contained"
+                onClick={loadMoreOrders}
+                disabled={loadingMore}
+                sx={{
+                  backgroundColor: "#8fa876",
+                  color: "#ffffff",
+                  "&:hover": {
+                    backgroundColor: "#7a956a",
+                  },
+                  px: 4,
+                  py: 1,
+                  borderRadius: "25px",
+                  fontWeight: 600,
+                  textTransform: "none",
+                }}
+              >
+                {loadingMore ? "Loading..." : "Load more orders"}
+              </Button>
+            </Box>
+          )}
         </Box>
       </Box>
     </>